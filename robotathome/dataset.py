@@ -9,7 +9,9 @@ __copyright__ = "Copyright 2020, 2021, Gregorio Ambrosio Cestero"
 __date__ = "2021/02/03"
 __license__ = "MIT"
 
-import version
+from robotathome import version
+from robotathome.helpers import label_masks_stats
+from robotathome.log import logger
 import os
 import hashlib
 import humanize
@@ -23,9 +25,54 @@ from urllib.request import urlretrieve
 from urllib.request import urlopen
 import cgi
 import io
+import gc
+import mmap
+import pickle
+import multiprocessing
+import concurrent.futures
+import functools
 #import progressbar
 # from memory_profiler import profile
 
+class NamedList(list):
+    """
+    A list of items that have a name attribute. The name index returned by
+    as_dict_name is built on first use and dropped whenever the list changes
+    """
+
+    __index = None
+
+    def get_names(self):
+        return [item.name for item in self]
+
+    def as_dict_name(self):
+        """
+        Returns a (cached) dictionary of the items by name, which must not be
+        modified
+        """
+        if self.__index is None:
+            self.__index = {item.name: item for item in self}
+        return self.__index
+
+
+def _drops_name_index(method):
+    """
+    Wraps a list method so that it drops the NamedList name index
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        self._NamedList__index = None
+        return method(self, *args, **kwargs)
+    return wrapper
+
+
+for _method_name in ('__setitem__', '__delitem__', '__iadd__', '__imul__',
+                     'append', 'extend', 'insert', 'pop', 'remove', 'clear',
+                     'sort', 'reverse'):
+    setattr(NamedList, _method_name,
+            _drops_name_index(getattr(list, _method_name)))
+
+
 class Dataset():
 
     class DatasetUnit():
@@ -34,6 +81,9 @@ class Dataset():
         A plain text Robot@Home dataset
         """
 
+        # Attributes set by _load_function, i.e. the ones kept in snapshots
+        _loaded_attributes = ()
+
         def __init__(self,
                      name = "",
                      path = "",
@@ -52,6 +102,9 @@ class Dataset():
             expected_hash_code : the hash code the downloaded unit must have
             expected_size      : the number of bytes the downloaded copy must
                                  have
+            snapshot_path      : folder where the parsed data is cached (see
+                                 save_snapshot), None (default) to disable
+                                 it
             """
 
             self.name = name
@@ -59,6 +112,7 @@ class Dataset():
             self.url = url
             self.expected_hash_code = expected_hash_code
             self.expected_size = expected_size
+            self.snapshot_path = None
             self.__data_loaded__ = False
 
         def __repr__(self):
@@ -276,6 +330,145 @@ class Dataset():
                                              hexdigest()) for fn in filenames)
             return hashfunc(index.encode('utf-8')).hexdigest()
 
+        def __iter_file_stats(self, path):
+            """
+            Yields (path, size, modification time) of every file under path
+            """
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.is_dir():
+                        yield from self.__iter_file_stats(entry.path)
+                    else:
+                        stat = entry.stat()
+                        yield entry.path, stat.st_size, stat.st_mtime_ns
+
+        def get_fingerprint(self):
+            """
+            Returns a hash of the unit path and the relative path, size and
+            modification time of every file under it. File contents are not
+            read, so it is cheap enough to be computed at every load
+            """
+            hasher = hashlib.sha1(self.path.encode('utf-8'))
+            for path, size, mtime in sorted(self.__iter_file_stats(self.path)):
+                hasher.update('{}={}:{}\n'.format(os.path.relpath(path, self.path),
+                                                  size, mtime).encode('utf-8'))
+            return hasher.hexdigest()
+
+        def get_snapshot_file_name(self, fingerprint):
+            """
+            Returns the path file name of the snapshot of a fingerprint
+            """
+            return os.path.join(self.snapshot_path,
+                                os.path.basename(self.path) + '-' +
+                                fingerprint[:16] + '.pkl')
+
+        def save_snapshot(self, fingerprint):
+            """
+            Saves the attributes set by _load_function (_loaded_attributes)
+            to a binary snapshot. NumPy arrays are stored out of band (pickle
+            protocol 5) in a .bin file next to it, so they can be memory
+            mapped when loaded. Snapshots of previous fingerprints are removed
+
+            Snapshots are plain pickles: loading one can run arbitrary code,
+            so snapshot_path must be a folder only trusted users can write
+            """
+            snapshot_file_name = self.get_snapshot_file_name(fingerprint)
+            os.makedirs(self.snapshot_path, exist_ok=True)
+            buffers = []
+            state = pickle.dumps({name: getattr(self, name)
+                                  for name in self._loaded_attributes},
+                                 protocol=5,
+                                 buffer_callback=buffers.append)
+            # Buffers are 64 bytes aligned
+            spans = []
+            offset = 0
+            buffers_file_name = snapshot_file_name[:-4] + '.bin'
+            with open(buffers_file_name + '.part', 'wb') as file_handler:
+                for buffer in buffers:
+                    data = buffer.raw()
+                    file_handler.write(b'\0' * (-offset % 64))
+                    offset += -offset % 64
+                    file_handler.write(data)
+                    spans.append((offset, data.nbytes))
+                    offset += data.nbytes
+            with open(snapshot_file_name + '.part', 'wb') as file_handler:
+                pickle.dump(spans, file_handler, protocol=5)
+                file_handler.write(state)
+            # The .pkl file is renamed the last one, so an incomplete snapshot
+            # is never found
+            os.replace(buffers_file_name + '.part', buffers_file_name)
+            os.replace(snapshot_file_name + '.part', snapshot_file_name)
+            prefix = os.path.basename(self.path) + '-'
+            for file_name in os.listdir(self.snapshot_path):
+                key, _, extension = file_name[len(prefix):].partition('.')
+                if (file_name.startswith(prefix) and len(key) == 16 and
+                        key != fingerprint[:16] and extension in ('pkl', 'bin')):
+                    os.remove(os.path.join(self.snapshot_path, file_name))
+            return snapshot_file_name
+
+        def load_snapshot(self, fingerprint):
+            """
+            Sets the attributes saved in the snapshot of a fingerprint. NumPy
+            arrays are copy on write views of the memory mapped .bin file.
+            Snapshots are unpickled, so they must come from a trusted source
+            (see save_snapshot)
+
+            Returns
+            -------
+            True if the snapshot exists and it was loaded, False otherwise
+            """
+            snapshot_file_name = self.get_snapshot_file_name(fingerprint)
+            if not os.path.isfile(snapshot_file_name):
+                return False
+            with open(snapshot_file_name, 'rb') as file_handler:
+                spans = pickle.load(file_handler)
+                state = file_handler.read()
+            buffers_file_name = snapshot_file_name[:-4] + '.bin'
+            # An empty file can't be mapped
+            memory = memoryview(bytearray(0))
+            if os.path.getsize(buffers_file_name) > 0:
+                with open(buffers_file_name, 'rb') as file_handler:
+                    memory = memoryview(mmap.mmap(file_handler.fileno(), 0,
+                                                  access=mmap.ACCESS_COPY))
+            buffers = [memory[offset:offset + size] for offset, size in spans]
+            # Unpickling creates a lot of objects and none of them is garbage,
+            # so the collector is paused meanwhile
+            gc_enabled = gc.isenabled()
+            gc.disable()
+            try:
+                attributes = pickle.loads(state, buffers=buffers)
+            finally:
+                if gc_enabled:
+                    gc.enable()
+            for name, value in attributes.items():
+                setattr(self, name, value)
+            return True
+
+        def __try_load_snapshot(self, fingerprint):
+            """
+            A missing or unreadable snapshot just means parsing the files
+            """
+            if fingerprint is None:
+                return False
+            try:
+                if self.load_snapshot(fingerprint):
+                    print("Loaded from snapshot: " + self.get_snapshot_file_name(fingerprint))
+                    return True
+            except Exception as err:
+                print("The snapshot couldn't be loaded: ", repr(err))
+            return False
+
+        def __try_save_snapshot(self, fingerprint):
+            """
+            Data is already loaded, so a failure is reported but not raised
+            """
+            if fingerprint is None:
+                return
+            try:
+                print("Saving snapshot: " + self.save_snapshot(fingerprint))
+            except Exception as err:
+                print("The snapshot couldn't be saved: ", repr(err))
+
         def is_loaded(self):
             return self.__data_loaded__
 
@@ -288,7 +481,12 @@ class Dataset():
             while True:
                 try:
                     print("Trying to load data from: " + self.path)
-                    self._load_function()  # this function must be defined in child class
+                    fingerprint = None
+                    if self.snapshot_path is not None:
+                        fingerprint = self.get_fingerprint()
+                    if not self.__try_load_snapshot(fingerprint):
+                        self._load_function()  # this function must be defined in child class
+                        self.__try_save_snapshot(fingerprint)
                     print("Success ! Now data is loaded in memory. Use the API to access data")
                     self.__data_loaded__ = True
                     return self.__data_loaded__
@@ -459,6 +657,8 @@ class Dataset():
                 return new_dict
 
         class Object():
+            __slots__ = ('id', 'name', 'type_id', 'type_name', 'room_id', 'features')
+
             def __init__(self, id, name, type_id, type_name, room_id, features):
                 self.id = id
                 self.name = name
@@ -567,6 +767,10 @@ class Dataset():
             31 :<saturation-histogram(4)>
             """
 
+            __slots__ = ()
+
+            num_features = 32
+
             keys = ['planarity',
                     'scatter',
                     'linearity',
@@ -625,6 +829,9 @@ class Dataset():
                 return new_dict
 
         class ObjectRelation():
+            __slots__ = ('id', 'obj1_id', 'obj1_name', 'obj1_type',
+                         'obj2_id', 'obj2_name', 'obj2_type', 'features')
+
             def __init__(self, id,
                          obj1_id, obj1_name, obj1_type,
                          obj2_id, obj2_name, obj2_type,
@@ -736,6 +943,10 @@ class Dataset():
             10 : <abs-value-mean-diff>
             """
 
+            __slots__ = ()
+
+            num_features = 11
+
             keys = ['minimum-distance',
                     'perpendicularity',
                     'vertical-distance',
@@ -776,6 +987,9 @@ class Dataset():
                 return new_dict
 
         class Observation():
+            __slots__ = ('id', 'sensor_name', 'objects_id', 'features',
+                         'scan_features')
+
             def __init__(self,
                          id,
                          sensor_name,
@@ -892,6 +1106,10 @@ class Dataset():
                 8 : <scatter>
             """
 
+            __slots__ = ()
+
+            num_features = 48
+
             keys = ['mean-hue',
                     'mean-saturation',
                     'mean-value',
@@ -975,6 +1193,10 @@ class Dataset():
                 7 : <linearity>
                 8 : <scatter>
             """
+            __slots__ = ()
+
+            num_features = 9
+
             keys = ['area',
                     'elongation',
                     'mean-distance',
@@ -1009,6 +1231,141 @@ class Dataset():
                 new_dict = dict(zip_obj)
                 return new_dict
 
+        class FeatureMatrix():
+            """
+            Float32 features of a kind of element (objects, relations,
+            observations or observation scans) of every home, one row per
+            element. Rows are grouped by room, i.e. the rows of the i-th room
+            are room_offsets[i]:room_offsets[i+1], so per room matrices are
+            views, not copies.
+
+            Attributes
+            ----------
+            columns: feature names, one per column (grouped features like
+                     histograms are expanded as <name>(<bin>))
+            values: float32 array (num_of_elements x num_of_features)
+            ids: int64 array with the element ids
+            room_index: int64 array with the position of the room of every
+                        element in the unit rooms list
+            home_index: int64 array with the home session id of every element
+            room_offsets: int64 array with the first row of every room and the
+                          number of rows as last item
+            """
+
+            __slots__ = ('columns', 'values', 'ids', 'room_index',
+                         'home_index', 'room_offsets')
+
+            def __init__(self, columns, values, ids, room_index, home_index,
+                         room_offsets):
+                self.columns = columns
+                self.values = values
+                self.ids = ids
+                self.room_index = room_index
+                self.home_index = home_index
+                self.room_offsets = room_offsets
+
+            def __len__(self):
+                return len(self.values)
+
+            def __repr__(self):
+                s = "<FeatureMatrix instance (" + str(len(self)) + " x " + \
+                    str(len(self.columns)) + ")>"
+                return s
+
+            @staticmethod
+            def get_columns(feature_class):
+                """
+                Returns the column names of a feature list class (e.g.
+                ObjectFeatures) following the layout of its as_dict()
+                """
+                features = feature_class()
+                features += [str(i) for i in range(feature_class.num_features)]
+                columns = [''] * feature_class.num_features
+                for key, value in features.as_dict().items():
+                    if isinstance(value, list):
+                        for bin, i in enumerate(value):
+                            columns[int(i)] = key + "(" + str(bin) + ")"
+                    else:
+                        columns[int(value)] = key
+                return columns
+
+            @classmethod
+            def from_rooms(cls, rooms, elements, features, feature_class):
+                """
+                Builds the feature matrix of the elements of a list of rooms
+
+                Parameters
+                ----------
+                rooms: list of Room instances
+                elements: name of the room attribute with the elements, i.e.
+                          'objects', 'relations' or 'observations'
+                features: name of the element attribute with the feature list,
+                          i.e. 'features' or 'scan_features'
+                feature_class: class of the feature list, e.g. ObjectFeatures
+
+                Returns
+                -------
+                A FeatureMatrix instance
+                """
+                counts = np.array([len(getattr(room, elements)) for room in rooms],
+                                  dtype=np.int64)
+                nodes = [node for room in rooms for node in getattr(room, elements)]
+                room_offsets = np.zeros(len(rooms) + 1, dtype=np.int64)
+                np.cumsum(counts, out=room_offsets[1:])
+                values = np.array([getattr(node, features) for node in nodes],
+                                  dtype=np.float32)
+                return cls(cls.get_columns(feature_class),
+                           values.reshape(len(nodes), feature_class.num_features),
+                           np.array([node.id for node in nodes]).astype(np.int64),
+                           np.repeat(np.arange(len(rooms), dtype=np.int64), counts),
+                           np.repeat(np.array([room.home_id for room in rooms],
+                                              dtype=np.int64), counts),
+                           room_offsets)
+
+            def get_room(self, room_index):
+                """
+                Returns a FeatureMatrix with the rows of a room (position in the
+                unit rooms list). Its arrays are views of this matrix ones
+                """
+                rows = slice(self.room_offsets[room_index],
+                             self.room_offsets[room_index + 1])
+                return Dataset.DatasetUnitCharacterizedElements.FeatureMatrix(
+                    self.columns,
+                    self.values[rows],
+                    self.ids[rows],
+                    self.room_index[rows],
+                    self.home_index[rows],
+                    self.room_offsets[room_index:room_index + 2] - rows.start)
+
+            def get_column(self, key):
+                """ Returns a view of the column of a feature name """
+                return self.values[:, self.columns.index(key)]
+
+            def get_room_means(self):
+                """
+                Returns a float32 array (num_of_rooms x num_of_features) with
+                the mean features of every room (NaN for rooms without
+                elements)
+                """
+                counts = np.diff(self.room_offsets)
+                non_empty = counts > 0
+                means = np.full((len(counts), len(self.columns)), np.nan,
+                                dtype=np.float32)
+                if non_empty.any():
+                    # Empty rooms are left out of the indices, the segment of
+                    # a non empty room still ends where the next one starts
+                    sums = np.add.reduceat(self.values,
+                                           self.room_offsets[:-1][non_empty],
+                                           axis=0,
+                                           dtype=np.float64)
+                    means[non_empty] = sums / counts[non_empty, np.newaxis]
+                return means
+
+        _loaded_attributes = ('categories', 'home_files', 'home_sessions',
+                              'rooms', 'object_features', 'relation_features',
+                              'observation_features',
+                              'observation_scan_features')
+
         def __init__(self, name="",
                      path="",
                      url="",
@@ -1040,6 +1397,39 @@ class Dataset():
             self.categories = self.__load_categories()
             self.home_files = self.__get_home_files()
             self.home_sessions = self.__load_home_files()
+            self.__build_feature_matrices()
+
+        def __build_feature_matrices(self):
+            """
+            Builds the float32 feature matrices (see FeatureMatrix) of the
+            objects, relations, observations and observation scans of every
+            room. Their room_index items are positions in self.rooms
+            """
+            self.rooms = [room
+                          for home_session in self.home_sessions
+                          for room in home_session.rooms]
+            self.object_features = self.FeatureMatrix.from_rooms(
+                self.rooms, 'objects', 'features', self.ObjectFeatures)
+            self.relation_features = self.FeatureMatrix.from_rooms(
+                self.rooms, 'relations', 'features', self.ObjectRelationFeatures)
+            self.observation_features = self.FeatureMatrix.from_rooms(
+                self.rooms, 'observations', 'features', self.ObservationFeatures)
+            self.observation_scan_features = self.FeatureMatrix.from_rooms(
+                self.rooms, 'observations', 'scan_features',
+                self.ObservationScanFeatures)
+
+        def get_room_index(self, home_session_name, room_name):
+            """
+            Returns the position of a room in self.rooms (and so the
+            room_index used by the feature matrices)
+            """
+            room_index = 0
+            for home_session in self.home_sessions:
+                for room in home_session.rooms:
+                    if home_session.name == home_session_name and room.name == room_name:
+                        return room_index
+                    room_index += 1
+            raise Exception(f"Sorry, room {room_name} not found in {home_session_name}")
 
         def __get_type(self):
             """
@@ -1242,10 +1632,11 @@ class Dataset():
                             # print(object_line)
                             words = object_line.strip().split()
                             # print(words)
+                            # Names and types repeat across rooms, so they are interned
                             object_id = int(words[1])
-                            object_name = words[0]
+                            object_name = sys.intern(words[0])
                             object_type_id = int(words[3])
-                            object_type_name = words[2]
+                            object_type_name = sys.intern(words[2])
                             object_feature_list = self.ObjectFeatures()
                             object_feature_list += words[4:]
                             # print(len(object_feature_list))
@@ -1299,10 +1690,10 @@ class Dataset():
 
                             object_relation_id = words[2]
                             object_relation_obj1_id   = words[3]
-                            object_relation_obj1_name = words[0]
+                            object_relation_obj1_name = sys.intern(words[0])
                             object_relation_obj1_type = words[5]
                             object_relation_obj2_id   = words[4]
-                            object_relation_obj2_name = words[1]
+                            object_relation_obj2_name = sys.intern(words[1])
                             object_relation_obj2_type = words[6]
                             object_relation_feature_list = self.ObjectRelationFeatures()
                             object_relation_feature_list += words[7:]
@@ -1381,7 +1772,7 @@ class Dataset():
                             # print(observation_index, len(words))
                             # print(words)
                             observation_id = words[1]
-                            observation_sensor_name = words[0]
+                            observation_sensor_name = sys.intern(words[0])
 
                             """ compute range values """
                             obj_num = int(words[2])
@@ -1481,6 +1872,8 @@ class Dataset():
                 return s
 
         class Point():
+            __slots__ = ('x', 'y', 'z')
+
             def __init__(self, x, y, z):
                 self.x = x
                 self.y = y
@@ -1514,6 +1907,8 @@ class Dataset():
                 return s
 
 
+        _loaded_attributes = ('homes',)
+
         def __init__(self, name="",
                      url="",
                      path="",
@@ -1656,6 +2051,8 @@ class Dataset():
                             topo_relation.room2_name
                 return new_dict
 
+        _loaded_attributes = ('homes',)
+
         def __init__(self, name="", url="", path="", expected_hash_code="",
                      expected_size=0):
             """ Calls the super class __init__"""
@@ -1712,7 +2109,7 @@ class Dataset():
             def get_home_name(self):
                 return self.name.split('-s')[0]
 
-        class HomeSessions(list):
+        class HomeSessions(NamedList):
 
             def __init__(self):
                 pass
@@ -1728,14 +2125,33 @@ class Dataset():
                     " items)>"
                 return s
 
-            def get_names(self):
-                return [home.name for home in self]
-
         class Room():
-            def __init__(self, name, folder_path, sensor_observations):
+            """
+            Rooms are listed when the unit is loaded, but their sensor
+            observations are parsed from the room file (file_path) the
+            first time they are accessed
+            """
+            def __init__(self, name, folder_path, sensor_observations=None,
+                         file_path="", rel_path=""):
                 self.name = name
                 self.folder_path = folder_path
-                self.sensor_observations = sensor_observations
+                self.file_path = file_path
+                self.rel_path = rel_path
+                self.__sensor_observations = sensor_observations
+
+            @property
+            def sensor_observations(self):
+                if self.__sensor_observations is None:
+                    self.__sensor_observations = Dataset.DatasetUnitRawData.load_sensors(
+                        self.file_path, self.folder_path, self.rel_path)
+                return self.__sensor_observations
+
+            @sensor_observations.setter
+            def sensor_observations(self, sensor_observations):
+                self.__sensor_observations = sensor_observations
+
+            def is_loaded(self):
+                return self.__sensor_observations is not None
 
             def __str__(self):
                 s = '\t' + self.name + '  folder: /' + self.folder_path + \
@@ -1746,7 +2162,7 @@ class Dataset():
                 s = "<Room instance (" + self.name + ")>"
                 return s
 
-        class Rooms(list):
+        class Rooms(NamedList):
 
             def __init__(self):
                 pass
@@ -1763,6 +2179,13 @@ class Dataset():
                 return s
 
         class Sensor():
+            # Subclasses declare empty __slots__, so load_files() can still cast
+            # an instance by assigning __class__
+            __slots__ = ('id', 'name',
+                         'sensor_pose_x', 'sensor_pose_y', 'sensor_pose_z',
+                         'sensor_pose_yaw', 'sensor_pose_pitch', 'sensor_pose_roll',
+                         'time_stamp', 'files', 'path', 'rel_path')
+
             def __init__(self, id='0', name='undefined',
                          sensor_pose_x='0', sensor_pose_y='0', sensor_pose_z='0',
                          sensor_pose_yaw='0', sensor_pose_pitch='0', sensor_pose_roll='0',
@@ -1848,6 +2271,8 @@ class Dataset():
                 return s
 
         class SensorCamera(Sensor):
+            __slots__ = ()
+
             def __init__(self, id='0', name='undefined',
                          sensor_pose_x='0', sensor_pose_y='0', sensor_pose_z='0',
                          sensor_pose_yaw='0', sensor_pose_pitch='0', sensor_pose_roll='0',
@@ -1915,7 +2340,6 @@ class Dataset():
                 return labels
 
             def __get_mask(self):
-                mask = []
                 labels_file = self.get_labels_file()
                 labels_file_path = labels_file
                 with open(labels_file_path, "r") as file_handler:
@@ -1929,30 +2353,38 @@ class Dataset():
 
                     for i in range(num_of_labels):
                         line = file_handler.readline()
-                        words = line.strip().split()
 
-                    num_of_rows = 0
-                    line = file_handler.readline()
-                    while line:
-                        num_of_rows += 1
-                        words = line.strip().split()
-                        mask.append(list(map(int, words)))
-                        line = file_handler.readline()
-                # h = len(mask)
-                # w = len(mask[0])
+                    # Vectorized parsing of the remaining rows
+                    mask = np.loadtxt(file_handler, dtype=np.int64, ndmin=2)
+                # h, w = mask.shape
 
                 return mask
 
             def get_label_mask(self, pos):
-                mask = self.__get_mask()
-                arr = np.array(mask)
-                arr = np.rot90(arr)
-                arr = arr & (2**(pos))
-                np.clip(arr, 0, 1, out=arr)
-                arr = np.uint8(arr)
+                label_masks, _ = self.get_label_masks([pos])
+                arr = np.uint8(label_masks[0])
                 arr = arr * 255
                 return arr
 
+            def get_label_masks(self, positions=None):
+                """
+                Parses the labels file once and extracts the binary masks of
+                several labels broadcasting over the bit planes
+
+                Parameters
+                ----------
+                positions: sequence of label positions (all the labels of the
+                           observation if None)
+
+                Returns
+                -------
+                A tuple (label_masks, stats), see helpers.label_masks_stats
+                (masks are cropped like the toolbox ones)
+                """
+                if positions is None:
+                    positions = range(len(self.get_labels()))
+                return label_masks_stats(np.rot90(self.__get_mask()), positions)
+
             def show_intensity_image(self):
                 img = self.get_intensity_image()
                 cv2.imshow("Intensity image " + "#" + self.id, img)
@@ -1989,6 +2421,8 @@ class Dataset():
                 return s
 
         class SensorLaserScanner(Sensor):
+            __slots__ = ()
+
             def __init__(self, id='0', name='undefined',
                          sensor_pose_x='0', sensor_pose_y='0', sensor_pose_z='0',
                          sensor_pose_yaw='0', sensor_pose_pitch='0', sensor_pose_roll='0',
@@ -2060,6 +2494,9 @@ class Dataset():
                 return s
 
         class LaserScan():
+            __slots__ = ('aperture', 'max_range', 'vector_of_scans',
+                         'vector_of_valid_scans')
+
             def __init__(self, aperture='0', max_range='0',
                          vector_of_scans=[], vector_of_valid_scans=[]):
                 self.aperture = aperture
@@ -2095,6 +2532,8 @@ class Dataset():
                 return s
 
         class Label():
+            __slots__ = ('id', 'name')
+
             def __init__(self, id='', name=''):
                 self.id = id
                 self.name = name
@@ -2141,16 +2580,65 @@ class Dataset():
                 new_dict = dict(zip_obj)
                 return new_dict
 
+        _loaded_attributes = ('home_sessions',)
+
         def __init__(self, name="", url="", path="", expected_hash_code="",
                      expected_size=0):
             """ Calls the super class __init__"""
             super().__init__(name, url, path, expected_hash_code,
                              expected_size)
 
+        @staticmethod
+        def load_sensors(file_path, folder_path, rel_path):
+            """
+            Parses a room file and returns a Sensors list with a Sensor per
+            observation
+
+            Parameters
+            ----------
+            file_path: path of the room .txt file
+            folder_path: path of the room folder with the observation files
+            rel_path: room folder path relative to the dataset path
+            """
+            sensors = Dataset.DatasetUnitRawData.Sensors()
+            with open(file_path, "r") as file_handler:
+                for line in file_handler:
+                    words = line.strip().split()
+                    if words[0] != '#':
+                        """
+                        Read a line with the following structure:
+                        words  0 : [Observation_id]
+                        words  1 : [sensor_label]
+                        words  2 : [sensor_pose_x]
+                        words  3 : [sensor_pose_y]
+                        words  4 : [sensor_pose_z]
+                        words  5 : [sensor_pose_yaw]
+                        words  6 : [sensor_pose_pitch]
+                        words  7 : [sensor_pose_roll]
+                        words  8 : [time-stamp]
+                        """
+                        sensor = Dataset.DatasetUnitRawData.Sensor(words[0],
+                                                                   words[1],
+                                                                   words[2],
+                                                                   words[3],
+                                                                   words[4],
+                                                                   words[5],
+                                                                   words[6],
+                                                                   words[7],
+                                                                   words[8],
+                                                                   [],
+                                                                   folder_path,
+                                                                   rel_path)
+                        sensors.append(sensor)
+            return sensors
+
         def _load_function(self):
+            """
+            Lists home sessions and rooms. Room files are parsed when their
+            sensor observations are first accessed (see Room)
+            """
             self.home_sessions = self.HomeSessions()
             home_folders = sorted(os.listdir(self.path))
-            # print(home_folders)
             for home_folder in home_folders:
                 words = home_folder.strip().split('-')
                 len_of_words = len(words)
@@ -2165,58 +2653,21 @@ class Dataset():
                     home_folder + '/' +
                     home_subfolder
                 )
-                # print(room_files)
                 for room_file in room_files:
                     if room_file.endswith('.txt'):
-                        #print(room_file)
                         room_folder_path = self.path + '/' + home_folder + \
                                            '/' + home_subfolder + '/' + \
                                            room_file.split('.')[0]
                         room_file_path = self.path + '/' + home_folder + \
                                          '/' + home_subfolder + '/' + \
                                          room_file
-                        sensors = self.Sensors()
-                        # print(sensor_observations_files)
-                        with open(room_file_path, "r") as file_handler:
-                            for line in file_handler:
-                                words = line.strip().split()
-                                if words[0] != '#':
-                                    """
-                                    Read a line with the following structure:
-                                    words  0 : [Observation_id]
-                                    words  1 : [sensor_label]
-                                    words  2 : [sensor_pose_x]
-                                    words  3 : [sensor_pose_y]
-                                    words  4 : [sensor_pose_z]
-                                    words  5 : [sensor_pose_yaw]
-                                    words  6 : [sensor_pose_pitch]
-                                    words  7 : [sensor_pose_roll]
-                                    words  8 : [time-stamp]
-                                    """
-                                    # print(words[0])
-                                    sensor = self.Sensor(words[0],
-                                                         words[1],
-                                                         words[2],
-                                                         words[3],
-                                                         words[4],
-                                                         words[5],
-                                                         words[6],
-                                                         words[7],
-                                                         words[8],
-                                                         [],
-                                                         room_folder_path,
-                                                         room_relative_path + "/" + room_file.split('.')[0])
-                                    sensors.append(sensor)
                         room = self.Room(room_file.split('.')[0],
                                          room_folder_path,
-                                         sensors)
+                                         file_path=room_file_path,
+                                         rel_path=room_relative_path + "/" + room_file.split('.')[0])
                         rooms.append(room)
-                        # print(room)
-                # print(rooms)
-                # input("Press Enter to continue...")
                 home_session = self.HomeSession(home_subfolder, rooms)
                 self.home_sessions.append(home_session)
-            # return home_sessions
 
         def __str__(self):
             s = ""
@@ -2243,7 +2694,7 @@ class Dataset():
             def get_home_name(self):
                 return self.name.split('-s')[0]
 
-        class HomeSessions(list):
+        class HomeSessions(NamedList):
 
             def __init__(self):
                 pass
@@ -2259,14 +2710,32 @@ class Dataset():
                     " items)>"
                 return s
 
-            def get_names(self):
-                return [home.name for home in self]
-
         class Room():
-            def __init__(self, name, folder_path, sensor_sessions):
+            """
+            Rooms are listed when the unit is loaded, but their sensor
+            sessions are listed and parsed from the room folder the first
+            time they are accessed
+            """
+            def __init__(self, name, folder_path, sensor_sessions=None,
+                         rel_path=""):
                 self.name = name
                 self.folder_path = folder_path
-                self.sensor_sessions = sensor_sessions
+                self.rel_path = rel_path
+                self.__sensor_sessions = sensor_sessions
+
+            @property
+            def sensor_sessions(self):
+                if self.__sensor_sessions is None:
+                    self.__sensor_sessions = Dataset.DatasetUnitLaserScans.load_sensor_sessions(
+                        self.folder_path, self.rel_path)
+                return self.__sensor_sessions
+
+            @sensor_sessions.setter
+            def sensor_sessions(self, sensor_sessions):
+                self.__sensor_sessions = sensor_sessions
+
+            def is_loaded(self):
+                return self.__sensor_sessions is not None
 
             def __str__(self):
                 s = '\t' + self.name + '  folder: /' + self.folder_path + \
@@ -2277,7 +2746,7 @@ class Dataset():
                 s = "<Room instance (" + self.name + ")>"
                 return s
 
-        class Rooms(list):
+        class Rooms(NamedList):
 
             def __init__(self):
                 pass
@@ -2325,6 +2794,13 @@ class Dataset():
                 return s
 
         class Sensor():
+            # Subclasses declare empty __slots__, so load_files() can still cast
+            # an instance by assigning __class__
+            __slots__ = ('id', 'name',
+                         'sensor_pose_x', 'sensor_pose_y', 'sensor_pose_z',
+                         'sensor_pose_yaw', 'sensor_pose_pitch', 'sensor_pose_roll',
+                         'time_stamp', 'files', 'path', 'rel_path')
+
             def __init__(self, id='0', name='undefined',
                          sensor_pose_x='0', sensor_pose_y='0', sensor_pose_z='0',
                          sensor_pose_yaw='0', sensor_pose_pitch='0', sensor_pose_roll='0',
@@ -2409,6 +2885,8 @@ class Dataset():
                 return s
 
         class SensorLaserScanner(Sensor):
+            __slots__ = ()
+
             def __init__(self, id='0', name='undefined',
                          sensor_pose_x='0', sensor_pose_y='0', sensor_pose_z='0',
                          sensor_pose_yaw='0', sensor_pose_pitch='0', sensor_pose_roll='0',
@@ -2462,6 +2940,9 @@ class Dataset():
                 return s
 
         class LaserScan():
+            __slots__ = ('aperture', 'max_range', 'vector_of_scans',
+                         'vector_of_valid_scans')
+
             def __init__(self, aperture='0', max_range='0',
                          vector_of_scans=[], vector_of_valid_scans=[]):
                 self.aperture = aperture
@@ -2496,6 +2977,8 @@ class Dataset():
                     " items)>"
                 return s
 
+        _loaded_attributes = ('home_sessions',)
+
         def __init__(self, name="", url="", path="", expected_hash_code="",
                      expected_size=0):
             """ Calls the super class __init__"""
@@ -2504,16 +2987,75 @@ class Dataset():
 
             # self.home_sessions = self.__load_data()
 
+        @staticmethod
+        def load_sensor_sessions(folder_path, rel_path):
+            """
+            Parses the sensor session files of a room folder and returns a
+            SensorSessions list
+
+            Parameters
+            ----------
+            folder_path: path of the room folder
+            rel_path: room folder path relative to the dataset path
+            """
+            sensor_session_files = sorted(os.listdir(folder_path))
+            sensor_sessions = Dataset.DatasetUnitLaserScans.SensorSessions()
+            for sensor_session_file in sensor_session_files:
+                if sensor_session_file.endswith('.txt'):
+                    sensor_session_folder_path = folder_path + '/' + \
+                                       sensor_session_file.split('.')[0]
+                    sensor_session_file_path = folder_path + '/' + \
+                                       sensor_session_file
+                    sensors = Dataset.DatasetUnitLaserScans.Sensors()
+                    with open(sensor_session_file_path, "r") as file_handler:
+                        for line in file_handler:
+                            words = line.strip().split()
+                            if words[0] != '#':
+                                """
+                                Read a line with the following structure:
+                                words  0 : [Observation_id]
+                                words  1 : [sensor_label]
+                                words  2 : [sensor_pose_x]
+                                words  3 : [sensor_pose_y]
+                                words  4 : [sensor_pose_z]
+                                words  5 : [sensor_pose_yaw]
+                                words  6 : [sensor_pose_pitch]
+                                words  7 : [sensor_pose_roll]
+                                words  8 : [time-stamp]
+                                """
+                                sensor = Dataset.DatasetUnitLaserScans.Sensor(
+                                    words[0],
+                                    words[1],
+                                    words[2],
+                                    words[3],
+                                    words[4],
+                                    words[5],
+                                    words[6],
+                                    words[7],
+                                    words[8],
+                                    [],
+                                    sensor_session_folder_path,
+                                    rel_path + "/" + sensor_session_file.split('.')[0]
+                                )
+                                sensors.append(sensor)
+                    sensor_session = Dataset.DatasetUnitLaserScans.SensorSession(
+                        sensor_session_file.split('.')[0],
+                        sensor_session_folder_path, sensors)
+                    sensor_sessions.append(sensor_session)
+            return sensor_sessions
+
         def _load_function(self):
+            """
+            Lists home sessions and rooms. Room folders are parsed when their
+            sensor sessions are first accessed (see Room)
+            """
             home_folders = sorted(os.listdir(self.path))
             self.home_sessions = self.HomeSessions()
-            # print(home_folders)
             for home_folder in home_folders:
                 words = home_folder.strip().split('-')
                 len_of_words = len(words)
                 home_subfolder = words[len_of_words-2] + '-' + \
                                  words[len_of_words - 1]
-                # print(home_folder)
                 room_folders = sorted(os.listdir(self.path + '/' +
                                                  home_folder + '/' +
                                                  home_subfolder))
@@ -2522,71 +3064,18 @@ class Dataset():
                     home_folder + '/' +
                     home_subfolder
                 )
-                # print(room_folders)
                 rooms = self.Rooms()
                 for room_folder in room_folders:
-                    # print(room_folder)
                     room_folder_path = self.path + '/' + home_folder + \
                                        '/' + home_subfolder + '/' + \
                                        room_folder
-                    sensor_session_files = sorted(os.listdir(room_folder_path))
-                    # print(sensor_session_files)
-                    sensor_sessions = self.SensorSessions()
-                    for sensor_session_file in sensor_session_files:
-                        if sensor_session_file.endswith('.txt'):
-                            # print(sensor_session_file)
-                            sensor_session_folder_path = room_folder_path + '/' + \
-                                               sensor_session_file.split('.')[0]
-                            sensor_session_file_path = room_folder_path + '/' + \
-                                               sensor_session_file
-                            # print(sensor_session_folder_path)
-                            # print(sensor_session_file_path)
-                            sensors = self.Sensors()
-                            with open(sensor_session_file_path, "r") as file_handler:
-                                for line in file_handler:
-                                    words = line.strip().split()
-                                    if words[0] != '#':
-                                        """
-                                        Read a line with the following structure:
-                                        words  0 : [Observation_id]
-                                        words  1 : [sensor_label]
-                                        words  2 : [sensor_pose_x]
-                                        words  3 : [sensor_pose_y]
-                                        words  4 : [sensor_pose_z]
-                                        words  5 : [sensor_pose_yaw]
-                                        words  6 : [sensor_pose_pitch]
-                                        words  7 : [sensor_pose_roll]
-                                        words  8 : [time-stamp]
-                                        """
-                                        # print(words[0])
-                                        sensor = self.Sensor(words[0],
-                                                             words[1],
-                                                             words[2],
-                                                             words[3],
-                                                             words[4],
-                                                             words[5],
-                                                             words[6],
-                                                             words[7],
-                                                             words[8],
-                                                             [],
-                                                             sensor_session_folder_path,
-                                                             room_relative_path + "/" + room_folder + "/" + sensor_session_file.split('.')[0]
-                                                             )
-                                        sensors.append(sensor)
-                            sensor_session = self.SensorSession(sensor_session_file.split('.')[0],
-                                                                sensor_session_folder_path, sensors)
-                            sensor_sessions.append(sensor_session)
                     room = self.Room(room_folder,
-                                     room_folder_path, sensor_sessions)
+                                     room_folder_path,
+                                     rel_path=room_relative_path + "/" + room_folder)
                     rooms.append(room)
-                    # print(room)
-                # print(rooms)
-                # input("Press Enter to continue...")
                 home_session = self.HomeSession(home_subfolder, rooms)
                 self.home_sessions.append(home_session)
 
-            # return home_sessions
-
         def __str__(self):
             s = ""
             s = ""
@@ -2666,6 +3155,7 @@ class Dataset():
                 return s
 
         class BoundingBox():
+            __slots__ = ('id', 'name', 'bb_pose', 'bb_corner')
 
             def __init__(self, id='0', name='undefined',
                          bb_pose=[0.0]*6,
@@ -2726,6 +3216,8 @@ class Dataset():
                 new_dict = dict(zip_obj)
                 return new_dict
 
+        _loaded_attributes = ('home_sessions',)
+
         def __init__(self, name="", url="", path="", expected_hash_code="",
                      expected_size=0):
             """ Calls the super class __init__"""
@@ -2810,16 +3302,27 @@ class Dataset():
                  name="",
                  path=os.path.abspath("."),
                  url="",
-                 autoload="True"):
+                 autoload="True",
+                 snapshot_path=None,
+                 num_workers=1):
 
         """
         Robot@Home Dataset
+
+        snapshot_path : folder (relative to path, or an absolute path) where
+                        units cache their parsed data, None (default) to
+                        always parse the plain text files. Snapshots are
+                        pickles, so only trusted folders must be used (see
+                        DatasetUnit.save_snapshot)
+        num_workers   : number of processes that load the units when
+                        autoload is set (see load_units)
         """
 
         self.name = name
         self.path = path
         self.url = url
         self.autoload = autoload
+        self.snapshot_path = snapshot_path
 
         print (version.get_version_str())
 
@@ -2890,17 +3393,14 @@ class Dataset():
             7947563808)
 
 
+        if self.snapshot_path is not None:
+            for unit in self.unit.values():
+                unit.snapshot_path = os.path.join(os.path.abspath(self.path),
+                                                  self.snapshot_path)
 
+        self.load_report = {}
         if self.autoload:
-            self.unit["chelmnts"].load_data()
-            self.unit["2dgeomap"].load_data()
-            self.unit["hometopo"].load_data()
-            self.unit["raw"].load_data()
-            self.unit["lsrscan"].load_data()
-            self.unit["rgbd"].load_data()
-            self.unit["lblrgbd"].load_data()
-            self.unit["lblscene"].load_data()
-            self.unit["rctrscene"].load_data()
+            self.load_report = self.load_units(num_workers)
 
             """
             Memory profile
@@ -2916,6 +3416,92 @@ class Dataset():
             """
 
 
+    def load_units(self, num_workers=1):
+        """
+        Loads the data of every unit. With more than one worker, units are
+        parsed concurrently in worker processes, the largest ones first. A
+        worker saves the parsed unit to its snapshot (see
+        DatasetUnit.save_snapshot), which is then mapped by this process,
+        or sends it back pickled if snapshots are disabled. A unit that
+        fails in a worker, or every unit if the workers can't be started,
+        is loaded again by load_data(), so the integrity check and download
+        prompt are kept
+
+        num_workers : number of worker processes, 1 to load the units one
+                      after another in this process, None for os.cpu_count()
+
+        Returns a dictionary with the load time (seconds) and peak memory
+        (bytes) of every unit, which is also logged (info level). Peak
+        memory is the peak resident set size of the worker process while
+        loading the unit or, when a unit is loaded by this process, the
+        increase of its peak resident set size. It is None in platforms
+        where it can't be measured (see get_peak_memory)
+        """
+        load_report = {}
+        if num_workers != 1:
+            try:
+                self.__load_units_in_workers(num_workers, load_report)
+            except Exception as err:
+                print("Units couldn't be loaded in worker processes: ", repr(err))
+
+        for key, unit in self.unit.items():
+            if key not in load_report:
+                start_time = time.perf_counter()
+                start_peak = get_peak_memory()
+                unit.load_data()
+                load_report[key] = (time.perf_counter() - start_time,
+                                    get_peak_memory_increase(start_peak))
+
+        for key, (seconds, peak) in load_report.items():
+            logger.info("{:<10}: {:8.2f} s, peak memory {}",
+                        key, seconds,
+                        "unavailable" if peak is None
+                        else humanize.naturalsize(peak, binary=True))
+        return load_report
+
+    def __load_units_in_workers(self, num_workers, load_report):
+        """
+        Loads the units in worker processes (see load_units), adding an
+        item to load_report for every unit that is loaded
+        """
+        keys = sorted(self.unit,
+                      key=lambda key: self.unit[key].expected_size,
+                      reverse=True)
+        executor_args = {'max_workers': num_workers,
+                         'mp_context': multiprocessing.get_context('spawn')}
+        # A process per unit, so its peak memory isn't mixed up with the one
+        # of other units. Before Python 3.11 workers are reused and
+        # _load_unit resets the peak instead
+        if sys.version_info >= (3, 11):
+            executor_args['max_tasks_per_child'] = 1
+        with concurrent.futures.ProcessPoolExecutor(**executor_args) as executor:
+            futures = {executor.submit(_load_unit, self.unit[key]): key
+                       for key in keys}
+            for future in concurrent.futures.as_completed(futures):
+                key = futures[future]
+                unit = self.unit[key]
+                try:
+                    fingerprint, attributes, seconds, peak = future.result()
+                    if attributes is None:
+                        start_time = time.perf_counter()
+                        if not unit.load_snapshot(fingerprint):
+                            raise Exception(f"Sorry, snapshot of {unit.name} not found")
+                        seconds += time.perf_counter() - start_time
+                    else:
+                        for name, value in attributes.items():
+                            setattr(unit, name, value)
+                    unit.__data_loaded__ = True
+                    print("Loaded " + unit.name + " from a worker process")
+                except Exception as err:
+                    print("Something went wrong loading " + unit.name +
+                          " in a worker process: ", repr(err))
+                    start_time = time.perf_counter()
+                    start_peak = get_peak_memory()
+                    unit.load_data()
+                    seconds = time.perf_counter() - start_time
+                    peak = get_peak_memory_increase(start_peak)
+                load_report[key] = (seconds, peak)
+
     def __str__(self):
 
         """ Units """
@@ -2942,6 +3528,88 @@ class Dataset():
         return s
 
 
+def get_peak_memory():
+    """
+    Returns the peak resident set size of the current process in bytes, or
+    None if it is unavailable in this platform (e.g. Windows)
+    """
+    # In Linux, ru_maxrss of a spawned process keeps the peak of the process
+    # that forked it, VmHWM doesn't
+    try:
+        with open('/proc/self/status') as file_handler:
+            for line in file_handler:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes in Linux, bytes in macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def get_peak_memory_increase(start_peak):
+    """
+    Returns the increase of the peak resident set size since start_peak
+    (see get_peak_memory), None if it is unavailable
+    """
+    peak = get_peak_memory()
+    if peak is None or start_peak is None:
+        return None
+    return peak - start_peak
+
+
+def reset_peak_memory():
+    """
+    Resets the peak resident set size of the current process to the current
+    one (Linux only, see get_peak_memory)
+
+    Returns
+    -------
+    True if the peak has been reset, False otherwise
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as file_handler:
+            file_handler.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _load_unit(unit):
+    """
+    Parses a dataset unit in a worker process (see Dataset.load_units)
+
+    Returns
+    -------
+    A tuple (fingerprint, attributes, seconds, peak memory), where
+    attributes are the ones set by the unit _load_function, or None if they
+    have been saved to (or were already in) the unit snapshot
+    """
+    # Worker processes are reused before Python 3.11 (see load_units)
+    reset_peak_memory()
+    start_time = time.perf_counter()
+    fingerprint = None
+    attributes = None
+    if unit.snapshot_path is not None:
+        fingerprint = unit.get_fingerprint()
+    if (fingerprint is None or
+            not os.path.isfile(unit.get_snapshot_file_name(fingerprint))):
+        unit._load_function()
+        attributes = {name: getattr(unit, name)
+                      for name in unit._loaded_attributes}
+        if fingerprint is not None:
+            try:
+                unit.save_snapshot(fingerprint)
+                attributes = None
+            except Exception as err:
+                print("The snapshot couldn't be saved: ", repr(err))
+    return (fingerprint, attributes, time.perf_counter() - start_time,
+            get_peak_memory())
+
 def main():
     print (version.get_version_str())
 
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Robot@Home detector.py
+
+Object detection over lblrgbd observations sharded across worker processes.
+One MXNet process doesn't saturate a multi-core CPU, so the observation ids
+are split into contiguous shards that are processed by a pool of processes,
+each one with its own RobotAtHome object, its own cached network (see
+ModelRegistry) and a pinned number of MXNet threads. The detections of every
+shard are merged into a single long format dataframe (see detections2df).
+
+Usage:
+    python -m robotathome.detector detect --rh_path=<rh_path> --wspc_path=<wspc_path>
+    python -m robotathome.detector scaling --rh_path=<rh_path> --wspc_path=<wspc_path>
+"""
+
+__author__ = "Gregorio Ambrosio"
+__contact__ = "gambrosio[at]uma.es"
+__copyright__ = "Copyright 2021, 2026, Gregorio Ambrosio"
+__date__ = "2026/10/17"
+__license__ = "MIT"
+
+
+import os
+import time
+import multiprocessing
+import concurrent.futures
+import fire
+import numpy as np
+import pandas as pd
+import robotathome as rh
+
+
+# =========================
+#      GLOBAL VARIABLES
+# =========================
+# RobotAtHome object of the current (worker) process
+RH = None
+
+
+def _init_worker(rh_path, wspc_path, db_filename, materialize, model, gpu,
+                 num_threads):
+
+    """
+    Opens the dataset and loads the network once per worker process. MXNet
+    threads are set before MXNet is imported by the (spawned) process
+    """
+
+    global RH
+    rh.set_mxnet_threads(num_threads)
+    RH = rh.RobotAtHome(rh_path, wspc_path, db_filename,
+                        materialize=materialize)
+    rh.get_detection_model(model, gpu)
+
+
+def _detect_shard(ids, model, gpu, batch_size, thresh):
+
+    """ Returns the detections of a shard of observation ids """
+
+    return RH.detect_objects(ids, model, gpu, batch_size, thresh=thresh)
+
+
+def get_shards(ids, shard_size=256):
+
+    """
+    Splits a sorted array of observation ids in contiguous shards of at most
+    shard_size ids (consecutive ids belong to the same sequence, so they
+    share the image resolution)
+    """
+
+    ids = np.asarray(ids, dtype=np.int64)
+    return np.split(ids, np.arange(shard_size, len(ids), shard_size))
+
+
+def detect_objects(rh_path='.',
+                   wspc_path='.',
+                   db_filename='rh.db',
+                   ids=None,
+                   model='yolo3_darknet53_coco',
+                   gpu=False,
+                   batch_size=8,
+                   thresh=0.0,
+                   num_processes=None,
+                   num_threads=None,
+                   shard_size=256,
+                   materialize=True,
+                   output_file_name=None):
+
+    """
+    Applies an object detection model to lblrgbd observations in parallel
+
+    Parameters
+    ----------
+    ids: a sequence (or NumPy array) of sensor observation ids, all the
+         lblrgbd observations if None
+    batch_size, thresh: see RobotAtHome.lblrgbd_object_detection
+    num_processes: number of worker processes (default os.cpu_count())
+    num_threads: number of MXNet threads per worker process (by default, the
+                 cpu count divided by the number of processes)
+    shard_size: number of observations per task, shards are handed out to
+                the workers as they become idle
+    materialize: see RobotAtHome, the materialized table is built once by
+                 the calling process and shared by the workers
+    output_file_name: optional csv file (relative to wspc_path) where the
+                      detections are saved
+
+    Returns
+    -------
+    A long format dataframe with the detections of every observation, in the
+    order of ids
+    """
+
+    cpu_count = os.cpu_count() or 1
+    if num_processes is None:
+        num_processes = cpu_count
+    if num_threads is None:
+        num_threads = max(1, cpu_count // num_processes)
+
+    # The calling process lists the ids (and materializes the lblrgbd table
+    # before the workers open the dataset)
+    rh_obj = rh.RobotAtHome(rh_path, wspc_path, db_filename,
+                            materialize=materialize)
+    if ids is None:
+        ids = rh_obj.get_lblrgbd_ids()
+    del rh_obj
+
+    shards = get_shards(ids, shard_size)
+    rh.logger.info("{} observations in {} shards, {} processes x {} threads",
+                   len(ids), len(shards), num_processes, num_threads)
+
+    # Spawned (not forked) workers, so MXNet is initialized in each process
+    # after its thread settings
+    with concurrent.futures.ProcessPoolExecutor(
+            max_workers=num_processes,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(rh_path, wspc_path, db_filename, materialize, model, gpu,
+                      num_threads)
+    ) as executor:
+        futures = [executor.submit(_detect_shard, shard, model, gpu, batch_size,
+                                   thresh)
+                   for shard in shards]
+        df_detections = pd.concat([future.result() for future in futures],
+                                  ignore_index=True)
+
+    if output_file_name is not None:
+        df_detections.to_csv(os.path.join(wspc_path, output_file_name),
+                             index=False)
+    return df_detections
+
+
+def scaling_report(rh_path='.',
+                   wspc_path='.',
+                   db_filename='rh.db',
+                   num_frames=512,
+                   model='yolo3_darknet53_coco',
+                   batch_size=8,
+                   max_processes=None,
+                   num_threads=1,
+                   shard_size=32,
+                   materialize=True):
+
+    """
+    Measures the throughput of detect_objects from 1 to max_processes
+    workers over the first num_frames lblrgbd observations
+
+    Times are end to end, i.e. they include starting the workers and loading
+    the network in each of them
+
+    Returns
+    -------
+    A dataframe with a row per number of processes and columns processes,
+    threads, seconds, fps, speedup and efficiency (speedup / processes)
+    """
+
+    if max_processes is None:
+        max_processes = os.cpu_count() or 1
+    rh_obj = rh.RobotAtHome(rh_path, wspc_path, db_filename,
+                            materialize=materialize)
+    ids = rh_obj.get_lblrgbd_ids()[:num_frames]
+    del rh_obj
+
+    num_processes_list = sorted({1, max_processes} |
+                                {2**i for i in range(max_processes.bit_length())
+                                 if 2**i <= max_processes})
+    report = []
+    for num_processes in num_processes_list:
+        start_time = time.perf_counter()
+        detect_objects(rh_path, wspc_path, db_filename, ids, model,
+                       batch_size=batch_size,
+                       num_processes=num_processes,
+                       num_threads=num_threads,
+                       shard_size=shard_size,
+                       materialize=materialize)
+        seconds = time.perf_counter() - start_time
+        report.append((num_processes, num_threads, seconds, len(ids) / seconds))
+        rh.logger.info("{} processes: {:.1f} frames/s", num_processes, report[-1][3])
+
+    df_report = pd.DataFrame(report, columns=['processes', 'threads', 'seconds', 'fps'])
+    df_report['speedup'] = df_report['seconds'].iloc[0] / df_report['seconds']
+    df_report['efficiency'] = df_report['speedup'] / df_report['processes']
+    return df_report
+
+
+def main():
+    fire.Fire({'detect': detect_objects,
+               'scaling': scaling_report})
+    return 0
+
+
+if __name__ == "__main__":
+    main()
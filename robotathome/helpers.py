@@ -8,18 +8,27 @@ __date__ = "2021/02/22"
 __license__ = "MIT"
 
 import os
+import sys
+import ctypes
 import datetime as dt
 import time
 import re
+import collections
+import concurrent.futures
+import threading
+import queue
 import numpy as np
-import cv2
-import matplotlib.patches as mpatches
-import matplotlib.pyplot as plt
-import mxnet as mx
-import gluoncv as gcv
-import pandas as pd
+from robotathome.lazy import lazy_import
 import robotathome as rh
 
+# Heavy backends are imported on first use (see lazy.py)
+cv2 = lazy_import('cv2')
+mpatches = lazy_import('matplotlib.patches')
+plt = lazy_import('matplotlib.pyplot')
+mx = lazy_import('mxnet')
+gcv = lazy_import('gluoncv')
+pd = lazy_import('pandas')
+
 """
 misc
 """
@@ -57,6 +66,54 @@ def plot_mask(patched_img, names, colors):
     plt.legend(handles=mpatches_)
     plt.show()
 
+def label_masks_stats(mask, labels):
+    """
+    Extracts the binary masks of several labels at once, broadcasting the
+    bit planes of a label mask, together with per label statistics
+
+    Parameters
+    ----------
+    mask: rotated label mask, every pixel is a bit field with a bit per label
+          (see RobotAtHome.get_mask_from_lblrgbd). The label grid is 2
+          columns wider on each side than the rgb images, so those columns
+          are cropped
+    labels: sequence of label local ids (bit positions)
+
+    Returns
+    -------
+    A tuple (label_masks, stats) where:
+    label_masks : (L, H, W) boolean array, cropped like the rgb images
+    stats       : dict of arrays aligned with labels:
+                  'count'    (L,) number of pixels
+                  'bbox'     (L, 4) xmin, ymin, xmax, ymax (-1 if empty)
+                  'centroid' (L, 2) x, y (nan if empty)
+    """
+    mask = np.asarray(mask)[:, 2:-2]
+    labels = np.asarray(labels, dtype=np.int64).ravel()
+    bits = (np.uint64(1) << labels.astype(np.uint64)).astype(mask.dtype)
+    label_masks = (mask[np.newaxis] & bits[:, np.newaxis, np.newaxis]) != 0
+
+    # Row and column projections give every statistic in one pass
+    pixels = label_masks.view(np.uint8)
+    rows = pixels.sum(axis=2, dtype=np.uint16)
+    cols = pixels.sum(axis=1, dtype=np.uint16)
+    count = rows.sum(axis=1, dtype=np.int64)
+    h, w = mask.shape
+    rows_any = rows > 0
+    cols_any = cols > 0
+    bbox = np.stack([cols_any.argmax(axis=1),
+                     rows_any.argmax(axis=1),
+                     w - 1 - cols_any[:, ::-1].argmax(axis=1),
+                     h - 1 - rows_any[:, ::-1].argmax(axis=1)], axis=1)
+    bbox[count == 0] = -1
+    with np.errstate(invalid='ignore', divide='ignore'):
+        centroid = np.stack([cols @ np.arange(w),
+                             rows @ np.arange(h)], axis=1) / count[:, np.newaxis]
+
+    return label_masks, {'count': count,
+                         'bbox': bbox,
+                         'centroid': centroid}
+
 """
 time
 """
@@ -80,6 +137,40 @@ def time_unixepoch2win(date):
         windows_timestamp = 0
     return windows_timestamp
 
+def sync_time_stamps(ref_time_stamps, time_stamps, tolerance):
+    """
+    Matches every reference time stamp with the nearest time stamp of
+    several other sorted sequences (vectorized with np.searchsorted)
+
+    Parameters
+    ----------
+    ref_time_stamps: sorted (M,) array with the reference time stamps
+    time_stamps: list of S sorted arrays
+    tolerance: maximum allowed time difference (same units)
+
+    Returns
+    -------
+    A (M', S + 1) int64 array of aligned row indices (the reference index
+    first). Reference time stamps without a match within tolerance in
+    every sequence are dropped
+    """
+    ref_time_stamps = np.asarray(ref_time_stamps)
+    columns = [np.arange(len(ref_time_stamps))]
+    matched = np.ones(len(ref_time_stamps), dtype=bool)
+    for seq_time_stamps in time_stamps:
+        seq_time_stamps = np.asarray(seq_time_stamps)
+        if len(seq_time_stamps) == 0:
+            return np.empty((0, len(time_stamps) + 1), dtype=np.int64)
+        right = np.clip(np.searchsorted(seq_time_stamps, ref_time_stamps),
+                        0, len(seq_time_stamps) - 1)
+        left = np.clip(right - 1, 0, None)
+        nearest = np.where(np.abs(seq_time_stamps[left] - ref_time_stamps) <=
+                           np.abs(seq_time_stamps[right] - ref_time_stamps),
+                           left, right)
+        matched &= np.abs(seq_time_stamps[nearest] - ref_time_stamps) <= tolerance
+        columns.append(nearest)
+    return np.stack(columns, axis=1)[matched].astype(np.int64)
+
 
 """
 log
@@ -122,22 +213,469 @@ def rename_if_exist(file_name, tail='.bak'):
         os.rename(file_name, new_file_name)
 
 
+"""
+concurrency & caching
+"""
+
+def prefetch_map(func, iterable, num_workers=4, prefetch=8):
+    """
+    Lazy, ordered and bounded version of map(func, iterable) running func in
+    a thread pool
+
+    Parameters
+    ----------
+    func: callable applied to every item. It should spend its time in code
+          releasing the GIL (file I/O, cv2 decoding, NumPy, ...)
+    iterable: the items to process
+    num_workers: number of threads
+    prefetch: maximum number of items submitted ahead of the consumer. No
+              more work is submitted until the consumer takes a result
+              (back-pressure), so memory stays bounded
+
+    Returns
+    -------
+    A generator yielding func(item) in the same order as iterable. Closing
+    the generator cancels the pending work
+    """
+    if num_workers < 1 or prefetch < 1:
+        raise Exception("Sorry, num_workers and prefetch must be positive")
+
+    items = iter(iterable)
+    pending = collections.deque()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=num_workers)
+    try:
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= prefetch:
+                break
+        while pending:
+            result = pending.popleft().result()
+            for item in items:
+                pending.append(executor.submit(func, item))
+                break
+            yield result
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+class ThreadedVideoWriter():
+    """
+    Drop-in replacement of cv2.VideoWriter that encodes and writes frames
+    in a single writer thread, fed through a bounded queue, so encoding
+    overlaps with the decoding and processing of the next frames
+    """
+
+    def __init__(self, file_name, fourcc, fps, frame_size, queue_size=16):
+        """
+        Parameters
+        ----------
+        file_name, fourcc, fps, frame_size: as in cv2.VideoWriter
+        queue_size: maximum number of frames waiting to be written. write()
+                    blocks when the queue is full (back-pressure)
+        """
+        self.__writer = cv2.VideoWriter(file_name, fourcc, fps, frame_size)
+        self.__queue = queue.Queue(maxsize=queue_size)
+        self.__error = None
+        self.__frames_written = 0
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def __run(self):
+        while True:
+            img = self.__queue.get()
+            if img is None:
+                break
+            if self.__error is not None:
+                continue  # keep draining so producers never block
+            try:
+                self.__writer.write(img)
+                self.__frames_written += 1
+            except Exception as error:
+                self.__error = error
+
+    def __check(self):
+        if self.__error is not None:
+            raise Exception(f"Sorry, the video writer failed: {self.__error}")
+
+    def isOpened(self):
+        return self.__writer.isOpened()
+
+    def write(self, img):
+        """ Queues a frame to be written (the image must not be modified later) """
+        self.__check()
+        self.__queue.put(img)
+
+    def release(self):
+        """
+        Waits until every queued frame is written and closes the video file
+
+        Returns
+        -------
+        The number of frames written
+        """
+        if self.__thread.is_alive():
+            self.__queue.put(None)
+            self.__thread.join()
+            self.__writer.release()
+        self.__check()
+        return self.__frames_written
+
+
+class LRUCache():
+    """
+    Thread safe least recently used cache of NumPy arrays bounded by a memory
+    budget (the sum of the nbytes of the cached arrays)
+    """
+
+    def __init__(self, max_bytes):
+        """
+        Parameters
+        ----------
+        max_bytes: memory budget in bytes
+        """
+        self.__max_bytes = int(max_bytes)
+        self.__items = collections.OrderedDict()
+        self.__nbytes = 0
+        self.__lock = threading.Lock()
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+
+    def __len__(self):
+        return len(self.__items)
+
+    def __evict(self):
+        # Must be called with the lock held
+        while self.__nbytes > self.__max_bytes:
+            _, arr = self.__items.popitem(last=False)
+            self.__nbytes -= arr.nbytes
+            self.__evictions += 1
+
+    def get(self, key):
+        """
+        Returns the array cached under key (marking it as the most recently
+        used) or None
+        """
+        with self.__lock:
+            arr = self.__items.get(key)
+            if arr is None:
+                self.__misses += 1
+                return None
+            self.__items.move_to_end(key)
+            self.__hits += 1
+            return arr
+
+    def put(self, key, arr):
+        """
+        Caches arr under key evicting the least recently used arrays until
+        the memory budget is met. Arrays larger than the budget are not cached
+        """
+        if arr.nbytes > self.__max_bytes:
+            return
+        with self.__lock:
+            old_arr = self.__items.pop(key, None)
+            if old_arr is not None:
+                self.__nbytes -= old_arr.nbytes
+            self.__items[key] = arr
+            self.__nbytes += arr.nbytes
+            self.__evict()
+
+    def resize(self, max_bytes):
+        """ Changes the memory budget, evicting arrays if needed """
+        with self.__lock:
+            self.__max_bytes = int(max_bytes)
+            self.__evict()
+
+    def clear(self):
+        """ Drops every cached array (counters are kept) """
+        with self.__lock:
+            self.__items.clear()
+            self.__nbytes = 0
+
+    def stats(self):
+        """
+        Returns a dict with the hits, misses, evictions, items, bytes and
+        max_bytes of the cache
+        """
+        with self.__lock:
+            return {'hits': self.__hits,
+                    'misses': self.__misses,
+                    'evictions': self.__evictions,
+                    'items': len(self.__items),
+                    'bytes': self.__nbytes,
+                    'max_bytes': self.__max_bytes}
+
+
+
+"""
+geometry
+"""
+
+class VoxelGrid():
+    """
+    Hashed voxel grid accumulating point clouds frame by frame. Every voxel
+    keeps the sum of its points and colors and its label votes, so memory
+    depends on the number of occupied voxels and not on the number of
+    points added
+    """
+
+    # Voxel coordinates are packed into one int64 hash key (21 bits per axis)
+    KEY_BITS = 21
+    KEY_OFFSET = 1 << (KEY_BITS - 1)
+
+    def __init__(self, voxel_size):
+        """
+        Parameters
+        ----------
+        voxel_size: voxel edge length (same units as the points)
+        """
+        if voxel_size <= 0:
+            raise Exception("Sorry, voxel_size must be positive")
+        self.voxel_size = voxel_size
+        self.__keys = np.empty(0, dtype=np.int64)  # sorted hash keys
+        self.__counts = np.empty(0, dtype=np.int64)
+        self.__sums = np.empty((0, 3), dtype=np.float64)
+        self.__color_sums = np.empty((0, 3), dtype=np.float64)
+        self.__label_ids = np.empty(0, dtype=np.int64)  # sorted labels
+        self.__votes = np.empty((0, 0), dtype=np.int32)
+
+    def __len__(self):
+        return len(self.__keys)
+
+    def __hash(self, points):
+        voxels = np.floor(points / self.voxel_size).astype(np.int64) + self.KEY_OFFSET
+        if voxels.size and (voxels.min() < 0 or voxels.max() >= 1 << self.KEY_BITS):
+            raise Exception("Sorry, the points are out of the voxel grid range")
+        return ((voxels[:, 0] << (2 * self.KEY_BITS)) |
+                (voxels[:, 1] << self.KEY_BITS) |
+                voxels[:, 2])
+
+    def add(self, points, colors=None, labels=None):
+        """
+        Adds a point cloud to the grid
+
+        Parameters
+        ----------
+        points: (N, 3) array
+        colors: optional (N, 3) array
+        labels: optional (N,) integer array, negative values do not vote
+        """
+        points = np.asarray(points, dtype=np.float64)
+        frame_keys, inverse = np.unique(self.__hash(points), return_inverse=True)
+        inverse = inverse.ravel()
+
+        # Voxels already in the grid are updated in place, the new ones are
+        # inserted keeping the keys sorted
+        pos = np.searchsorted(self.__keys, frame_keys)
+        found = pos < len(self.__keys)
+        found[found] = self.__keys[pos[found]] == frame_keys[found]
+        insert_at = pos[~found]
+        self.__keys = np.insert(self.__keys, insert_at, frame_keys[~found])
+        self.__counts = np.insert(self.__counts, insert_at, 0)
+        self.__sums = np.insert(self.__sums, insert_at, 0, axis=0)
+        self.__color_sums = np.insert(self.__color_sums, insert_at, 0, axis=0)
+        self.__votes = np.insert(self.__votes, insert_at, 0, axis=0)
+        # Positions of the frame voxels in the updated grid (np.insert puts
+        # the j-th inserted key at insert_at[j] + j)
+        pos[found] += np.searchsorted(insert_at, pos[found], side='right')
+        pos[~found] = insert_at + np.arange(len(insert_at))
+        point_pos = pos[inverse]
+
+        self.__counts[pos] += np.bincount(inverse, minlength=len(frame_keys))
+        for axis in range(3):
+            self.__sums[pos, axis] += np.bincount(inverse, points[:, axis],
+                                                  minlength=len(frame_keys))
+            if colors is not None:
+                self.__color_sums[pos, axis] += np.bincount(inverse, colors[:, axis],
+                                                            minlength=len(frame_keys))
+
+        if labels is not None:
+            labels = np.asarray(labels, dtype=np.int64)
+            voting = labels >= 0
+            new_label_ids = np.setdiff1d(labels[voting], self.__label_ids)
+            if len(new_label_ids):
+                columns = np.searchsorted(self.__label_ids, new_label_ids)
+                self.__label_ids = np.insert(self.__label_ids, columns, new_label_ids)
+                self.__votes = np.insert(self.__votes, columns, 0, axis=1)
+            num_of_labels = len(self.__label_ids)
+            cells = (point_pos[voting] * num_of_labels +
+                     np.searchsorted(self.__label_ids, labels[voting]))
+            cells, cell_votes = np.unique(cells, return_counts=True)
+            self.__votes.reshape(-1)[cells] += cell_votes.astype(np.int32)
+
+    def get_votes(self):
+        """
+        Returns a (M, 3) int64 array with the rows (voxel, label, votes),
+        where voxel is the row of the voxel in get_points()
+        """
+        voxels, columns = np.nonzero(self.__votes)
+        return np.stack([voxels,
+                         self.__label_ids[columns],
+                         self.__votes[voxels, columns]], axis=1).astype(np.int64)
+
+    def get_points(self):
+        """
+        Returns a tuple (points, colors, labels) with the centroids (K, 3),
+        the mean colors (K, 3) and the most voted label (K,) of every voxel
+        (-1 when a voxel has no votes)
+        """
+        counts = self.__counts[:, np.newaxis]
+        points = self.__sums / counts
+        colors = self.__color_sums / counts
+        labels = np.full(len(self.__keys), -1, dtype=np.int64)
+        if self.__votes.size:
+            voted = self.__votes.max(axis=1) > 0
+            labels[voted] = self.__label_ids[self.__votes[voted].argmax(axis=1)]
+        return points, colors, labels
+
+
 """
 MXNet + GluoncV
 """
 
+# Model names by family, the model zoo list is built only once
+MODEL_FAMILIES = {}
+
+def get_model_families():
+    """
+    Returns a dictionary with the names of the supported yolo and rcnn models
+    """
+    if not MODEL_FAMILIES:
+        models = list(gcv.model_zoo.get_model_list())
+        MODEL_FAMILIES['yolo'] = [models[i] for i in [176, 177, 179, 180, 182, 183]]
+        MODEL_FAMILIES['rcnn'] = [models[i] for i in [84, 86, 87, 88, 89, 91, 92, 93, 94, 95, 97]]
+    return MODEL_FAMILIES
+
 def get_yolo_models():
-    models = list(gcv.model_zoo.get_model_list())
-    yolo_models = [models[i] for i in [176, 177, 179, 180, 182, 183]]
-    return yolo_models
+    return list(get_model_families()['yolo'])
 
 def get_rcnn_models():
-    models = list(gcv.model_zoo.get_model_list())
-    rcnn_models = [models[i] for i in [84, 86, 87, 88, 89, 91, 92, 93, 94, 95, 97]]
-    return rcnn_models
+    return list(get_model_families()['rcnn'])
+
+def get_model_family(model):
+    """
+    Returns the family ('yolo' or 'rcnn') of a supported model
+    """
+    for family, models in get_model_families().items():
+        if model in models:
+            return family
+    raise Exception(f"Sorry, the model '{model}' is not allowed")
+
+
+class ModelRegistry():
+    """
+    Thread safe registry of GluonCV networks keyed by (model, ctx). A network
+    is loaded from the model zoo and hybridized the first time it is asked
+    for, and the same object is returned by later calls until it is evicted
+    """
+
+    def __init__(self):
+        self.__nets = collections.OrderedDict()
+        self.__lock = threading.Lock()
+        self.__hits = 0
+        self.__misses = 0
+
+    def __len__(self):
+        return len(self.__nets)
+
+    def get(self, model='yolo3_darknet53_coco', ctx=None):
+        """
+        Returns the (pretrained, hybridized) network of a model in a context
+
+        Parameters
+        ----------
+        model: a string with the model name
+        ctx: MXNet context, cpu by default
+        """
+        if ctx is None:
+            ctx = mx.context.cpu()
+        key = (model, str(ctx))
+        with self.__lock:
+            net = self.__nets.get(key)
+            if net is not None:
+                self.__hits += 1
+                return net
+            self.__misses += 1
+            # Loaded with the lock held, so concurrent callers don't load the
+            # same network twice
+            rh.logger.debug("loading model {} in {}", model, ctx)
+            net = gcv.model_zoo.get_model(model, pretrained=True, ctx=ctx)
+            net.hybridize(static_alloc=True)
+            self.__nets[key] = net
+        return net
+
+    def evict(self, model=None, ctx=None):
+        """
+        Removes networks from the registry
+
+        Parameters
+        ----------
+        model: model name to evict, all of them if None
+        ctx: MXNet context to evict, all of them if None
+
+        Returns
+        -------
+        The number of evicted networks
+        """
+        with self.__lock:
+            keys = [key for key in self.__nets
+                    if (model is None or key[0] == model) and
+                    (ctx is None or key[1] == str(ctx))]
+            for key in keys:
+                del self.__nets[key]
+        return len(keys)
+
+    def keys(self):
+        """ Returns a list with the (model, ctx) keys of the loaded networks """
+        with self.__lock:
+            return list(self.__nets)
+
+    def stats(self):
+        """ Returns a dictionary with hits, misses and items """
+        with self.__lock:
+            return {'hits': self.__hits,
+                    'misses': self.__misses,
+                    'items': len(self.__nets)}
+
+
+# Process wide registry of detection networks
+MODEL_REGISTRY = ModelRegistry()
+
+def get_detection_model(model='yolo3_darknet53_coco', gpu=False):
+    """
+    Returns a cached detection network (see ModelRegistry)
+
+    Parameters
+    ----------
+    model: a string with the model to apply
+    gpu: boolean indicating if gpu context must be used
+    """
+    get_model_family(model)
+    ctx_ = mx.context.gpu() if gpu else mx.context.cpu()
+    return MODEL_REGISTRY.get(model, ctx_)
+
+def evict_detection_models(model=None, gpu=None):
+    """
+    Removes detection networks from the process wide registry
+
+    Parameters
+    ----------
+    model: model name to evict, all of them if None
+    gpu: boolean indicating the context to evict (gpu if True, cpu if False),
+         both of them if None
+
+    Returns
+    -------
+    The number of evicted networks
+    """
+    ctx_ = None if gpu is None else (mx.context.gpu() if gpu else mx.context.cpu())
+    return MODEL_REGISTRY.evict(model, ctx_)
 
 def nn_out2df(class_ids, scores, bounding_boxs):
-    # to DataFrame
+    # to DataFrame (one dataframe per output, see filter_detections and
+    # detections2df for the long format used by lblrgbd_object_detection)
 
     df_class_ids = pd.DataFrame(class_ids.asnumpy()[0].tolist(),
                                 columns=['class_ids'])
@@ -149,6 +687,117 @@ def nn_out2df(class_ids, scores, bounding_boxs):
 
     return [df_class_ids, df_scores, df_bounding_boxs]
 
+def set_mxnet_threads(num_threads):
+    """
+    Sets the number of CPU threads used by MXNet operators
+
+    The OpenMP thread pool is resized in place if MXNet is already imported.
+    The engine worker threads (MXNET_CPU_WORKER_NTHREADS) are only read when
+    MXNet is imported, so they can only be set before its first use
+
+    Parameters
+    ----------
+    num_threads: number of threads
+    """
+    os.environ['OMP_NUM_THREADS'] = str(num_threads)
+    if 'mxnet' not in sys.modules:
+        os.environ['MXNET_CPU_WORKER_NTHREADS'] = str(num_threads)
+        return
+    set_num_omp_threads = getattr(mx.base._LIB, 'MXSetNumOMPThreads', None)
+    if set_num_omp_threads is None:
+        rh.logger.warning("MXNet is already imported, OMP_NUM_THREADS can't be changed")
+        return
+    mx.base.check_call(set_num_omp_threads(ctypes.c_int(num_threads)))
+
+def object_detection_batch(net, imgs, model_family='yolo'):
+    """ Object detection over a batch of images in a single forward pass
+
+    Parameters
+    ----------
+    net: a GluonCV detection network, e.g. from get_detection_model()
+    imgs: a list of preloaded images with HWC layout and the same shape
+    model_family: 'yolo' or 'rcnn', selects the preprocessing
+
+    Returns
+    -------
+    nn_out: a list with three MXNet ndarrays [class_ids, scores,
+            bounding_boxs] with one row per image
+    """
+    if model_family == 'yolo':
+        transform_test = gcv.data.transforms.presets.yolo.transform_test
+    elif model_family == 'rcnn':
+        transform_test = gcv.data.transforms.presets.rcnn.transform_test
+    else:
+        raise Exception(f"Sorry, the model family '{model_family}' is not allowed")
+
+    short_edge_size = min(imgs[0].shape[0:2])
+    trnf_imgs, _ = transform_test([mx.nd.array(img) for img in imgs],
+                                  short=short_edge_size)
+    # transform_test unpacks single element lists
+    if isinstance(trnf_imgs, list):
+        trnf_imgs = mx.nd.concat(*trnf_imgs, dim=0)
+
+    class_ids, scores, bounding_boxs = net(trnf_imgs)
+    return [class_ids, scores, bounding_boxs]
+
+def filter_detections(class_ids, scores, bounding_boxs, thresh=0.0):
+    """ Flattens the (batched) output of a detection network into one row
+    per detected object
+
+    Parameters
+    ----------
+    class_ids, scores, bounding_boxs: the network output, MXNet ndarrays or
+                                      NumPy arrays with shapes (N, K, 1),
+                                      (N, K, 1) and (N, K, 4)
+    thresh: minimum score of the returned detections
+
+    Returns
+    -------
+    A tuple (frame_pos, class_ids, scores, boxes) of NumPy arrays with shapes
+    (D,), (D,), (D,) and (D, 4), where frame_pos is the batch position of
+    every detection. -1 padding and scores below thresh are dropped
+    """
+    class_ids, scores, bounding_boxs = [
+        out.asnumpy() if hasattr(out, 'asnumpy') else np.asarray(out)
+        for out in (class_ids, scores, bounding_boxs)
+    ]
+    class_ids = class_ids[..., 0]
+    scores = scores[..., 0]
+    frame_pos, object_pos = np.nonzero((class_ids >= 0) & (scores >= thresh))
+    return (frame_pos,
+            class_ids[frame_pos, object_pos].astype(np.int64),
+            scores[frame_pos, object_pos],
+            bounding_boxs[frame_pos, object_pos])
+
+def detections2df(frame_ids, class_ids, scores, boxes):
+    """ Builds a long format dataframe of detections (see filter_detections)
+
+    Returns
+    -------
+    A dataframe with columns frame_id, class_id, score, xmin, ymin, xmax and
+    ymax, and a row per detected object
+    """
+    boxes = np.asarray(boxes).reshape(-1, 4)
+    return pd.DataFrame({'frame_id': np.asarray(frame_ids),
+                         'class_id': np.asarray(class_ids),
+                         'score': np.asarray(scores),
+                         'xmin': boxes[:, 0],
+                         'ymin': boxes[:, 1],
+                         'xmax': boxes[:, 2],
+                         'ymax': boxes[:, 3]})
+
+def concat_detections(detections):
+    """ Builds a single long format dataframe (see detections2df) from a
+    list of (frame_ids, class_ids, scores, boxes) tuples of NumPy arrays,
+    e.g. one per batch or per shard
+    """
+    if not detections:
+        return detections2df(np.empty(0, dtype=np.int64),
+                             np.empty(0, dtype=np.int64),
+                             np.empty(0, dtype=np.float32),
+                             np.empty((0, 4), dtype=np.float32))
+    return detections2df(*[np.concatenate(arrays) for arrays in zip(*detections)])
+
 def object_detection_with_gluoncv(img,
                                   model='yolo3_darknet53_coco',
                                   gpu=False):
@@ -167,19 +816,11 @@ def object_detection_with_gluoncv(img,
                to dataframes
     """
 
-    yolo_models = get_yolo_models()
-    rcnn_models = get_rcnn_models()
-
-    if model not in yolo_models + rcnn_models:
-        raise Exception(f"Sorry, the model '{model}' is not allowed")
+    model_family = get_model_family(model)
 
-    #  Set context to cpu or gpu
-    ctx_ = mx.context.gpu() if gpu else mx.context.cpu()
-
-    # Load Pretrained Model from the CV model zoo
-    net = gcv.model_zoo.get_model(model,
-                                  pretrained=True,
-                                  ctx=ctx_)
+    # Pretrained model from the CV model zoo, loaded (and hybridized) only
+    # the first time it is used in this context
+    net = get_detection_model(model, gpu)
 
     # Transform the Image
 
@@ -216,11 +857,11 @@ def object_detection_with_gluoncv(img,
     """
     short_edge_size = min(img.shape[0:2])
 
-    if model in yolo_models:
+    if model_family == 'yolo':
         rh.logger.trace("yolo_model: {}", model)
         trnf_img, chw_img = gcv.data.transforms.presets.yolo.transform_test(mx.nd.array(img),
                                                                             short=short_edge_size)
-    if model in rcnn_models:
+    if model_family == 'rcnn':
         rh.logger.trace("rcnn_model: {}", model)
         trnf_img, chw_img = gcv.data.transforms.presets.rcnn.transform_test(mx.nd.array(img),
                                                                             short=short_edge_size)
@@ -255,6 +896,199 @@ def object_detection_with_gluoncv(img,
     return chw_img, net.classes, nn_out
 
 
+"""
+Object detection evaluation
+"""
+
+# Class names (in network output order) of the GluonCV COCO detectors
+COCO_CLASSES = (
+    'person', 'bicycle', 'car', 'motorcycle', 'airplane', 'bus', 'train',
+    'truck', 'boat', 'traffic light', 'fire hydrant', 'stop sign',
+    'parking meter', 'bench', 'bird', 'cat', 'dog', 'horse', 'sheep', 'cow',
+    'elephant', 'bear', 'zebra', 'giraffe', 'backpack', 'umbrella', 'handbag',
+    'tie', 'suitcase', 'frisbee', 'skis', 'snowboard', 'sports ball', 'kite',
+    'baseball bat', 'baseball glove', 'skateboard', 'surfboard',
+    'tennis racket', 'bottle', 'wine glass', 'cup', 'fork', 'knife', 'spoon',
+    'bowl', 'banana', 'apple', 'sandwich', 'orange', 'broccoli', 'carrot',
+    'hot dog', 'pizza', 'donut', 'cake', 'chair', 'couch', 'potted plant',
+    'bed', 'dining table', 'toilet', 'tv', 'laptop', 'mouse', 'remote',
+    'keyboard', 'cell phone', 'microwave', 'oven', 'toaster', 'sink',
+    'refrigerator', 'book', 'clock', 'vase', 'scissors', 'teddy bear',
+    'hair drier', 'toothbrush'
+)
+
+# Robot@Home object types (see stuff/Robot@Home_object_categories.csv) with
+# an equivalent COCO class (see stuff/COCO_object_categories.csv)
+RH2COCO_CLASSES = {
+    'apple': 'apple',
+    'baby_chair': 'chair',
+    'banana': 'banana',
+    'bed': 'bed',
+    'book': 'book',
+    'books': 'book',
+    'bottle': 'bottle',
+    'bottles': 'bottle',
+    'bowl': 'bowl',
+    'chair': 'chair',
+    'clock': 'clock',
+    'clock_alarm': 'clock',
+    'computer_screen': 'tv',
+    'couch': 'couch',
+    'deck_chair': 'chair',
+    'fruit_bowl': 'bowl',
+    'hair_dryer': 'hair drier',
+    'juice_bottle': 'bottle',
+    'keyboard': 'keyboard',
+    'laptop': 'laptop',
+    'microwave': 'microwave',
+    'milk_bottle': 'bottle',
+    'mini_oven': 'oven',
+    'mouse': 'mouse',
+    'mug': 'cup',
+    'orange': 'orange',
+    'oven': 'oven',
+    'plant': 'potted plant',
+    'refrigerator': 'refrigerator',
+    'remote_contol': 'remote',
+    'remote_control': 'remote',
+    'sink': 'sink',
+    'smartphone': 'cell phone',
+    'table': 'dining table',
+    'teddy': 'teddy bear',
+    'teddy_bear': 'teddy bear',
+    'teddy_buzz': 'teddy bear',
+    'teddy_cow': 'teddy bear',
+    'teddy_heart': 'teddy bear',
+    'teddy_keny': 'teddy bear',
+    'teddy_olaf': 'teddy bear',
+    'teddy_pikachu': 'teddy bear',
+    'teddy_pumba': 'teddy bear',
+    'teddy_stan': 'teddy bear',
+    'toaster': 'toaster',
+    'toilet': 'toilet',
+    'tooth_brush': 'toothbrush',
+    'tv': 'tv',
+    'tv_set': 'tv',
+    'vase': 'vase',
+}
+
+def box_iou(boxes1, boxes2):
+    """
+    Returns the (N, M) intersection over union matrix of two arrays of boxes
+    with shapes (N, 4) and (M, 4) and xmin, ymin, xmax, ymax columns
+    """
+    boxes1 = np.asarray(boxes1, dtype=np.float64).reshape(-1, 4)
+    boxes2 = np.asarray(boxes2, dtype=np.float64).reshape(-1, 4)
+    top_left = np.maximum(boxes1[:, np.newaxis, :2], boxes2[np.newaxis, :, :2])
+    bottom_right = np.minimum(boxes1[:, np.newaxis, 2:], boxes2[np.newaxis, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area1 = np.prod(boxes1[:, 2:] - boxes1[:, :2], axis=1)
+    area2 = np.prod(boxes2[:, 2:] - boxes2[:, :2], axis=1)
+    union = area1[:, np.newaxis] + area2[np.newaxis, :] - intersection
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(union > 0, intersection / union, 0.0)
+
+def match_detections(det_frame_ids, det_class_ids, det_scores, det_boxes,
+                     gt_frame_ids, gt_class_ids, gt_boxes, iou_thresh=0.5):
+    """
+    Matches detections and ground truth boxes of the same frame and class.
+    In every frame, detections are taken by decreasing score and matched to
+    the unmatched ground truth box with the largest IoU (if it reaches
+    iou_thresh)
+
+    Returns
+    -------
+    A boolean array, True for the detections that are true positives
+    """
+    det_frame_ids = np.asarray(det_frame_ids)
+    gt_frame_ids = np.asarray(gt_frame_ids)
+    det_order = np.lexsort((-np.asarray(det_scores), det_frame_ids))
+    gt_order = np.argsort(gt_frame_ids, kind='stable')
+    det_frames = det_frame_ids[det_order]
+    det_classes = np.asarray(det_class_ids)[det_order]
+    det_boxes = np.asarray(det_boxes).reshape(-1, 4)[det_order]
+    gt_frames = gt_frame_ids[gt_order]
+    gt_classes = np.asarray(gt_class_ids)[gt_order]
+    gt_boxes = np.asarray(gt_boxes).reshape(-1, 4)[gt_order]
+
+    true_positives = np.zeros(len(det_frames), dtype=bool)
+    frames, det_starts = np.unique(det_frames, return_index=True)
+    det_ends = np.append(det_starts[1:], len(det_frames))
+    gt_starts = np.searchsorted(gt_frames, frames, side='left')
+    gt_ends = np.searchsorted(gt_frames, frames, side='right')
+    for d0, d1, g0, g1 in zip(det_starts, det_ends, gt_starts, gt_ends):
+        if g0 == g1:
+            continue
+        # IoU matrix of the frame, boxes of other classes don't overlap
+        iou = box_iou(det_boxes[d0:d1], gt_boxes[g0:g1])
+        iou[det_classes[d0:d1, np.newaxis] != gt_classes[np.newaxis, g0:g1]] = 0
+        # Only detections that overlap some box need the greedy assignment
+        matched = np.zeros(g1 - g0, dtype=bool)
+        for d in np.nonzero(iou.max(axis=1) >= iou_thresh)[0]:
+            candidates = np.where(matched, -1.0, iou[d])
+            g = candidates.argmax()
+            if candidates[g] >= iou_thresh:
+                matched[g] = True
+                true_positives[d0 + d] = True
+
+    # Back to the input order
+    result = np.empty_like(true_positives)
+    result[det_order] = true_positives
+    return result
+
+def average_precision(det_class_ids, det_scores, true_positives, gt_class_ids):
+    """
+    Computes per class precision, recall and average precision (area under
+    the interpolated precision-recall curve) in one pass over the
+    detections of every frame
+
+    Returns
+    -------
+    A dataframe with a row per class (of the detections or of the ground
+    truth) and columns class_id, num_gt, num_det, tp, precision, recall and
+    ap. Precision and recall are those of the whole set of detections, ap is
+    nan for classes without ground truth boxes
+    """
+    det_class_ids = np.asarray(det_class_ids, dtype=np.int64)
+    gt_class_ids = np.asarray(gt_class_ids, dtype=np.int64)
+    true_positives = np.asarray(true_positives, dtype=bool)
+    order = np.lexsort((-np.asarray(det_scores), det_class_ids))
+    det_classes = det_class_ids[order]
+    true_positives = true_positives[order]
+
+    classes = np.union1d(det_classes, gt_class_ids)
+    num_gt = np.searchsorted(np.sort(gt_class_ids), classes, side='right') - \
+        np.searchsorted(np.sort(gt_class_ids), classes, side='left')
+    det_starts = np.searchsorted(det_classes, classes, side='left')
+    det_ends = np.searchsorted(det_classes, classes, side='right')
+
+    num_tp = np.zeros(len(classes), dtype=np.int64)
+    ap = np.full(len(classes), np.nan)
+    for i, (d0, d1) in enumerate(zip(det_starts, det_ends)):
+        tp_cumsum = np.cumsum(true_positives[d0:d1])
+        num_tp[i] = tp_cumsum[-1] if d1 > d0 else 0
+        if num_gt[i] == 0:
+            continue
+        recall = tp_cumsum / num_gt[i]
+        precision = tp_cumsum / np.arange(1, d1 - d0 + 1)
+        # Precision envelope over the recall steps
+        mrec = np.concatenate(([0.0], recall, [1.0]))
+        mpre = np.concatenate(([0.0], precision, [0.0]))
+        mpre = np.maximum.accumulate(mpre[::-1])[::-1]
+        steps = np.nonzero(mrec[1:] != mrec[:-1])[0]
+        ap[i] = np.sum((mrec[steps + 1] - mrec[steps]) * mpre[steps + 1])
+
+    num_det = det_ends - det_starts
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return pd.DataFrame({'class_id': classes,
+                             'num_gt': num_gt,
+                             'num_det': num_det,
+                             'tp': num_tp,
+                             'precision': num_tp / num_det,
+                             'recall': num_tp / num_gt,
+                             'ap': ap})
+
+
 """
 Lab
 """
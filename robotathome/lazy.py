@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Lazy loading of heavy third party modules
+
+OpenCV, pandas, matplotlib, MXNet and GluonCV take seconds and hundreds of
+MB to import. The SQL and metadata APIs do not need them, so the rest of the
+package binds them through lazy_import() and they are only imported the
+first time one of their attributes is accessed.
+"""
+
+__author__ = "Gregorio Ambrosio"
+__contact__ = "gambrosio[at]uma.es"
+__copyright__ = "Copyright 2021, 2026, Gregorio Ambrosio"
+__date__ = "2026/10/17"
+__license__ = "MIT"
+
+import sys
+import importlib
+import types
+
+# One placeholder per module name, shared by every caller
+LAZY_MODULES = {}
+
+
+class LazyModule(types.ModuleType):
+    """
+    Placeholder that imports the named module on first attribute access
+    """
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.__dict__['_LazyModule__module'] = None
+
+    def __repr__(self):
+        state = 'loaded' if self.__module is not None else 'not loaded'
+        return f"<LazyModule '{self.__name__}' ({state})>"
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+    def __dir__(self):
+        return dir(self.load())
+
+    def is_loaded(self):
+        """
+        Returns True if the real module has already been imported
+        """
+        return self.__module is not None
+
+    def load(self):
+        """
+        Imports the real module (only once) and returns it
+
+        The attributes of the real module are copied in the placeholder so
+        later accesses do not go through __getattr__ anymore.
+        """
+        if self.__module is None:
+            module = importlib.import_module(self.__name__)
+            self.__dict__.update(module.__dict__)
+            self.__dict__['_LazyModule__module'] = module
+        return self.__module
+
+
+def lazy_import(name):
+    """
+    Returns the module called name if it is already imported, or a
+    LazyModule placeholder that will import it on first use
+
+    Parameters
+    ----------
+    name: full module name, e.g. 'cv2' or 'matplotlib.pyplot'
+
+    Returns
+    -------
+    A module or a LazyModule instance
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    if name not in LAZY_MODULES:
+        LAZY_MODULES[name] = LazyModule(name)
+    return LAZY_MODULES[name]
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+""" Robot@Home renderer.py
+
+Batch rendering of the rgb videos of every (home_session, home_subsession,
+room, sensor) sequence returned by RobotAtHome.get_locators(). Sequences are
+sharded over a pool of processes, each one with its own RobotAtHome object
+(sqlite connections can't be shared between processes).
+
+Videos are written under a temporary name and renamed when they are complete,
+and every finished sequence is appended to a csv manifest, so an interrupted
+run can be resumed by launching the same command again.
+
+Usage:
+    python -m robotathome.renderer --rh_path=<rh_path> --wspc_path=<wspc_path>
+"""
+
+__author__ = "Gregorio Ambrosio"
+__contact__ = "gambrosio[at]uma.es"
+__copyright__ = "Copyright 2021, 2026, Gregorio Ambrosio"
+__date__ = "2026/10/17"
+__license__ = "MIT"
+
+
+import os
+import csv
+import time
+import concurrent.futures
+import fire
+import cv2
+import robotathome as rh
+
+
+# =========================
+#      GLOBAL VARIABLES
+# =========================
+# RobotAtHome object and workspace path of the current (worker) process
+RH = None
+WSPC_PATH = '.'
+# Manifest columns
+MANIFEST_FIELDS = ['video_file_name', 'home_session_name', 'home_subsession',
+                   'room_name', 'sensor_name', 'status', 'frames', 'seconds',
+                   'error']
+# Statuses that don't need to be rendered again
+DONE_STATUSES = ('rendered', 'skipped', 'empty')
+
+
+def get_render_jobs(rh_obj, sensor_names=('RGBD_1', 'RGBD_2', 'RGBD_3', 'RGBD_4')):
+
+    """
+    Returns a list of (home_session_name, home_subsession, room_name,
+    sensor_name) tuples, one for every locator and sensor
+    """
+
+    locators = rh_obj.get_locators()
+    return [(row.home_session_name, int(row.home_subsession_id), row.room_name,
+             sensor_name)
+            for row in locators.itertuples()
+            for sensor_name in sensor_names]
+
+
+def get_video_file_name(job, output_path='videos'):
+
+    """
+    Returns the (wspc_path relative) video file name of a render job
+    """
+
+    home_session_name, home_subsession, room_name, sensor_name = job
+    return os.path.join(output_path,
+                        f'{home_session_name}_{home_subsession}_{room_name}_{sensor_name}.avi')
+
+
+def get_video_frame_count(video_path_file_name):
+
+    """
+    Returns the number of frames of a video file, or -1 if it can't be opened
+    """
+
+    if not os.path.isfile(video_path_file_name):
+        return -1
+    cap = cv2.VideoCapture(video_path_file_name)
+    if not cap.isOpened():
+        return -1
+    num_of_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    return num_of_frames
+
+
+def read_manifest(manifest_path_file_name):
+
+    """
+    Returns a dictionary with the last manifest row of every video file name
+    """
+
+    manifest = {}
+    if os.path.isfile(manifest_path_file_name):
+        with open(manifest_path_file_name, newline='') as manifest_file:
+            for row in csv.DictReader(manifest_file):
+                manifest[row['video_file_name']] = row
+    return manifest
+
+
+def _init_worker(rh_path, wspc_path, db_filename, materialize):
+
+    """ Opens the dataset once per worker process """
+
+    global RH, WSPC_PATH
+    WSPC_PATH = wspc_path
+    RH = rh.RobotAtHome(rh_path, wspc_path, db_filename,
+                        materialize=materialize)
+
+
+def _render_job(job, source, output_path, stride, resize, num_threads, overwrite):
+
+    """
+    Renders the video of a job and returns its manifest row. Existing videos
+    with the expected number of frames are kept
+    """
+
+    home_session_name, home_subsession, room_name, sensor_name = job
+    video_file_name = get_video_file_name(job, output_path)
+    result = dict(video_file_name=video_file_name,
+                  home_session_name=home_session_name,
+                  home_subsession=home_subsession,
+                  room_name=room_name,
+                  sensor_name=sensor_name,
+                  status='failed',
+                  frames=0,
+                  seconds=0.0,
+                  error='')
+
+    start_time = time.perf_counter()
+    try:
+        rows = RH.get_sensor_observation_files(source,
+                                               home_session_name,
+                                               home_subsession,
+                                               room_name,
+                                               sensor_name,
+                                               df=False)
+        # At least two frames are needed to compute the frame rate
+        if len(rows) < 2:
+            result['status'] = 'empty'
+            return result
+
+        num_of_frames = len(rows[::stride])
+        result['frames'] = num_of_frames
+        video_path_file_name = os.path.join(WSPC_PATH, video_file_name)
+        if (not overwrite and
+                get_video_frame_count(video_path_file_name) == num_of_frames):
+            result['status'] = 'skipped'
+            return result
+
+        # Written under a temporary name, so an interrupted render is never
+        # taken for a complete video
+        temp_file_name = video_file_name + '.part.avi'
+        RH.get_video_from_rgbd(source,
+                               home_session_name,
+                               home_subsession,
+                               room_name,
+                               sensor_name,
+                               video_file_name=temp_file_name,
+                               stride=stride,
+                               resize=resize,
+                               num_workers=num_threads)
+        os.replace(os.path.join(WSPC_PATH, temp_file_name),
+                   video_path_file_name)
+        result['status'] = 'rendered'
+    except Exception as err:
+        result['error'] = repr(err)
+    finally:
+        result['seconds'] = round(time.perf_counter() - start_time, 3)
+
+    return result
+
+
+def render_videos(rh_path='.',
+                  wspc_path='.',
+                  db_filename='rh.db',
+                  source='lblrgbd',
+                  sensor_names=('RGBD_1', 'RGBD_2', 'RGBD_3', 'RGBD_4'),
+                  output_path='videos',
+                  manifest_file_name='manifest.csv',
+                  stride=1,
+                  resize=None,
+                  num_processes=None,
+                  num_threads=2,
+                  materialize=True,
+                  overwrite=False):
+
+    """
+    Renders the rgb video of every (home_session, home_subsession, room,
+    sensor) sequence in parallel
+
+    Parameters
+    ----------
+    sensor_names: sensors whose sequences are rendered
+    output_path: folder (relative to wspc_path) where videos are stored
+    manifest_file_name: csv file (in output_path) where a row with the
+                        status, number of frames and elapsed seconds of every
+                        sequence is appended as soon as it finishes
+    stride, resize: see RobotAtHome.get_video_from_rgbd
+    num_processes: number of worker processes (default os.cpu_count())
+    num_threads: number of decoding threads per worker process
+    materialize: see RobotAtHome, the materialized table is built once by
+                 the calling process and shared by the workers
+    overwrite: boolean indicating if complete videos are rendered again
+
+    Returns
+    -------
+    A dictionary with the number of sequences by status
+    """
+
+    # The calling process lists the jobs (and materializes the lblrgbd table
+    # before the workers open the dataset)
+    rh_obj = rh.RobotAtHome(rh_path, wspc_path, db_filename,
+                            materialize=materialize)
+    jobs = get_render_jobs(rh_obj, tuple(sensor_names))
+    del rh_obj
+
+    os.makedirs(os.path.join(wspc_path, output_path), exist_ok=True)
+    manifest_path_file_name = os.path.join(wspc_path, output_path,
+                                           manifest_file_name)
+
+    # Resuming: sequences finished in a previous run are not submitted again
+    manifest = read_manifest(manifest_path_file_name)
+    pending_jobs = []
+    for job in jobs:
+        row = manifest.get(get_video_file_name(job, output_path))
+        if (overwrite or row is None or row['status'] not in DONE_STATUSES or
+                (row['status'] != 'empty' and
+                 not os.path.isfile(os.path.join(wspc_path,
+                                                 row['video_file_name'])))):
+            pending_jobs.append(job)
+    rh.logger.info("{} sequences, {} already done, {} pending",
+                   len(jobs), len(jobs) - len(pending_jobs), len(pending_jobs))
+
+    summary = {}
+    new_manifest = not os.path.isfile(manifest_path_file_name)
+    with open(manifest_path_file_name, 'a', newline='') as manifest_file, \
+         concurrent.futures.ProcessPoolExecutor(
+             max_workers=num_processes,
+             initializer=_init_worker,
+             initargs=(rh_path, wspc_path, db_filename, materialize)
+         ) as executor:
+        writer = csv.DictWriter(manifest_file, fieldnames=MANIFEST_FIELDS)
+        if new_manifest:
+            writer.writeheader()
+        futures = [executor.submit(_render_job, job, source, output_path,
+                                   stride, resize, num_threads, overwrite)
+                   for job in pending_jobs]
+        for future in concurrent.futures.as_completed(futures):
+            result = future.result()
+            writer.writerow(result)
+            # Flushed row by row, so an interrupted run keeps its progress
+            manifest_file.flush()
+            summary[result['status']] = summary.get(result['status'], 0) + 1
+            rh.logger.info("{status}: {video_file_name} ({frames} frames, {seconds} s)",
+                           **result)
+            if result['error']:
+                rh.logger.error("{}: {}", result['video_file_name'], result['error'])
+
+    return summary
+
+
+def main():
+    fire.Fire(render_videos)
+    return 0
+
+
+if __name__ == "__main__":
+    main()
@@ -11,39 +11,123 @@ import sys
 import datetime as dt
 import sqlite3
 import os
-import cv2
+import hashlib
+import io
+import itertools
+import threading
 import numpy as np
-import pandas as pd
-import mxnet as mx
-from mxnet import image
-from mxnet import context
-import gluoncv as gcv
-from gluoncv import model_zoo, data, utils
 # from matplotlib import pyplot as plt
 # import helpers
+from robotathome.lazy import lazy_import
 import robotathome as rh
 # import fire
 
+# Heavy backends are imported on first use (see lazy.py)
+cv2 = lazy_import('cv2')
+pd = lazy_import('pandas')
+mx = lazy_import('mxnet')
+gcv = lazy_import('gluoncv')
+
 
 class RobotAtHome():
     """
     RobotAtHome class with methods for Robot@Home dataset v2.x.y
     """
 
+    # Five-way join behind rh_temp_lblrgbd
+    LBLRGBD_SELECT = '''
+        select
+            rh_lblrgbd.id,
+            rh_lblrgbd.home_session_id as hs_id,
+            rh_home_sessions.name as hs_name,
+            rh_lblrgbd.home_subsession_id as hss_id,
+            rh_lblrgbd.home_id as h_id,
+            rh_homes.name as h_name,
+            rh_lblrgbd.room_id as r_id,
+            rh_rooms.name as r_name,
+            rh_lblrgbd.sensor_id as s_id,
+            rh_sensors.name as s_name,
+            rh_lblrgbd.time_stamp as t,
+            rh_lblrgbd.sensor_pose_x as s_px,
+            rh_lblrgbd.sensor_pose_y as s_py,
+            rh_lblrgbd.sensor_pose_z as s_pz,
+            rh_lblrgbd.sensor_pose_yaw as s_pya,
+            rh_lblrgbd.sensor_pose_pitch as s_ppi,
+            rh_lblrgbd.sensor_pose_roll as s_pro,
+            rh2_old2new_rgbd_files.new_file_1 as f1,
+            rh2_old2new_rgbd_files.new_file_2 as f2,
+            rh2_old2new_rgbd_files.new_file_3 as f3,
+            rh2_old2new_rgbd_files.new_path as pth
+        from rh_lblrgbd
+        inner join rh_home_sessions on home_session_id = rh_home_sessions.id
+        inner join rh_homes on rh_lblrgbd.home_id = rh_homes.id
+        inner join rh_rooms on rh_lblrgbd.room_id = rh_rooms.id
+        inner join rh_sensors on rh_lblrgbd.sensor_id = rh_sensors.id
+        inner join rh2_old2new_rgbd_files on rh2_old2new_rgbd_files.id = rh_lblrgbd.id
+        '''
+
+    # Meters per depth level of the depth images. 8 bit images span the
+    # default maximum range of MRPT 3D range scans (10 m), 16 bit images are
+    # stored in millimeters
+    DEPTH_SCALE_8BIT = 10.0 / 255
+    DEPTH_SCALE_16BIT = 1e-3
+    # Nominal field of view (degrees) of the Asus Xtion depth camera
+    DEPTH_CAMERA_HFOV = 58.0
+    DEPTH_CAMERA_VFOV = 45.0
+    # Shape (rows, columns) of the rotated rgb and depth images
+    LBLRGBD_IMAGE_SHAPE = (320, 240)
+    # Left to right order of the rgbd cameras in composed videos
+    COMPOSITION_ORDER = ('RGBD_3', 'RGBD_4', 'RGBD_1', 'RGBD_2')
+    # Number of bits (i.e. of labels) of a label mask pixel
+    MASK_BITS = 64
+
     def __init__(self,
                  rh_path='.',
                  wspc_path='.',
                  db_filename='rh.db',
                  rgbd_path='files/rgbd',
-                 scene_path='files/scene'):
-        """ RobotAtHome constructor method """
+                 scene_path='files/scene',
+                 cache_path='rh_cache',
+                 materialize=False,
+                 frame_cache_size=0,
+                 mask_cache=False,
+                 results_db_filename='rh_results.db'):
+        """ RobotAtHome constructor method
+
+        Parameters
+        ----------
+        cache_path: folder (relative to wspc_path) where derived data, e.g.
+                    materialized tables, is stored
+        materialize: boolean indicating if rh_temp_lblrgbd is backed by an
+                     indexed table in the cache database (True) instead of a
+                     five-way join view (False)
+        frame_cache_size: memory budget in bytes of an LRU cache of decoded
+                          frames keyed by (so_id, channel). 0 (default)
+                          disables the cache
+        mask_cache: boolean indicating if label masks are read from (and
+                    stored into) binary .npy files in the cache folder
+                    instead of parsing the labels text files every time.
+                    Entries are keyed by the size and modification time of
+                    their labels file, so edited files are parsed again
+        results_db_filename: database (relative to wspc_path, or an absolute
+                             path) where object detections are stored
+        """
         self.__rh_path = rh_path
         self.__wspc_path = wspc_path
         self.__db_filename = db_filename
         self.__rgbd_path = rgbd_path
         self.__scene_path = scene_path
+        self.__cache_path = os.path.join(wspc_path, cache_path)
+        self.__materialize = materialize
         self.__con = None
         self.__rgbd_views = []
+        self.__files_index = None
+        self.__poses = None
+        self.__ray_grids = {}
+        self.__frame_cache = None
+        self.set_frame_cache_size(frame_cache_size)
+        self.__mask_cache = mask_cache
+        self.__results_db_filename = results_db_filename
 
         # Initialization functions
         self.__open_dataset()
@@ -80,40 +164,23 @@ class RobotAtHome():
         This function creates temporary views to work on the class environment
         """
 
-        sql_str = '''
-        begin transaction;
-        drop view if exists rh_temp_lblrgbd;
-        create temp view rh_temp_lblrgbd as
-        select
-            rh_lblrgbd.id,
-            rh_lblrgbd.home_session_id as hs_id,
-            rh_home_sessions.name as hs_name,
-            rh_lblrgbd.home_subsession_id as hss_id,
-            rh_lblrgbd.home_id as h_id,
-            rh_homes.name as h_name,
-            rh_lblrgbd.room_id as r_id,
-            rh_rooms.name as r_name,
-            rh_lblrgbd.sensor_id as s_id,
-            rh_sensors.name as s_name,
-            rh_lblrgbd.time_stamp as t,
-            rh_lblrgbd.sensor_pose_x as s_px,
-            rh_lblrgbd.sensor_pose_y as s_py,
-            rh_lblrgbd.sensor_pose_z as s_pz,
-            rh_lblrgbd.sensor_pose_yaw as s_pya,
-            rh_lblrgbd.sensor_pose_pitch as s_ppi,
-            rh_lblrgbd.sensor_pose_roll as s_pro,
-            rh2_old2new_rgbd_files.new_file_1 as f1,
-            rh2_old2new_rgbd_files.new_file_2 as f2,
-            rh2_old2new_rgbd_files.new_file_3 as f3,
-            rh2_old2new_rgbd_files.new_path as pth
-        from rh_lblrgbd
-        inner join rh_home_sessions on home_session_id = rh_home_sessions.id
-        inner join rh_homes on rh_lblrgbd.home_id = rh_homes.id
-        inner join rh_rooms on rh_lblrgbd.room_id = rh_rooms.id
-        inner join rh_sensors on rh_lblrgbd.sensor_id = rh_sensors.id
-        inner join rh2_old2new_rgbd_files on rh2_old2new_rgbd_files.id = rh_lblrgbd.id;
-        commit;
-        '''
+        if self.__materialize:
+            self.__materialize_lblrgbd()
+            sql_str = '''
+            begin transaction;
+            drop view if exists rh_temp_lblrgbd;
+            create temp view rh_temp_lblrgbd as
+            select * from rh_cache.rh2_lblrgbd;
+            commit;
+            '''
+        else:
+            sql_str = f'''
+            begin transaction;
+            drop view if exists rh_temp_lblrgbd;
+            create temp view rh_temp_lblrgbd as
+            {self.LBLRGBD_SELECT};
+            commit;
+            '''
 
         # Get a cursor to execute SQLite statements
         cur = self.__con.cursor()
@@ -122,12 +189,273 @@ class RobotAtHome():
         self.__rgbd_views.append("rh_temp_lblrgbd")
         rh.logger.trace("The view rh_temp_lblrgbd has been created")
 
+    def __get_db_fingerprint(self):
+        """
+        Returns a string that changes whenever rh.db (or the definition of
+        the materialized select) changes. It is built from the size and the
+        modification time of the database file, so it costs a single stat()
+        """
+        db_stat = os.stat(os.path.join(self.__rh_path, self.__db_filename))
+        fingerprint = hashlib.sha1()
+        fingerprint.update(f"{db_stat.st_size}:{db_stat.st_mtime_ns}".encode())
+        fingerprint.update(self.LBLRGBD_SELECT.encode())
+        return fingerprint.hexdigest()
+
+    def __attach_cache(self):
+        """
+        Attaches (creating it if needed) the cache database as rh_cache.
+
+        Derived tables are kept there instead of in rh.db, so the dataset
+        file is never modified and its fingerprint stays stable.
+        """
+        if 'rh_cache' in [row[1] for row in self.__fetchall("pragma database_list")]:
+            return
+        os.makedirs(self.__cache_path, exist_ok=True)
+        cache_full_path = os.path.join(self.__cache_path, 'rh_cache.db')
+        self.__con.execute("attach database ? as rh_cache", (cache_full_path,))
+        self.__con.executescript('''
+            create table if not exists rh_cache.rh2_fingerprints (
+                name text primary key,
+                fingerprint text
+            );
+            ''')
+        rh.logger.debug("cache database attached: {}", cache_full_path)
+
+    def __attach_results(self):
+        """
+        Attaches (creating it if needed) the results database as rh_results.
+
+        Object detections are not stored in rh.db: writing to it would change
+        its fingerprint and invalidate the materialized tables.
+        rh2_detections holds a row per detected object, and
+        rh2_detected_frames a row per processed (so_id, model), so frames
+        without detections are not processed again either.
+        """
+        if 'rh_results' in [row[1] for row in self.__fetchall("pragma database_list")]:
+            return
+        results_full_path = os.path.join(self.__wspc_path, self.__results_db_filename)
+        self.__con.execute("attach database ? as rh_results", (results_full_path,))
+        self.__con.executescript('''
+            create table if not exists rh_results.rh2_detected_frames (
+                so_id integer,
+                model text,
+                primary key (so_id, model)
+            ) without rowid;
+            create table if not exists rh_results.rh2_detections (
+                so_id integer,
+                model text,
+                class_id integer,
+                score real,
+                xmin real,
+                ymin real,
+                xmax real,
+                ymax real
+            );
+            create index if not exists rh_results.idx_rh2_detections
+                on rh2_detections(so_id, model);
+            ''')
+        rh.logger.debug("results database attached: {}", results_full_path)
+
+    def __materialize_lblrgbd(self):
+        """
+        This function stores the rh_temp_lblrgbd join in the table
+        rh_cache.rh2_lblrgbd. The table is only rebuilt when the rh.db
+        fingerprint changes.
+
+        Sensor observations are looked up by id (the table primary key) or
+        by locator, i.e. (hs_name, hss_id, r_name, s_name) ordered by t.
+        The locator index also contains every column returned by
+        get_sensor_observation_files, so sequence lookups are served by an
+        index range scan without touching the table.
+        """
+        self.__attach_cache()
+        fingerprint = self.__get_db_fingerprint()
+        row = self.__fetchone(
+            "select fingerprint from rh_cache.rh2_fingerprints where name = ?",
+            ('rh2_lblrgbd',)
+        )
+        if row is not None and row[0] == fingerprint:
+            rh.logger.trace("rh_cache.rh2_lblrgbd is up to date")
+            return
+
+        rh.logger.info("Materializing rh_temp_lblrgbd into rh_cache.rh2_lblrgbd")
+        sql_str = f'''
+        begin transaction;
+        drop table if exists rh_cache.rh2_lblrgbd;
+        create table rh_cache.rh2_lblrgbd (
+            id integer primary key,
+            hs_id integer,
+            hs_name text,
+            hss_id integer,
+            h_id integer,
+            h_name text,
+            r_id integer,
+            r_name text,
+            s_id integer,
+            s_name text,
+            t integer,
+            s_px real,
+            s_py real,
+            s_pz real,
+            s_pya real,
+            s_ppi real,
+            s_pro real,
+            f1 text,
+            f2 text,
+            f3 text,
+            pth text
+        );
+        insert into rh_cache.rh2_lblrgbd
+        {self.LBLRGBD_SELECT};
+        create index rh_cache.idx_rh2_lblrgbd_locator
+            on rh2_lblrgbd(hs_name, hss_id, r_name, s_name, t, id, pth, f1, f2, f3);
+        create index rh_cache.idx_rh2_lblrgbd_locator_id
+            on rh2_lblrgbd(hs_id, hss_id, r_id, s_id, t, id);
+        insert or replace into rh_cache.rh2_fingerprints (name, fingerprint)
+            values ('rh2_lblrgbd', '{fingerprint}');
+        commit;
+        '''
+        self.__con.executescript(sql_str)
+        rh.logger.info("rh_cache.rh2_lblrgbd has been created")
+
     def get_con(self):
         """
         This function returns the sql connection variable
         """
         return self.__con
 
+    def __fetchall(self, sql_str, parms=()):
+        """
+        Executes a parameter bound sql statement and returns its rows as a
+        list of plain tuples
+
+        sqlite3 keeps a per connection cache of prepared statements keyed by
+        the sql text. Lookups must keep their sql text constant and pass
+        every value through parms, so that repeated calls skip the parsing
+        and planning stage and no DataFrame is built.
+        """
+        return self.__con.execute(sql_str, parms).fetchall()
+
+    def __fetchone(self, sql_str, parms=()):
+        """
+        Same as __fetchall but returns only the first row (or None)
+        """
+        return self.__con.execute(sql_str, parms).fetchone()
+
+    def __fetchall_ids(self, sql_str, ids, parms=()):
+        """
+        Same as __fetchall for queries filtered by a batch of ids. The ids
+        are loaded into the temporary table rh_temp_ids(id), which sql_str
+        must join, so its text keeps constant whatever the number of ids
+        """
+        ids = np.unique(np.asarray(ids, dtype=np.int64))
+        with self.__con:
+            self.__con.execute(
+                "create temp table if not exists rh_temp_ids (id integer primary key)")
+            self.__con.execute("delete from rh_temp_ids")
+            self.__con.executemany("insert into rh_temp_ids values (?)",
+                                   zip(ids.tolist()))
+        return self.__fetchall(sql_str, parms)
+
+    def __load_files_index(self):
+        """
+        Loads (only once) a compact in-memory index of the lblrgbd files
+
+        Returns
+        -------
+        A tuple (ids, pth_names, pth_codes, files, pth_prefixes) where:
+        ids          : sorted int64 array with the sensor observation ids
+        pth_names    : object array with the distinct relative paths
+        pth_codes    : int32 array, pth_names[pth_codes[i]] is the path of
+                       ids[i]
+        files        : (N, 3) object array with the f1, f2 and f3 file names
+                       (depth, intensity and labels) of ids[i]
+        pth_prefixes : object array with the full folder (ending with a
+                       separator) of each distinct path
+
+        Paths are dictionary encoded (a few hundred distinct values are
+        shared by tens of thousands of observations) and ids are resolved
+        with a binary search, so no sql query is run per frame.
+        """
+        if self.__files_index is None:
+            rows = self.__fetchall(
+                """
+                select id, pth, f1, f2, f3
+                from rh_temp_lblrgbd
+                order by id
+                """
+            )
+            ids = np.array([row[0] for row in rows], dtype=np.int64)
+            pth_names, pth_codes = np.unique(
+                np.array([row[1] for row in rows], dtype=object),
+                return_inverse=True
+            )
+            files = np.empty((len(rows), 3), dtype=object)
+            files[:] = [row[2:] for row in rows]
+            pth_prefixes = np.array(
+                [os.path.join(self.__rh_path, self.__rgbd_path, pth_name, '')
+                 for pth_name in pth_names],
+                dtype=object
+            )
+            self.__files_index = (ids,
+                                  pth_names,
+                                  pth_codes.astype(np.int32),
+                                  files,
+                                  pth_prefixes)
+            rh.logger.debug("lblrgbd files index loaded: {} observations, {} paths",
+                            len(ids), len(pth_names))
+        return self.__files_index
+
+    def __get_files_index_positions(self, ids):
+        """
+        Returns the positions of the sensor observation ids in the files
+        index. An exception is raised if any id does not belong to lblrgbd
+        """
+        index_ids = self.__load_files_index()[0]
+        ids = np.asarray(ids, dtype=np.int64).ravel()
+        pos = np.searchsorted(index_ids, ids)
+        found = pos < len(index_ids)
+        found[found] = index_ids[pos[found]] == ids[found]
+        if not found.all():
+            raise Exception(f"Sorry, the sensor observations {ids[~found].tolist()} do not belong to lblrgbd")
+        return pos
+
+    def __get_lblrgbd_files(self, so_id):
+        """
+        Returns a tuple (pth, f1, f2, f3) with the relative path and the
+        depth, intensity and labels file names of a lblrgbd observation
+        """
+        _, pth_names, pth_codes, files, _ = self.__load_files_index()
+        pos = self.__get_files_index_positions(so_id)[0]
+        return (pth_names[pth_codes[pos]],) + tuple(files[pos])
+
+    def get_lblrgbd_file_names(self, ids, file_type='intensity'):
+        """
+        Returns the full path file names of a batch of lblrgbd observations
+
+        Parameters
+        ----------
+        ids: a sequence (or NumPy array) of sensor observation ids
+        file_type: 'depth', 'intensity' or 'labels'
+
+        Returns
+        -------
+        A list of strings in the same order as ids
+        """
+        switcher = {
+            "depth": 0,
+            "intensity": 1,
+            "labels": 2,
+        }
+        column = switcher.get(file_type)
+        if column is None:
+            raise Exception(f"Sorry, the file type '{file_type}' is not allowed")
+
+        _, _, pth_codes, files, pth_prefixes = self.__load_files_index()
+        pos = self.__get_files_index_positions(ids)
+        # Element-wise concatenation of object (str) arrays
+        return (pth_prefixes[pth_codes[pos]] + files[pos, column]).tolist()
+
     def select_column(self, column_name, table_name):
         '''
         Returns a dataframe with grouped column values
@@ -271,67 +599,57 @@ class RobotAtHome():
                                      home_session_name='alma-s1',
                                      home_subsession=0,
                                      room_name='alma_masterroom1',
-                                     sensor_name='RGBD_1'
+                                     sensor_name='RGBD_1',
+                                     df=True
                                      ):
 
         """
         This functions queries the database to extract sensor observation
         files filtered by home_session_name, home_subsession, room_name, and
         sensor_name.
-        """
 
-        # Get a cursor to execute SQLite statements
-        cur = self.__con.cursor()
+        Parameters
+        ----------
+        df: boolean indicating if result is returned as a DataFrame (True) or
+            as a NumPy structured array with fields id, t, pth, f1, f2, f3
+            (False)
+        """
 
         switcher = {
             # rh_temp_lblrgbd created in _create_temp_views at the begining
             "lblrgbd": "rh_temp_lblrgbd",
         }
-        sensor_observation_table = switcher.get(source, lambda: "Invalid argument")
-
-        # Build the query
-        # sql_str = (
-        #     '''
-        #     select id, t, pth, f1, f2, f3
-        #     from
-        #     ''' +
-        #     sensor_observation_table +
-        #     '''
-        #     where
-        #         hs_name = ? and
-        #         hss_id = ? and
-        #         r_name = ? and
-        #         s_name = ?
-        #     order by t
-        #     '''
-        # )
-        #
-        # parms = (home_session_name,
-        #          home_subsession,
-        #          room_name,
-        #          sensor_name)
-        # cur.execute(sql_str, parms)
-        3
-        # cur.execute(sql_str)
-        # rows = cur.fetchall()
+        sensor_observation_table = switcher.get(source)
+        if sensor_observation_table is None:
+            raise Exception(f"Sorry, the source '{source}' is not allowed")
 
+        # Only the (whitelisted) table name is formatted into the sql text,
+        # the filter values are bound as parameters
         sql_str = (
             f'''
             select id, t, pth, f1, f2, f3
             from {sensor_observation_table}
             where
-                hs_name = '{home_session_name}' and
-                hss_id = {home_subsession} and
-                r_name = '{room_name}' and
-                s_name = '{sensor_name}'
+                hs_name = ? and
+                hss_id = ? and
+                r_name = ? and
+                s_name = ?
             order by t
             '''
         )
+        parms = (home_session_name,
+                 int(home_subsession),
+                 room_name,
+                 sensor_name)
         rh.logger.debug(sql_str)
 
-        df_rows = pd.read_sql_query(sql_str, self.__con)
+        if df:
+            return pd.read_sql_query(sql_str, self.__con, params=parms)
 
-        return df_rows
+        return np.array(self.__fetchall(sql_str, parms),
+                        dtype=[('id', np.int64), ('t', np.int64),
+                               ('pth', object), ('f1', object),
+                               ('f2', object), ('f3', object)])
 
     def get_video_from_rgbd(self,
                             source='lblrgbd',
@@ -339,34 +657,65 @@ class RobotAtHome():
                             home_subsession=0,
                             room_name='alma_masterroom1',
                             sensor_name='RGBD_1',
-                            video_file_name=None
+                            video_file_name=None,
+                            stride=1,
+                            resize=None,
+                            num_workers=4,
+                            queue_size=16
                             ):
 
         """
-        This functions ...
+        This functions makes a video with the rgb images of a sequence
+
+        Rendering is pipelined: reader threads decode (and resize) frames
+        ahead of time, a single writer thread encodes them, and the stages
+        are linked by bounded queues
+
+        Parameters
+        ----------
+        stride: only one of every stride frames is rendered (the frame rate is
+                reduced accordingly, so the video length is kept)
+        resize: optional (width, height) of the output video
+        num_workers: number of decoding threads
+        queue_size: maximum number of frames waiting in each queue
+
+        Returns
+        -------
+        The video file name
         """
 
         rows = self.get_sensor_observation_files(source,
                                                  home_session_name,
                                                  home_subsession,
                                                  room_name,
-                                                 sensor_name)
+                                                 sensor_name,
+                                                 df=False)
 
         # Computing frames per second
         num_of_frames = len(rows)
-        seconds = (rows.iloc[-1]['t'] - rows.iloc[0]['t']) / 10**7
-        frames_per_second = num_of_frames / seconds
+        seconds = (rows['t'][-1] - rows['t'][0]) / 10**7
+        frames_per_second = num_of_frames / seconds / stride
         rh.logger.debug("frames per second: {:.2f}", frames_per_second)
 
+        ids = rows['id'][::stride]
+        # File names are resolved here, sql objects can't be used in threads
+        file_names = self.get_lblrgbd_file_names(ids, 'intensity')
+
+        def read_frame(i):
+            img = self.__get_frame(ids[i], 'rgb', file_names[i])
+            if resize is not None:
+                img = cv2.resize(img, tuple(resize), interpolation=cv2.INTER_AREA)
+            return img
+
+        # Reader threads decode frames ahead of the writer
+        frames = rh.prefetch_map(read_frame,
+                                 range(len(ids)),
+                                 num_workers=num_workers,
+                                 prefetch=queue_size)
+
         # Get frame size
-        image_path = rows.iloc[0]['pth']
-        file_name = rows.iloc[0]['f2']
-        image_path_file_name = os.path.join(self.__rh_path,
-                                            self.__rgbd_path,
-                                            image_path,
-                                            file_name)
-        img = cv2.imread(image_path_file_name, cv2.IMREAD_COLOR)
-        img_h, img_w, _ = img.shape
+        first_img = next(frames)
+        img_h, img_w, _ = first_img.shape
 
         # Opening video file
         if video_file_name is None:
@@ -384,20 +733,14 @@ class RobotAtHome():
         video_path_file_name = os.path.abspath(os.path.join(self.__wspc_path,
                                                             video_file_name)
                                                )
-        out = cv2.VideoWriter(video_path_file_name,
-                              fourcc,
-                              frames_per_second,
-                              (img_w, img_h))
-
-        for _, row in rows.iterrows():
-            image_path = row['pth']
-            file_name = row['f2']
-            image_path_file_name = os.path.join(self.__rh_path,
-                                                self.__rgbd_path,
-                                                image_path,
-                                                file_name)
-            img = cv2.imread(image_path_file_name, cv2.IMREAD_COLOR)
-
+        # A single writer thread owns the cv2.VideoWriter
+        out = rh.ThreadedVideoWriter(video_path_file_name,
+                                     fourcc,
+                                     frames_per_second,
+                                     (img_w, img_h),
+                                     queue_size=queue_size)
+
+        for img in itertools.chain([first_img], frames):
             if rh.is_being_logged():
                 cv2.imshow('Debug mode (press q to exit)', img)
                 if cv2.waitKey(1) & 0xFF == ord('q'):
@@ -405,6 +748,7 @@ class RobotAtHome():
 
             out.write(img)
 
+        frames.close()
         out.release()
 
         if rh.is_being_logged():
@@ -412,54 +756,111 @@ class RobotAtHome():
 
         return video_file_name
 
+    def get_synced_sensor_observations(self,
+                                       home_session_name='alma-s1',
+                                       home_subsession=0,
+                                       room_name='alma_masterroom1',
+                                       sensor_names=('RGBD_1', 'RGBD_2', 'RGBD_3', 'RGBD_4'),
+                                       tolerance=None):
+        """
+        Joins the lblrgbd observations of several sensors of a room by time
+        stamp. Every observation of the first sensor is matched with the
+        nearest (in time) observation of each other sensor
+
+        Parameters
+        ----------
+        sensor_names: the sensors to join, the first one is the reference
+        tolerance: maximum time difference in seconds. By default, half the
+                   median frame period of the reference sensor
+
+        Returns
+        -------
+        A tuple (ids, t) where ids is a (M, S) int64 array with the aligned
+        sensor observation ids (a column per sensor) and t is the (M,) array
+        of reference time stamps. Reference observations without a match
+        within tolerance for every sensor are dropped
+        """
+        rows = [self.get_sensor_observation_files('lblrgbd',
+                                                  home_session_name,
+                                                  home_subsession,
+                                                  room_name,
+                                                  sensor_name,
+                                                  df=False)
+                for sensor_name in sensor_names]
+        ref_t = rows[0]['t']
+        if tolerance is None:
+            tolerance = (np.median(np.diff(ref_t)) / 2 / 10**7
+                         if len(ref_t) > 1 else 0)
+        # Time stamps are in 100 ns units
+        idx = rh.sync_time_stamps(ref_t,
+                                  [rows_s['t'] for rows_s in rows[1:]],
+                                  tolerance * 10**7)
+        ids = np.stack([rows_s['id'][idx[:, s]] for s, rows_s in enumerate(rows)],
+                       axis=1)
+        if len(ids) < len(ref_t):
+            rh.logger.warning("{} of {} {} observations have no synchronized match",
+                              len(ref_t) - len(ids), len(ref_t), sensor_names[0])
+        return ids, ref_t[idx[:, 0]]
+
     def get_composed_video_from_lblrgbd(self,
                                         home_session_name='alma-s1',
                                         home_subsession=0,
                                         room_name='alma_masterroom1',
-                                        video_file_name=None
+                                        video_file_name=None,
+                                        tolerance=None,
+                                        num_workers=4,
+                                        queue_size=16
                                         ):
 
-        ''' Docstring '''
-
-        rows_rgbd_1 = self.get_sensor_observation_files('lblrgbd',
-                                                        home_session_name,
-                                                        home_subsession,
-                                                        room_name,
-                                                        'RGBD_1')
+        """
+        This function makes a video composing side by side the rgb images of
+        the rgbd cameras in COMPOSITION_ORDER (RGBD_3, RGBD_4, RGBD_1 and
+        RGBD_2), synchronized by time stamp (see
+        get_synced_sensor_observations)
 
-        rows_rgbd_2 = self.get_sensor_observation_files('lblrgbd',
-                                                        home_session_name,
-                                                        home_subsession,
-                                                        room_name,
-                                                        'RGBD_2')
+        Parameters
+        ----------
+        tolerance: maximum time difference in seconds between composed frames
+        num_workers: number of decoding threads (the four images of a frame
+                     are decoded in parallel)
+        queue_size: maximum number of frames waiting in each queue
 
-        rows_rgbd_3 = self.get_sensor_observation_files('lblrgbd',
-                                                        home_session_name,
-                                                        home_subsession,
-                                                        room_name,
-                                                        'RGBD_3')
+        Returns
+        -------
+        The video file name
+        """
 
-        rows_rgbd_4 = self.get_sensor_observation_files('lblrgbd',
-                                                        home_session_name,
-                                                        home_subsession,
-                                                        room_name,
-                                                        'RGBD_4')
+        # Frames are synchronized with RGBD_1 as reference and then the
+        # columns are reordered into the composition order
+        synced_names = sorted(self.COMPOSITION_ORDER)
+        ids, t = self.get_synced_sensor_observations(home_session_name,
+                                                     home_subsession,
+                                                     room_name,
+                                                     synced_names,
+                                                     tolerance)
+        if len(ids) == 0:
+            raise Exception("Sorry, there are no synchronized frames to compose")
+        ids = ids[:, [synced_names.index(name) for name in self.COMPOSITION_ORDER]]
 
         # Computing frames per second
-        num_of_frames = len(rows_rgbd_1)
-        seconds = (rows_rgbd_1.iloc[-1]['t'] - rows_rgbd_1.iloc[0]['t']) / 10**7
+        num_of_frames = len(ids)
+        seconds = (t[-1] - t[0]) / 10**7
         frames_per_second = num_of_frames / seconds
         rh.logger.debug("frames per second: {:.2f}", frames_per_second)
 
+        # Every image is an independent decoding task, so the four images of
+        # a frame are decoded in parallel
+        flat_ids = ids.ravel()
+        file_names = self.get_lblrgbd_file_names(flat_ids, 'intensity')
+        images = rh.prefetch_map(lambda i: self.__get_frame(flat_ids[i], 'rgb', file_names[i]),
+                                 range(len(flat_ids)),
+                                 num_workers=num_workers,
+                                 prefetch=queue_size * ids.shape[1])
+        frames = (cv2.hconcat(list(imgs)) for imgs in zip(*[images] * ids.shape[1]))
+
         # Get frame size
-        image_path = rows_rgbd_1.iloc[0]['pth']
-        file_name = rows_rgbd_1.iloc[0]['f2']
-        image_path_file_name = os.path.join(self.__rh_path,
-                                            self.__rgbd_path,
-                                            image_path,
-                                            file_name)
-        img = cv2.imread(image_path_file_name, cv2.IMREAD_COLOR)
-        img_h, img_w, _ = img.shape
+        first_img = next(frames)
+        img_h, img_w, _ = first_img.shape
 
         # Opening video file
         if video_file_name is None:
@@ -468,7 +869,7 @@ class RobotAtHome():
                     home_session_name,
                     '_', str(home_subsession),
                     '_', room_name,
-                    '_RGBD_3412',
+                    '_RGBD_', ''.join(name[-1] for name in self.COMPOSITION_ORDER),
                     dt.datetime.now().strftime("_%Y%m%d%H%M%S"),
                     '.avi'
                 ]
@@ -477,54 +878,21 @@ class RobotAtHome():
         fourcc = cv2.VideoWriter_fourcc(*'MJPG')
         video_path_file_name = os.path.abspath(os.path.join(self.__wspc_path,
                                                             video_file_name))
-        out = cv2.VideoWriter(video_path_file_name,
-                              fourcc,
-                              frames_per_second,
-                              (4 * img_w, img_h))
-
-        for i in range(len(rows_rgbd_1)):
-            image_rgbd_1_path = rows_rgbd_1.iloc[i, 2]
-            file_rgbd_1_name = rows_rgbd_1.iloc[i, 4]
-            image_rgbd_1_path_file_name = os.path.join(self.__rh_path,
-                                                       self.__rgbd_path,
-                                                       image_rgbd_1_path,
-                                                       file_rgbd_1_name)
-
-            image_rgbd_2_path = rows_rgbd_2.iloc[i, 2]
-            file_rgbd_2_name = rows_rgbd_2.iloc[i, 4]
-            image_rgbd_2_path_file_name = os.path.join(self.__rh_path,
-                                                       self.__rgbd_path,
-                                                       image_rgbd_2_path,
-                                                       file_rgbd_2_name)
-
-            image_rgbd_3_path = rows_rgbd_3.iloc[i, 2]
-            file_rgbd_3_name = rows_rgbd_3.iloc[i, 4]
-            image_rgbd_3_path_file_name = os.path.join(self.__rh_path,
-                                                       self.__rgbd_path,
-                                                       image_rgbd_3_path,
-                                                       file_rgbd_3_name)
-
-            image_rgbd_4_path = rows_rgbd_4.iloc[i, 2]
-            file_rgbd_4_name = rows_rgbd_4.iloc[i, 4]
-            image_rgbd_4_path_file_name = os.path.join(self.__rh_path,
-                                                       self.__rgbd_path,
-                                                       image_rgbd_4_path,
-                                                       file_rgbd_4_name)
-
-
-            img_rgbd_1 = cv2.imread(image_rgbd_1_path_file_name, cv2.IMREAD_COLOR)
-            img_rgbd_2 = cv2.imread(image_rgbd_2_path_file_name, cv2.IMREAD_COLOR)
-            img_rgbd_3 = cv2.imread(image_rgbd_3_path_file_name, cv2.IMREAD_COLOR)
-            img_rgbd_4 = cv2.imread(image_rgbd_4_path_file_name, cv2.IMREAD_COLOR)
-
-            img = cv2.hconcat([img_rgbd_3, img_rgbd_4, img_rgbd_1, img_rgbd_2])
+        out = rh.ThreadedVideoWriter(video_path_file_name,
+                                     fourcc,
+                                     frames_per_second,
+                                     (img_w, img_h),
+                                     queue_size=queue_size)
 
+        for img in itertools.chain([first_img], frames):
             if rh.is_being_logged():
                 cv2.imshow('Debug mode (press q to exit)', img)
                 if cv2.waitKey(1) & 0xFF == ord('q'):
                     break
 
             out.write(img)
+
+        images.close()
         out.release()
 
         if rh.is_being_logged():
@@ -532,7 +900,7 @@ class RobotAtHome():
 
         return video_file_name
 
-    def get_labels_from_lblrgbd(self, so_id):
+    def get_labels_from_lblrgbd(self, so_id, df=True):
         """
         This function return labels rows for the observations referenced by
         sensor_observation_id
@@ -547,6 +915,9 @@ class RobotAtHome():
         so_id : int
             The primary key value to identify a row in the table
             rh_lbl_rgbd_labels.
+        df : boolean
+            indicating if result is returned as a DataFrame (True) or as a
+            list of tuples (False)
 
         Returns
         -------
@@ -555,156 +926,319 @@ class RobotAtHome():
         belong to rh_lblrgbd (labelled rgbd)
         """
 
-        # Get a cursor to execute SQLite statements
-        cur = self.__con.cursor()
-
-        # # Build the query
-        # sql_str = (
-        #     '''
-        #     select * from rh_lblrgbd_labels
-        #     where sensor_observation_id = ?
-        #     '''
-        # )
-
-        # parms = (so_id,)
-        # cur.execute(sql_str, parms)
-        # rows = cur.fetchall()
-
         sql_str = (
             '''
             select * from rh_lblrgbd_labels
-            where sensor_observation_id = {}
-            '''.format(so_id)
+            where sensor_observation_id = ?
+            '''
         )
+        parms = (int(so_id),)
 
-        df_rows = pd.read_sql_query(sql_str, self.__con)
+        if df:
+            return pd.read_sql_query(sql_str, self.__con, params=parms)
 
-        # print(df.shape)
-        # rows = df.to_records()
-        # for row in rows:
-        #     print(row)
+        return self.__fetchall(sql_str, parms)
 
-        return df_rows
+    def __parse_mask(self, label_path_file_name):
+        """
+        Vectorized parser of a labels text file
 
-    def __get_mask(self, label_path_file_name):
-        mask = []
-        with open(label_path_file_name, "r") as file_handler:
+        Returns
+        -------
+        The label mask (every pixel is a bit field with a bit per label) as
+        an int64 array, rotated like the rgb and depth images
+        """
+        with open(label_path_file_name, "rb") as file_handler:
             line = file_handler.readline()
             while line:
                 words = line.strip().split()
-                if words[0][0] != '#':
+                if words[0][0:1] != b'#':
                     num_of_labels = int(words[0])
                     break
                 line = file_handler.readline()
 
             for i in range(num_of_labels):
-                line = file_handler.readline()
-                words = line.strip().split()
+                file_handler.readline()
 
-            num_of_rows = 0
-            line = file_handler.readline()
-            while line:
-                num_of_rows += 1
-                words = line.strip().split()
-                mask.append(list(map(int, words)))
-                line = file_handler.readline()
+            data = file_handler.read()
+
+        # A labels file without a label grid gives an empty mask
+        if not data.strip():
+            return np.empty((0, 0), dtype=np.int64)
+        mask = np.loadtxt(io.BytesIO(data), dtype=np.int64, ndmin=2)
+
+        rh.logger.debug("mask height: {}", mask.shape[0])
+        rh.logger.debug("mask width : {}", mask.shape[1])
 
-        rh.logger.debug("mask height: {}", len(mask))
-        rh.logger.debug("mask width : {}", len(mask[0]))
+        return np.ascontiguousarray(np.rot90(mask))
 
-        mask = np.array(mask)
-        mask = np.rot90(mask)
+    def __get_mask_cache_file_name(self, label_path_file_name):
+        """
+        Returns the .npy file name caching a labels text file, e.g.
+        <cache_path>/masks/100026_labels.<size>_<mtime_ns>.npy (file names
+        start with the unique sensor observation id and end with the size
+        and modification time of the labels file, so a changed file never
+        matches a stale entry)
+        """
+        label_stat = os.stat(label_path_file_name)
+        return os.path.join(self.__cache_path,
+                            'masks',
+                            '{}.{}_{}.npy'.format(
+                                os.path.splitext(os.path.basename(label_path_file_name))[0],
+                                label_stat.st_size,
+                                label_stat.st_mtime_ns))
+
+    def __save_mask(self, mask_file_name, mask):
+        """
+        Atomically writes a binary mask, so concurrent readers never see a
+        partial file
+        """
+        os.makedirs(os.path.dirname(mask_file_name), exist_ok=True)
+        tmp_file_name = f"{mask_file_name}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_file_name, "wb") as file_handler:
+            np.save(file_handler, mask)
+        os.replace(tmp_file_name, mask_file_name)
+
+    def __get_mask(self, label_path_file_name):
+        """
+        Returns the label mask of a labels text file, reading it from the
+        binary mask cache when enabled (misses are parsed and cached)
+        """
+        if not self.__mask_cache:
+            return self.__parse_mask(label_path_file_name)
 
+        mask_file_name = self.__get_mask_cache_file_name(label_path_file_name)
+        try:
+            return np.load(mask_file_name)
+        except FileNotFoundError:
+            pass
+        mask = self.__parse_mask(label_path_file_name)
+        self.__save_mask(mask_file_name, mask)
         return mask
 
-    def get_mask_from_lblrgbd(self, so_id):
+    def create_mask_cache(self, overwrite=False):
         """
-        This function 
+        Converts (once) every lblrgbd labels text file into a binary .npy
+        mask in <cache_path>/masks, so get_mask_from_lblrgbd never parses text
+        (see mask_cache). Entries of labels files that have changed are
+        removed
 
         Parameters
         ----------
+        overwrite: boolean indicating if already converted masks are
+                   converted again
 
         Returns
         -------
-
+        The number of converted files
         """
-        # Get a cursor to execute SQLite statements
-        # cur = self.__con.cursor()
-
-        # sql_str = (
-        #     '''
-        #     select pth, f3
-        #     from rh_temp_lblrgbd
-        #     where id = {}
-        #     '''.format(so_id)
-        # )
-
-        sql_str = (
-            f'''
-            select pth, f3
-            from rh_temp_lblrgbd
-            where id = {so_id}
-            '''
-        )
+        ids = self.__load_files_index()[0]
+        file_names = self.get_lblrgbd_file_names(ids, 'labels')
+        num_of_files = len(file_names)
+        converted = 0
+        mask_file_names = set()
+        for i, label_path_file_name in enumerate(file_names):
+            if rh.is_being_logged('INFO'):
+                sys.stdout.write("\rConverting labels file %i of %i" % (i + 1, num_of_files))
+                sys.stdout.flush()
+            mask_file_name = self.__get_mask_cache_file_name(label_path_file_name)
+            mask_file_names.add(os.path.basename(mask_file_name))
+            if not overwrite and os.path.isfile(mask_file_name):
+                continue
+            self.__save_mask(mask_file_name,
+                             self.__parse_mask(label_path_file_name))
+            converted += 1
+
+        # Entries of labels files that have changed since they were cached
+        masks_path = os.path.join(self.__cache_path, 'masks')
+        if os.path.isdir(masks_path):
+            for file_name in os.listdir(masks_path):
+                if file_name.endswith('.npy') and file_name not in mask_file_names:
+                    os.remove(os.path.join(masks_path, file_name))
+        rh.logger.info("\n{} of {} labels files converted into binary masks",
+                       converted, num_of_files)
+        return converted
 
-        df_rows = pd.read_sql_query(sql_str, self.__con)
-        rh.logger.debug("df_rows.shape: {}", df_rows.shape)
-        # print(df_rows)
-        # print(df_rows.loc[0,"pth"])
-        # print(df_rows.loc[0,"f3"])
-        label_path_file_name = os.path.join(self.__rh_path,
-                                            self.__rgbd_path,
-                                            df_rows.loc[0, "pth"],
-                                            df_rows.loc[0, "f3"])
+    def get_mask_from_lblrgbd(self, so_id):
+        """
+        Returns the label mask of a lblrgbd sensor observation
 
-        rh.logger.debug("label_path_file_name: {}", label_path_file_name)
-        mask = self.__get_mask(label_path_file_name)
+        Parameters
+        ----------
+        so_id: sensor observation id
 
-        return mask
+        Returns
+        -------
+        An int64 array where every pixel is a bit field with a bit per label
+        (see get_labels_from_lblrgbd for the local label ids)
+        """
+        return self.__get_frame(so_id, 'mask')
 
     def get_label_mask(self, mask, labels):
         """
         Returns a binary 2D array (pixels being 1s and 0s)
         """
-        masks = []
-        for label in labels:
-            arr = mask & (2**(label))
-            np.clip(arr, 0, 1, out=arr)
-            arr = np.uint8(arr[:,2:-2])
-            masks.append(arr)
-        return masks
+        label_masks, _ = self.get_label_masks(mask, labels)
+        return list(label_masks.view(np.uint8))
 
-    def get_rgb_image_from_lblrgbd(self, so_id):
+    def get_label_masks(self, mask, labels, packed=False):
         """
-        This function 
+        Extracts the binary masks of several labels at once, broadcasting the
+        bit planes of the label mask, together with per label statistics
 
         Parameters
         ----------
+        mask: label mask (see get_mask_from_lblrgbd)
+        labels: sequence of label local ids (bit positions)
+        packed: boolean indicating if the masks are returned bit packed along
+                the rows (np.packbits, axis=-1) instead of as a boolean stack
 
         Returns
         -------
-        A BGR cv2 image
-
+        A tuple (label_masks, stats) where:
+        label_masks : (L, H, W) boolean array, or (L, H, ceil(W/8)) uint8
+                      array when packed, cropped like the rgb images
+        stats       : dict of arrays aligned with labels:
+                      'count'    (L,) number of pixels
+                      'bbox'     (L, 4) xmin, ymin, xmax, ymax (-1 if empty)
+                      'centroid' (L, 2) x, y (nan if empty)
         """
+        label_masks, stats = rh.label_masks_stats(mask, labels)
 
-        sql_str = f"""
-        select pth, f2
-        from rh_temp_lblrgbd
-        where id = {so_id}
-        """
-
-        df_rows = pd.read_sql_query(sql_str, self.__con)
-        # rh.logger.debug("df_rows.shape: {}", df_rows.shape)
-        rgb_image_path_file_name = os.path.join(self.__rh_path,
-                                            self.__rgbd_path,
-                                            df_rows.loc[0, "pth"],
-                                            df_rows.loc[0, "f2"])
+        if packed:
+            label_masks = np.packbits(label_masks, axis=-1)
 
-        # rh.logger.debug("rgb_image_path_file_name: {}",
-        #                 rgb_image_path_file_name)
-        bgr_img = cv2.imread(rgb_image_path_file_name, cv2.IMREAD_COLOR)
+        return label_masks, stats
 
-        return bgr_img
+    def __get_frame_reader(self, channel):
+        """
+        Returns a tuple (file_type, reader) with the file type (see
+        get_lblrgbd_file_names) and the decoding function of a channel
+        """
+        switcher = {
+            "rgb": ('intensity', self.__read_rgb_image),
+            "depth": ('depth', self.__read_depth_image),
+            "raw_depth": ('depth', self.__read_raw_depth),
+            "mask": ('labels', self.__get_mask),
+        }
+        frame_reader = switcher.get(channel)
+        if frame_reader is None:
+            raise Exception(f"Sorry, the channel '{channel}' is not allowed")
+        return frame_reader
+
+    def __get_frame(self, so_id, channel, file_name=None):
+        """
+        Returns the decoded channel ('rgb', 'depth' or 'mask') of a lblrgbd
+        observation, going through the frame cache when it is enabled
+
+        Parameters
+        ----------
+        file_name: full path file name of the channel (it is looked up in the
+                   files index when None)
+        """
+        file_type, reader = self.__get_frame_reader(channel)
+        frame_cache = self.__frame_cache
+        if frame_cache is not None:
+            frame = frame_cache.get((int(so_id), channel))
+            if frame is not None:
+                # Callers may draw on the returned image
+                return frame.copy()
+        if file_name is None:
+            file_name = self.get_lblrgbd_file_names([so_id], file_type)[0]
+        frame = reader(file_name)
+        if frame_cache is not None:
+            frame_cache.put((int(so_id), channel), frame)
+            return frame.copy()
+        return frame
+
+    def __get_frames(self, ids, channel):
+        """ Batch version of __get_frame """
+        file_type, _ = self.__get_frame_reader(channel)
+        file_names = self.get_lblrgbd_file_names(ids, file_type)
+        return [self.__get_frame(so_id, channel, file_name)
+                for so_id, file_name in zip(np.asarray(ids).ravel().tolist(),
+                                            file_names)]
+
+    def set_frame_cache_size(self, frame_cache_size):
+        """
+        Enables (frame_cache_size > 0) or disables (frame_cache_size = 0) the
+        decoded frame cache, or changes its memory budget
+
+        Parameters
+        ----------
+        frame_cache_size: memory budget in bytes for the decoded frames
+        """
+        if frame_cache_size <= 0:
+            self.__frame_cache = None
+        elif self.__frame_cache is None:
+            self.__frame_cache = rh.LRUCache(frame_cache_size)
+        else:
+            self.__frame_cache.resize(frame_cache_size)
+
+    def get_frame_cache_stats(self):
+        """
+        Returns a dict with the hits, misses, evictions, items, bytes and
+        max_bytes of the decoded frame cache (None if it is disabled)
+        """
+        if self.__frame_cache is None:
+            return None
+        return self.__frame_cache.stats()
+
+    def clear_frame_cache(self):
+        """ Drops every decoded frame from the cache """
+        if self.__frame_cache is not None:
+            self.__frame_cache.clear()
+
+    def __read_rgb_image(self, rgb_image_path_file_name):
+        """ Decodes an intensity file into a BGR cv2 image """
+        return cv2.imread(rgb_image_path_file_name, cv2.IMREAD_COLOR)
+
+    def __read_depth_image(self, depth_image_path_file_name):
+        """ Decodes a depth file into a gray levels cv2 image """
+        return cv2.imread(depth_image_path_file_name, cv2.IMREAD_GRAYSCALE)
+
+    def __read_raw_depth(self, depth_image_path_file_name):
+        """
+        Decodes a depth file keeping its native bit depth (uint8 or uint16)
+        in a single channel, without a three channels intermediate image
+        """
+        return cv2.imread(depth_image_path_file_name, cv2.IMREAD_ANYDEPTH)
+
+    def __depth_to_array(self, raw_depth, metric, out, depth_scale):
+        """
+        Converts a raw depth image into uint16 levels or float32 meters,
+        writing into out when it is given
+        """
+        dtype = np.float32 if metric else np.uint16
+        if out is None:
+            out = np.empty(raw_depth.shape, dtype=dtype)
+        elif out.shape != raw_depth.shape or out.dtype != dtype:
+            raise Exception(f"Sorry, the output buffer must be a {raw_depth.shape} {np.dtype(dtype).name} array")
+
+        if metric:
+            if depth_scale is None:
+                depth_scale = (self.DEPTH_SCALE_16BIT
+                               if raw_depth.dtype == np.uint16
+                               else self.DEPTH_SCALE_8BIT)
+            np.multiply(raw_depth, np.float32(depth_scale), out=out)
+        else:
+            np.copyto(out, raw_depth)
+        return out
+
+    def get_rgb_image_from_lblrgbd(self, so_id):
+        """
+        This function 
+
+        Parameters
+        ----------
+
+        Returns
+        -------
+        A BGR cv2 image
+
+        """
+
+        return self.__get_frame(so_id, 'rgb')
 
     def get_depth_image_from_lblrgbd(self, so_id):
         """
@@ -719,24 +1253,453 @@ class RobotAtHome():
 
         """
 
-        sql_str = f"""
-        select pth, f1
-        from rh_temp_lblrgbd
-        where id = {so_id}
+        return self.__get_frame(so_id, 'depth')
+
+    def get_rgb_images_from_lblrgbd(self, ids):
         """
+        Batch version of get_rgb_image_from_lblrgbd
 
-        df_rows = pd.read_sql_query(sql_str, self.__con)
-        rh.logger.debug("df_rows.shape: {}", df_rows.shape)
-        rgb_image_path_file_name = os.path.join(self.__rh_path,
-                                            self.__rgbd_path,
-                                            df_rows.loc[0, "pth"],
-                                            df_rows.loc[0, "f1"])
+        Parameters
+        ----------
+        ids: a sequence (or NumPy array) of sensor observation ids
+
+        Returns
+        -------
+        A list of BGR cv2 images in the same order as ids
+        """
+        return self.__get_frames(ids, 'rgb')
+
+    def get_depth_images_from_lblrgbd(self, ids):
+        """
+        Batch version of get_depth_image_from_lblrgbd
+
+        Parameters
+        ----------
+        ids: a sequence (or NumPy array) of sensor observation ids
+
+        Returns
+        -------
+        A list of gray levels cv2 images in the same order as ids
+        """
+        return self.__get_frames(ids, 'depth')
+
+    def get_depth_from_lblrgbd(self, so_id, metric=False, out=None, depth_scale=None):
+        """
+        Reads the depth image of a lblrgbd observation with its native bit
+        depth (IMREAD_ANYDEPTH)
+
+        Parameters
+        ----------
+        so_id: sensor observation id
+        metric: boolean indicating if depth is returned as float32 meters
+                (True) or as uint16 levels (False)
+        out: optional preallocated (H, W) array (float32 if metric else
+             uint16) where the result is written
+        depth_scale: meters per depth level. By default DEPTH_SCALE_8BIT or
+                     DEPTH_SCALE_16BIT depending on the bit depth of the file
+
+        Returns
+        -------
+        A (H, W) uint16 or float32 array (out, if given)
+        """
+        return self.__depth_to_array(self.__get_frame(so_id, 'raw_depth'),
+                                     metric,
+                                     out,
+                                     depth_scale)
+
+    def get_depths_from_lblrgbd(self,
+                                ids,
+                                metric=False,
+                                out=None,
+                                depth_scale=None,
+                                num_workers=4):
+        """
+        Batch version of get_depth_from_lblrgbd. Files are decoded in a thread
+        pool (see iter_lblrgbd_frames) straight into one stacked array
+
+        Parameters
+        ----------
+        ids: a sequence (or NumPy array) of sensor observation ids
+        out: optional preallocated (N, H, W) array (float32 if metric else
+             uint16) where the result is written
+
+        Returns
+        -------
+        A (N, H, W) uint16 or float32 array (out, if given) in the same order
+        as ids, (0, H, W) if ids is empty
+        """
+        ids = np.asarray(ids, dtype=np.int64).ravel()
+        if not len(ids):
+            if out is None:
+                out = np.empty((0,) + self.LBLRGBD_IMAGE_SHAPE,
+                               dtype=np.float32 if metric else np.uint16)
+            elif out.shape[0] != 0:
+                raise Exception(f"Sorry, the output buffer must have 0 rows")
+            return out
+        frames = self.iter_lblrgbd_frames(ids, ('raw_depth',), num_workers=num_workers)
+        for i, (_, frame) in enumerate(frames):
+            raw_depth = frame['raw_depth']
+            if out is None:
+                out = np.empty((len(ids),) + raw_depth.shape,
+                               dtype=np.float32 if metric else np.uint16)
+            elif out.shape[0] != len(ids):
+                raise Exception(f"Sorry, the output buffer must have {len(ids)} rows")
+            self.__depth_to_array(raw_depth, metric, out[i], depth_scale)
+        return out
+
+    def get_masks_from_lblrgbd(self, ids):
+        """
+        Batch version of get_mask_from_lblrgbd
 
-        rh.logger.debug("rgb_image_path_file_name: {}",
-                        rgb_image_path_file_name)
-        img = cv2.imread(rgb_image_path_file_name, cv2.IMREAD_COLOR)
-        
-        return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        Parameters
+        ----------
+        ids: a sequence (or NumPy array) of sensor observation ids
+
+        Returns
+        -------
+        A list of label masks in the same order as ids
+        """
+        return self.__get_frames(ids, 'mask')
+
+    def __load_poses(self):
+        """
+        Loads (only once) the sensor poses (x, y, z, yaw, pitch, roll) of the
+        lblrgbd observations as a (N, 6) array aligned with the files index
+        """
+        if self.__poses is None:
+            rows = self.__fetchall(
+                """
+                select id, s_px, s_py, s_pz, s_pya, s_ppi, s_pro
+                from rh_temp_lblrgbd
+                order by id
+                """
+            )
+            self.__poses = np.array([row[1:] for row in rows], dtype=np.float64)
+        return self.__poses
+
+    def get_sensor_poses(self, ids):
+        """
+        Returns the sensor pose transforms of a batch of lblrgbd observations
+
+        Parameters
+        ----------
+        ids: a sequence (or NumPy array) of sensor observation ids
+
+        Returns
+        -------
+        A tuple (rotations, translations) of float32 arrays with shapes
+        (N, 3, 3) and (N, 3). Rotations follow the MRPT convention
+        R = Rz(yaw) Ry(pitch) Rx(roll)
+        """
+        poses = self.__load_poses()[self.__get_files_index_positions(ids)]
+        cy, cp, cr = np.cos(poses[:, 3:6]).T
+        sy, sp, sr = np.sin(poses[:, 3:6]).T
+        rotations = np.stack([cy * cp, cy * sp * sr - sy * cr, cy * sp * cr + sy * sr,
+                              sy * cp, sy * sp * sr + cy * cr, sy * sp * cr - cy * sr,
+                              -sp, cp * sr, cp * cr], axis=1).reshape(-1, 3, 3)
+        return rotations.astype(np.float32), poses[:, 0:3].astype(np.float32)
+
+    def __get_ray_grid(self, shape):
+        """
+        Returns (and caches per resolution) the (H*W, 3) float32 grid of pixel
+        rays of a depth image, so that depth * ray is the point in the sensor
+        frame (x forward, y left, z up as in MRPT)
+
+        Stored images are rotated 90 degrees counterclockwise from the sensor
+        images (see cruncher), so rays are computed for the native image and
+        rotated the same way
+        """
+        ray_grid = self.__ray_grids.get(shape)
+        if ray_grid is None:
+            native_h, native_w = shape[1], shape[0]
+            fx = (native_w / 2) / np.tan(np.deg2rad(self.DEPTH_CAMERA_HFOV) / 2)
+            fy = (native_h / 2) / np.tan(np.deg2rad(self.DEPTH_CAMERA_VFOV) / 2)
+            u, v = np.meshgrid(np.arange(native_w) - (native_w - 1) / 2,
+                               np.arange(native_h) - (native_h - 1) / 2)
+            native_rays = np.stack([np.ones_like(u), -u / fx, -v / fy], axis=-1)
+            ray_grid = np.ascontiguousarray(
+                np.rot90(native_rays).reshape(-1, 3), dtype=np.float32)
+            self.__ray_grids[shape] = ray_grid
+        return ray_grid
+
+    def __back_project(self, depth, rotation, translation, bgr_img, mask):
+        """
+        Back-projects a metric depth image to a float32 (N, 3[+3][+1]) point
+        cloud keeping only pixels with a valid (positive) depth
+        """
+        rays = self.__get_ray_grid(depth.shape)
+        depth = depth.reshape(-1)
+        valid = depth > 0
+        # One matrix multiply rotates every ray to the world frame
+        points = (rays[valid] @ rotation.T) * depth[valid, np.newaxis]
+        points += translation
+        columns = [points]
+        if bgr_img is not None:
+            columns.append(bgr_img.reshape(-1, 3)[valid, ::-1].astype(np.float32))
+        if mask is not None:
+            mask = np.asarray(mask)[:, 2:-2].reshape(-1)[valid]
+            # Local id of the lowest label bit of every pixel, -1 if unlabelled
+            lowest_bit = mask & (~mask + 1)
+            label = np.full(len(mask), -1, dtype=np.float32)
+            labelled = lowest_bit > 0
+            label[labelled] = np.log2(lowest_bit[labelled])
+            columns.append(label[:, np.newaxis])
+        if len(columns) == 1:
+            return points
+        return np.hstack(columns)
+
+    def get_point_cloud(self, so_id, rgb=False, labels=False, depth_scale=None):
+        """
+        Back-projects the depth image of a lblrgbd observation to a world
+        frame point cloud using its sensor pose
+
+        Parameters
+        ----------
+        so_id: sensor observation id
+        rgb: boolean indicating if r, g, b columns are added
+        labels: boolean indicating if a label column (local id of the label,
+                -1 for unlabelled pixels) is added
+        depth_scale: meters per depth level (see get_depth_from_lblrgbd)
+
+        Returns
+        -------
+        A float32 (N, 3) array with x, y, z (plus r, g, b and label columns,
+        in that order, when requested), one row per pixel with valid depth
+        """
+        depth = self.get_depth_from_lblrgbd(so_id, metric=True, depth_scale=depth_scale)
+        rotations, translations = self.get_sensor_poses([so_id])
+        return self.__back_project(depth,
+                                   rotations[0],
+                                   translations[0],
+                                   self.get_rgb_image_from_lblrgbd(so_id) if rgb else None,
+                                   self.get_mask_from_lblrgbd(so_id) if labels else None)
+
+    def get_point_clouds(self, ids, rgb=False, labels=False, depth_scale=None):
+        """
+        Batch version of get_point_cloud
+
+        Parameters
+        ----------
+        ids: a sequence (or NumPy array) of sensor observation ids
+
+        Returns
+        -------
+        A list of float32 point clouds in the same order as ids
+        """
+        ids = np.asarray(ids, dtype=np.int64).ravel()
+        depths = self.get_depths_from_lblrgbd(ids, metric=True, depth_scale=depth_scale)
+        rotations, translations = self.get_sensor_poses(ids)
+        bgr_imgs = self.get_rgb_images_from_lblrgbd(ids) if rgb else [None] * len(ids)
+        masks = self.get_masks_from_lblrgbd(ids) if labels else [None] * len(ids)
+        return [self.__back_project(depths[i],
+                                    rotations[i],
+                                    translations[i],
+                                    bgr_imgs[i],
+                                    masks[i])
+                for i in range(len(ids))]
+
+    def get_room_point_cloud(self,
+                             home_session_name='alma-s1',
+                             home_subsession=0,
+                             room_name='alma_masterroom1',
+                             voxel_size=0.05,
+                             rgb=True,
+                             labels=True,
+                             sensor_names=('RGBD_1', 'RGBD_2', 'RGBD_3', 'RGBD_4'),
+                             stride=1,
+                             return_votes=False):
+        """
+        Fuses the frames of every RGBD sensor of a room (in a home subsession)
+        into a world frame point cloud downsampled by a hashed voxel grid
+
+        Frames are streamed (see iter_lblrgbd_frames), so memory is bounded by
+        the number of occupied voxels and not by the number of frames
+
+        Parameters
+        ----------
+        voxel_size: voxel edge length in meters
+        rgb: boolean indicating if mean r, g, b columns are added
+        labels: boolean indicating if a label column with the most voted
+                object type id of every voxel (-1 if none) is added
+        sensor_names: the sensors to fuse
+        stride: only one of every stride frames of every sensor is fused
+        return_votes: boolean indicating if the label votes are also returned
+
+        Returns
+        -------
+        A float32 (K, 3) array with x, y, z voxel centroids (plus r, g, b and
+        label columns, in that order, when requested). When return_votes is
+        True, a tuple (point_cloud, votes) where votes is a (M, 3) int64 array
+        with rows (point cloud row, object type id, number of pixels)
+        """
+        ids = np.concatenate([
+            self.get_sensor_observation_files('lblrgbd',
+                                              home_session_name,
+                                              home_subsession,
+                                              room_name,
+                                              sensor_name,
+                                              df=False)['id'][::stride]
+            for sensor_name in sensor_names])
+        if len(ids) == 0:
+            raise Exception(f"Sorry, there are no lblrgbd observations for {home_session_name}, {home_subsession}, {room_name}")
+        rotations, translations = self.get_sensor_poses(ids)
+        positions = {so_id: i for i, so_id in enumerate(ids.tolist())}
+
+        # Local label ids (bit positions) are mapped to object type ids
+        label_luts = {}
+        if labels:
+            rows = self.__fetchall(
+                """
+                select l.sensor_observation_id, l.local_id, l.object_type_id
+                from rh_lblrgbd_labels as l
+                inner join rh_temp_lblrgbd as v on v.id = l.sensor_observation_id
+                where v.hs_name = ? and v.hss_id = ? and v.r_name = ?
+                """,
+                (home_session_name, int(home_subsession), room_name))
+            for so_id, local_id, object_type_id in rows:
+                lut = label_luts.setdefault(so_id, {})
+                lut[local_id] = object_type_id
+
+        channels = ['raw_depth']
+        if rgb:
+            channels.append('rgb')
+        if labels:
+            channels.append('mask')
+        voxel_grid = rh.VoxelGrid(voxel_size)
+        for i, (so_id, frame) in enumerate(self.iter_lblrgbd_frames(ids, channels)):
+            if rh.is_being_logged('INFO'):
+                sys.stdout.write("\rFusing frame %i of %i" % (i + 1, len(ids)))
+                sys.stdout.flush()
+            depth = self.__depth_to_array(frame['raw_depth'], True, None, None)
+            pos = positions[so_id]
+            point_cloud = self.__back_project(depth,
+                                              rotations[pos],
+                                              translations[pos],
+                                              frame.get('rgb'),
+                                              frame.get('mask'))
+            point_labels = None
+            if labels:
+                # An item per mask bit, so bits without a label row map to
+                # -1 too, and a last one that maps unlabelled pixels (-1)
+                lut = np.full(self.MASK_BITS + 1, -1, dtype=np.int64)
+                for local_id, object_type_id in label_luts.get(so_id, {}).items():
+                    if 0 <= local_id < self.MASK_BITS:
+                        lut[local_id] = object_type_id
+                point_labels = lut[point_cloud[:, -1].astype(np.int64)]
+            voxel_grid.add(point_cloud[:, 0:3],
+                           point_cloud[:, 3:6] if rgb else None,
+                           point_labels)
+        rh.logger.debug("\n{} frames fused into {} voxels", len(ids), len(voxel_grid))
+
+        points, colors, voxel_labels = voxel_grid.get_points()
+        columns = [points]
+        if rgb:
+            columns.append(colors)
+        if labels:
+            columns.append(voxel_labels[:, np.newaxis])
+        room_point_cloud = np.hstack(columns).astype(np.float32)
+        if return_votes:
+            return room_point_cloud, voxel_grid.get_votes()
+        return room_point_cloud
+
+    def iter_lblrgbd_frames(self,
+                            ids,
+                            channels=('rgb', 'depth', 'mask'),
+                            num_workers=4,
+                            prefetch=8):
+        """
+        Iterates over a sequence of lblrgbd observations decoding their files
+        ahead of time in a bounded thread pool (cv2 releases the GIL while
+        decoding)
+
+        Parameters
+        ----------
+        ids: a sequence (or NumPy array) of sensor observation ids
+        channels: any of 'rgb' (BGR cv2 image), 'depth' (gray levels cv2
+                  image), 'raw_depth' (native bit depth image) and 'mask'
+                  (label mask)
+        num_workers: number of decoding threads
+        prefetch: maximum number of frames decoded ahead of the consumer
+
+        Returns
+        -------
+        A generator yielding (so_id, frame) tuples in the same order as ids,
+        where frame is a dict with an image for every channel
+        """
+        readers = []
+        for channel in channels:
+            file_type, _ = self.__get_frame_reader(channel)
+            readers.append((channel,
+                            self.get_lblrgbd_file_names(ids, file_type)))
+        ids = np.asarray(ids, dtype=np.int64).ravel().tolist()
+
+        def decode(i):
+            return ids[i], {channel: self.__get_frame(ids[i],
+                                                      channel,
+                                                      file_names[i])
+                            for channel, file_names in readers}
+
+        return rh.prefetch_map(decode,
+                               range(len(ids)),
+                               num_workers=num_workers,
+                               prefetch=prefetch)
+
+    def iter_frames(self,
+                    source='lblrgbd',
+                    home_session_name='alma-s1',
+                    home_subsession=0,
+                    room_name='alma_masterroom1',
+                    sensor_name='RGBD_1',
+                    channels=('rgb', 'depth', 'mask'),
+                    num_workers=4,
+                    prefetch=8):
+        """
+        Iterates in time order over the frames of the sequence located by
+        home_session_name, home_subsession, room_name and sensor_name (see
+        get_sensor_observation_files and iter_lblrgbd_frames)
+
+        Returns
+        -------
+        A generator yielding (so_id, frame) tuples, where frame is a dict
+        with an image for every channel
+        """
+        rows = self.get_sensor_observation_files(source,
+                                                 home_session_name,
+                                                 home_subsession,
+                                                 room_name,
+                                                 sensor_name,
+                                                 df=False)
+        return self.iter_lblrgbd_frames(rows['id'],
+                                        channels,
+                                        num_workers=num_workers,
+                                        prefetch=prefetch)
+
+    def __iter_rgb_batches(self, ids, batch_size):
+        """
+        Iterates over the rgb images of a sequence of lblrgbd observations in
+        batches of at most batch_size images of the same shape
+
+        Returns
+        -------
+        A generator yielding (batch_ids, imgs) tuples of lists
+        """
+        frames = self.iter_lblrgbd_frames(ids, ('rgb',))
+        batch_ids, imgs = [], []
+        try:
+            for so_id, frame in frames:
+                img = frame['rgb']
+                if imgs and img.shape != imgs[0].shape:
+                    yield batch_ids, imgs
+                    batch_ids, imgs = [], []
+                batch_ids.append(so_id)
+                imgs.append(img)
+                if len(imgs) == batch_size:
+                    yield batch_ids, imgs
+                    batch_ids, imgs = [], []
+            if imgs:
+                yield batch_ids, imgs
+        finally:
+            frames.close()
 
     def lblrgbd_plot_labels(self, so_id):
         img = self.get_rgb_image_from_lblrgbd(so_id)
@@ -756,11 +1719,13 @@ class RobotAtHome():
     """
 
     def lblrgbd_rgb_image_object_detection(self, so_id,
-                                           model='yolo3_darknet53_coco'):
+                                           model='yolo3_darknet53_coco',
+                                           gpu=False):
         bgr_img = self.get_rgb_image_from_lblrgbd(so_id)
         chw_img, class_names, nn_out = rh.object_detection_with_gluoncv(
             cv2.cvtColor(bgr_img, cv2.COLOR_BGR2RGB),
-            model
+            model,
+            gpu
         )
         return bgr_img, chw_img, class_names, nn_out
 
@@ -772,114 +1737,420 @@ class RobotAtHome():
                                  sensor_name='RGBD_1',
                                  video_file_name=None,
                                  model='yolo3_darknet53_coco',
-                                 gpu=False
+                                 gpu=False,
+                                 batch_size=1,
+                                 num_threads=None,
+                                 render_video=True,
+                                 thresh=0.0
                                  ):
         """
-        This functions ...
+        This functions applies an object detection model to the rgb images
+        of a sequence and, optionally, makes a video with the detections
+
+        Parameters
+        ----------
+        batch_size: number of frames stacked in every forward pass (frames of
+                    a sequence share the same resolution)
+        num_threads: number of MXNet CPU threads (see set_mxnet_threads), the
+                     current setting is kept if None
+        render_video: boolean indicating if boxes are drawn and encoded into a
+                      video (True) or only detections are computed (False)
+        thresh: minimum score of the returned detections
+
+        Returns
+        -------
+        df_detections: a long format dataframe with a row per detected object
+                       and columns frame_id (the sensor observation id),
+                       class_id, score, xmin, ymin, xmax and ymax (see
+                       detections2df)
+        video_file_name: the video file name, None if render_video is False
         """
         rows = self.get_sensor_observation_files(source,
                                                  home_session_name,
                                                  home_subsession,
                                                  room_name,
-                                                 sensor_name)
-
-        # Computing frames per second
-        num_of_frames = len(rows)
-        seconds = (rows.iloc[-1]['t'] - rows.iloc[0]['t']) / 10**7
-        frames_per_second = num_of_frames / seconds
-        rh.logger.debug("frames per second: {:.2f}", frames_per_second)
-
-        # Get frame size
-        img = self.get_rgb_image_from_lblrgbd(rows.iloc[0]['id'])
-        img_h, img_w, _ = img.shape
-
-        # Opening video file
-        if video_file_name is None:
-            video_file_name = ''.join(
-                [
-                    home_session_name,
-                    '_', str(home_subsession),
-                    '_', room_name,
-                    '_', sensor_name,
-                    '_by_', model,
-                    dt.datetime.now().strftime("_%Y%m%d%H%M%S"),
-                    '.avi'
-                ]
-            )
-        fourcc = cv2.VideoWriter_fourcc(*'MJPG')
-        video_path_file_name = os.path.abspath(os.path.join(self.__wspc_path,
-                                                            video_file_name)
-                                               )
-        rh.rename_if_exist(video_path_file_name)
-
-        out = cv2.VideoWriter(video_path_file_name,
-                              fourcc,
-                              frames_per_second,
-                              (img_w, img_h))
+                                                 sensor_name,
+                                                 df=False)
+
+        if render_video:
+            # Computing frames per second
+            num_of_frames = len(rows)
+            seconds = (rows['t'][-1] - rows['t'][0]) / 10**7
+            frames_per_second = num_of_frames / seconds
+            rh.logger.debug("frames per second: {:.2f}", frames_per_second)
+
+            # Get frame size
+            img = self.get_rgb_image_from_lblrgbd(rows['id'][0])
+            img_h, img_w, _ = img.shape
+
+            # Opening video file
+            if video_file_name is None:
+                video_file_name = ''.join(
+                    [
+                        home_session_name,
+                        '_', str(home_subsession),
+                        '_', room_name,
+                        '_', sensor_name,
+                        '_by_', model,
+                        dt.datetime.now().strftime("_%Y%m%d%H%M%S"),
+                        '.avi'
+                    ]
+                )
+            fourcc = cv2.VideoWriter_fourcc(*'MJPG')
+            video_path_file_name = os.path.abspath(os.path.join(self.__wspc_path,
+                                                                video_file_name)
+                                                   )
+            rh.rename_if_exist(video_path_file_name)
+
+            # Encoding runs in its own thread, overlapped with inference
+            out = rh.ThreadedVideoWriter(video_path_file_name,
+                                         fourcc,
+                                         frames_per_second,
+                                         (img_w, img_h))
+        else:
+            video_file_name = None
 
         ##############################################
         #                     NN
         ##############################################
 
-        yolo_models = rh.get_yolo_models()
-        rcnn_models = rh.get_rcnn_models()
+        if num_threads is not None:
+            rh.set_mxnet_threads(num_threads)
 
-        if model not in yolo_models + rcnn_models:
-            raise Exception(f"Sorry, the model '{model}' is not allowed")
+        model_family = rh.get_model_family(model)
 
-        #  Set context to cpu or gpu
-        ctx_ = mx.context.gpu() if gpu else mx.context.cpu()
-
-        # Load Pretrained Model from the CV model zoo
-        net = gcv.model_zoo.get_model(model,
-                                      pretrained=True,
-                                      ctx=ctx_)
+        # Pretrained model from the CV model zoo (cached by the registry)
+        net = rh.get_detection_model(model, gpu)
         class_names_ = net.classes
-        nn_out_list = []
+        detections = []
+        # Frames are decoded ahead of the network by a thread pool
+        batches = self.__iter_rgb_batches(rows['id'], batch_size)
         i = 0
-        for _, row in rows.iterrows():
-            img = self.get_rgb_image_from_lblrgbd(row['id'])
-
-            i += 1
+        stop = False
+        for batch_ids, imgs in batches:
+            i += len(imgs)
             if rh.is_being_logged('INFO'):
                 sys.stdout.write("\rProcessing frame %i of %i" % (i, len(rows)))
                 sys.stdout.flush()
 
-            short_edge_size = min(img.shape[0:2])
-            if model in yolo_models:
-                trnf_img, _ = gcv.data.transforms.presets.yolo.transform_test(mx.nd.array(img),
-                                                                              short=short_edge_size)
-            if model in rcnn_models:
-                trnf_img, _ = gcv.data.transforms.presets.rcnn.transform_test(mx.nd.array(img),
-                                                                              short=short_edge_size)
-            class_ids, scores, bounding_boxs = net(trnf_img)
+            # A single forward pass per batch
+            class_ids, scores, bounding_boxs = rh.object_detection_batch(net,
+                                                                         imgs,
+                                                                         model_family)
+
+            frame_pos, *batch_detections = rh.filter_detections(class_ids,
+                                                                 scores,
+                                                                 bounding_boxs,
+                                                                 thresh)
+            detections.append([np.asarray(batch_ids)[frame_pos]] + batch_detections)
+
+            if not render_video:
+                continue
+
+            for j, img in enumerate(imgs):
+                gcv.utils.viz.cv_plot_bbox(img,
+                                           bounding_boxs[j],
+                                           scores[j],
+                                           class_ids[j],
+                                           class_names=class_names_,
+                                           thresh=0.2,
+                                           linewidth=1)
+                if rh.is_being_logged():
+                    cv2.imshow('Debug mode (press q to exit)', img)
+                    if cv2.waitKey(1) & 0xFF == ord('q'):
+                        stop = True
+                        break
+
+                out.write(img)
+
+            if stop:
+                break
+
+        batches.close()
+        if render_video:
+            out.release()
 
-            df_nn_out = rh.nn_out2df(class_ids, scores, bounding_boxs)
-            nn_out_list.append(df_nn_out)
-
-            utils.viz.cv_plot_bbox(img,
-                                   bounding_boxs[0],
-                                   scores[0],
-                                   class_ids[0],
-                                   class_names=class_names_,
-                                   thresh=0.2,
-                                   linewidth=1)
             if rh.is_being_logged():
-                cv2.imshow('Debug mode (press q to exit)', img)
-                if cv2.waitKey(1) & 0xFF == ord('q'):
-                    break
+                cv2.destroyAllWindows()
 
-            out.write(img)
+        # A single dataframe is built from the concatenated arrays
+        df_detections = rh.concat_detections(detections)
+        return df_detections, video_file_name
 
-        out.release()
+    def __iter_object_detections(self, ids, model, gpu, batch_size, num_threads,
+                                 thresh=0.0):
+        """
+        Applies an object detection model to lblrgbd observations
 
-        if rh.is_being_logged():
-            cv2.destroyAllWindows()
+        Returns
+        -------
+        A generator yielding, for every batch, a tuple (batch_ids, frame_ids,
+        class_ids, scores, boxes), where batch_ids is the list of processed
+        observations and the rest are the filtered detections (see
+        filter_detections) with their observation ids
+        """
+        if num_threads is not None:
+            rh.set_mxnet_threads(num_threads)
+        model_family = rh.get_model_family(model)
+        net = rh.get_detection_model(model, gpu)
 
-        df_nn_out = pd.DataFrame(nn_out_list, columns=['class_ids',
-                                                       'scores',
-                                                       'bounding_boxs'])
-        return df_nn_out, video_file_name
+        i = 0
+        for batch_ids, imgs in self.__iter_rgb_batches(ids, batch_size):
+            class_ids, scores, bounding_boxs = rh.object_detection_batch(net,
+                                                                         imgs,
+                                                                         model_family)
+            frame_pos, class_ids, scores, boxes = rh.filter_detections(class_ids,
+                                                                       scores,
+                                                                       bounding_boxs,
+                                                                       thresh)
+            yield batch_ids, np.asarray(batch_ids)[frame_pos], class_ids, scores, boxes
+
+            i += len(imgs)
+            if rh.is_being_logged('INFO'):
+                sys.stdout.write("\rProcessing frame %i of %i" % (i, len(ids)))
+                sys.stdout.flush()
+
+    def get_lblrgbd_ids(self):
+        """
+        Returns a sorted NumPy array with the ids of the lblrgbd observations
+        """
+        return self.__load_files_index()[0].copy()
+
+    def detect_objects(self,
+                       ids=None,
+                       model='yolo3_darknet53_coco',
+                       gpu=False,
+                       batch_size=8,
+                       num_threads=None,
+                       thresh=0.0):
+        """
+        Applies an object detection model to lblrgbd observations
+
+        Parameters
+        ----------
+        ids: a sequence (or NumPy array) of sensor observation ids, all the
+             lblrgbd observations if None
+        batch_size, num_threads, thresh: see lblrgbd_object_detection
+
+        Returns
+        -------
+        A long format dataframe of detections (see detections2df)
+        """
+        if ids is None:
+            ids = self.get_lblrgbd_ids()
+        detections = [batch[1:] for batch in self.__iter_object_detections(ids,
+                                                                          model,
+                                                                          gpu,
+                                                                          batch_size,
+                                                                          num_threads,
+                                                                          thresh)]
+        return rh.concat_detections(detections)
+
+    def store_object_detections(self,
+                                ids=None,
+                                model='yolo3_darknet53_coco',
+                                gpu=False,
+                                batch_size=8,
+                                num_threads=None):
+        """
+        Applies an object detection model to lblrgbd observations and stores
+        the detections in the results database (see get_object_detections).
+
+        Observations already processed with the same model are skipped, so an
+        interrupted or repeated run only processes the missing ones. Every
+        batch is inserted and committed in a single transaction.
+
+        Parameters
+        ----------
+        ids: a sequence (or NumPy array) of sensor observation ids, all the
+             lblrgbd observations if None
+        batch_size, num_threads: see lblrgbd_object_detection
+
+        Returns
+        -------
+        The number of processed observations
+        """
+        self.__attach_results()
+        if ids is None:
+            ids = self.get_lblrgbd_ids()
+        ids = np.unique(np.asarray(ids, dtype=np.int64))
+
+        done_ids = np.array(self.__fetchall(
+            "select so_id from rh_results.rh2_detected_frames where model = ?",
+            (model,)), dtype=np.int64).ravel()
+        ids = ids[~np.isin(ids, done_ids)]
+        rh.logger.info("{} observations already processed by {}, {} pending",
+                       len(done_ids), model, len(ids))
+        if len(ids) == 0:
+            return 0
+
+        i = 0
+        for batch_ids, frame_ids, class_ids, scores, boxes in self.__iter_object_detections(
+                ids, model, gpu, batch_size, num_threads):
+            detections = zip(frame_ids.tolist(),
+                             itertools.repeat(model),
+                             class_ids.tolist(),
+                             scores.tolist(),
+                             *boxes.T.tolist())
+
+            with self.__con:
+                self.__con.executemany(
+                    "insert into rh_results.rh2_detections values (?, ?, ?, ?, ?, ?, ?, ?)",
+                    detections)
+                self.__con.executemany(
+                    "insert into rh_results.rh2_detected_frames values (?, ?)",
+                    zip(batch_ids, itertools.repeat(model)))
+            i += len(batch_ids)
+
+        return i
+
+    def get_object_detections(self, ids=None, model='yolo3_darknet53_coco'):
+        """
+        Returns the object detections stored by store_object_detections
+
+        Parameters
+        ----------
+        ids: a sequence (or NumPy array) of sensor observation ids, all the
+             stored observations if None
+
+        Returns
+        -------
+        A long format dataframe (see detections2df), i.e. with columns
+        frame_id (the so_id), class_id, score, xmin, ymin, xmax and ymax,
+        ordered by frame_id and decreasing score
+        """
+        self.__attach_results()
+        columns = ['frame_id', 'class_id', 'score', 'xmin', 'ymin', 'xmax', 'ymax']
+        if ids is None:
+            sql_str = '''
+            select so_id as frame_id, class_id, score, xmin, ymin, xmax, ymax
+            from rh_results.rh2_detections
+            where model = ?
+            order by so_id, score desc
+            '''
+            return pd.read_sql_query(sql_str, self.__con, params=(model,))
+        rows = self.__fetchall_ids(
+            '''
+            select d.so_id, d.class_id, d.score, d.xmin, d.ymin, d.xmax, d.ymax
+            from rh_temp_ids i
+            join rh_results.rh2_detections d on d.so_id = i.id
+            where d.model = ?
+            order by d.so_id, d.score desc
+            ''', ids, (model,))
+        return pd.DataFrame.from_records(rows, columns=columns)
+
+    def __get_coco_class_ids(self):
+        """
+        Returns an int64 array that maps every object_type_id to its COCO
+        class id (see RH2COCO_CLASSES), -1 for object types without one
+        """
+        object_types = self.__fetchall("select id, name from rh_object_types")
+        coco_class_ids = np.full(max([row[0] for row in object_types], default=-1) + 1,
+                                 -1, dtype=np.int64)
+        for object_type_id, name in object_types:
+            coco_name = rh.RH2COCO_CLASSES.get(name)
+            if coco_name is not None:
+                coco_class_ids[object_type_id] = rh.COCO_CLASSES.index(coco_name)
+        return coco_class_ids
+
+    def get_ground_truth_boxes(self, ids):
+        """
+        Returns the ground truth boxes of the labels of lblrgbd observations
+        whose object type has a COCO equivalent (see RH2COCO_CLASSES)
+
+        Boxes are the bounding boxes of the label masks (see
+        get_label_masks), in the coordinates of the rgb images
+
+        Parameters
+        ----------
+        ids: a sequence (or NumPy array) of sensor observation ids
+
+        Returns
+        -------
+        A dataframe with a row per label and columns frame_id (the so_id),
+        class_id (COCO), object_type_id, xmin, ymin, xmax and ymax
+        """
+        ids = np.unique(np.asarray(ids, dtype=np.int64))
+        coco_class_ids = self.__get_coco_class_ids()
+        labels = np.array(self.__fetchall_ids(
+            '''
+            select l.sensor_observation_id, l.local_id, l.object_type_id
+            from rh_temp_ids i
+            join rh_lblrgbd_labels l on l.sensor_observation_id = i.id
+            order by l.sensor_observation_id, l.local_id
+            ''', ids), dtype=np.int64).reshape(-1, 3)
+        class_ids = coco_class_ids[labels[:, 2]]
+        labels = labels[class_ids >= 0]
+        class_ids = class_ids[class_ids >= 0]
+
+        # Only frames with some mapped label are decoded
+        frame_ids, starts = np.unique(labels[:, 0], return_index=True)
+        ends = np.append(starts[1:], len(labels))
+        boxes = np.empty((len(labels), 4), dtype=np.float32)
+        frames = self.iter_lblrgbd_frames(frame_ids, ('mask',))
+        for (_, frame), start, end in zip(frames, starts, ends):
+            _, stats = self.get_label_masks(frame['mask'], labels[start:end, 1])
+            boxes[start:end] = stats['bbox']
+        frames.close()
+
+        # Labels without pixels are dropped, pixel indices are converted to
+        # the continuous coordinates of the network output
+        visible = boxes[:, 0] >= 0
+        boxes[:, 2:] += 1
+        return pd.DataFrame({'frame_id': labels[visible, 0],
+                             'class_id': class_ids[visible],
+                             'object_type_id': labels[visible, 2],
+                             'xmin': boxes[visible, 0],
+                             'ymin': boxes[visible, 1],
+                             'xmax': boxes[visible, 2],
+                             'ymax': boxes[visible, 3]})
+
+    def evaluate_object_detections(self, detections, ids=None, iou_thresh=0.5):
+        """
+        Evaluates COCO object detections against the lblrgbd labels
+
+        Detections of classes without a Robot@Home equivalent are ignored.
+        The mean average precision is df['ap'].mean()
+
+        Parameters
+        ----------
+        detections: a long format dataframe of detections (see
+                    detections2df), e.g. from detect_objects,
+                    lblrgbd_object_detection or get_object_detections
+        ids: the evaluated sensor observation ids, the frames of detections
+             if None (frames without detections would be missed)
+        iou_thresh: minimum IoU of a true positive
+
+        Returns
+        -------
+        A dataframe with a row per class and columns class_id, class_name,
+        num_gt, num_det, tp, precision, recall and ap (see average_precision)
+        """
+        if ids is None:
+            ids = detections['frame_id'].to_numpy()
+        ids = np.unique(np.asarray(ids, dtype=np.int64))
+        ground_truth = self.get_ground_truth_boxes(ids)
+
+        coco_class_ids = np.unique(self.__get_coco_class_ids())
+        detections = detections[detections['frame_id'].isin(ids) &
+                                detections['class_id'].isin(coco_class_ids[coco_class_ids >= 0])]
+        det_boxes = detections[['xmin', 'ymin', 'xmax', 'ymax']].to_numpy()
+        gt_boxes = ground_truth[['xmin', 'ymin', 'xmax', 'ymax']].to_numpy()
+
+        true_positives = rh.match_detections(detections['frame_id'].to_numpy(),
+                                             detections['class_id'].to_numpy(),
+                                             detections['score'].to_numpy(),
+                                             det_boxes,
+                                             ground_truth['frame_id'].to_numpy(),
+                                             ground_truth['class_id'].to_numpy(),
+                                             gt_boxes,
+                                             iou_thresh)
+        df_ap = rh.average_precision(detections['class_id'].to_numpy(),
+                                     detections['score'].to_numpy(),
+                                     true_positives,
+                                     ground_truth['class_id'].to_numpy())
+        df_ap.insert(1, 'class_name', np.array(rh.COCO_CLASSES)[df_ap['class_id']])
+        return df_ap
 
     def process_with_yolo(self,
                           source='lblrgbd',
@@ -952,8 +2223,8 @@ class RobotAtHome():
 
 
         #  get NN model
-        ctx_ = context.gpu() if gpu else context.cpu()
-        net = model_zoo.get_model('yolo3_darknet53_coco',
+        ctx_ = mx.context.gpu() if gpu else mx.context.cpu()
+        net = gcv.model_zoo.get_model('yolo3_darknet53_coco',
                                   pretrained=True,
                                   ctx=ctx_)
 
@@ -973,14 +2244,14 @@ class RobotAtHome():
 
             # core
             try:
-                img = image.imread(image_path_file_name)
+                img = mx.image.imread(image_path_file_name)
             except:
                 print('%s is not a valid raster image' % image_path_file_name)
 
             # long_edge_size = img.shape[0]
             short_edge_size = img.shape[1]
 
-            x, img = data.transforms.presets.yolo.load_test(image_path_file_name,
+            x, img = gcv.data.transforms.presets.yolo.load_test(image_path_file_name,
                                                             short=short_edge_size)
             # rh.logger.debug('Shape of pre-processed image: {}', x.shape)
             class_ids, scores, bounding_boxs = net(x)
@@ -998,7 +2269,7 @@ class RobotAtHome():
                            df_scores,
                            df_bounding_boxs])
 
-            utils.viz.cv_plot_bbox(img,
+            gcv.utils.viz.cv_plot_bbox(img,
                                    bounding_boxs[0],
                                    scores[0],
                                    class_ids[0],
@@ -1096,8 +2367,8 @@ class RobotAtHome():
         # ctx = context.cpu()
         # ctx = context.cpu_pinned()
         # ctx = context.gpu(dev_id)
-        ctx_ = context.gpu() if gpu else context.cpu()
-        net = model_zoo.get_model('faster_rcnn_resnet50_v1b_coco',
+        ctx_ = mx.context.gpu() if gpu else mx.context.cpu()
+        net = gcv.model_zoo.get_model('faster_rcnn_resnet50_v1b_coco',
                                   pretrained=True,
                                   ctx=ctx_) 
         nn_out = []
@@ -1115,14 +2386,14 @@ class RobotAtHome():
 
             # core
             try:
-                img = image.imread(image_path_file_name)
+                img = mx.image.imread(image_path_file_name)
             except:
                 print('%s is not a valid raster image' % image_path_file_name)
 
             # long_edge_size = img.shape[0]
             short_edge_size = img.shape[1]
 
-            x, img = data.transforms.presets.rcnn.load_test(image_path_file_name,
+            x, img = gcv.data.transforms.presets.rcnn.load_test(image_path_file_name,
                                                             short=short_edge_size)
             # rh.logger.debug('Shape of pre-processed image: {}', x.shape)
             class_ids, scores, bounding_boxs = net(x)
@@ -1139,7 +2410,7 @@ class RobotAtHome():
                            df_scores,
                            df_bounding_boxs])
 
-            utils.viz.cv_plot_bbox(img,
+            gcv.utils.viz.cv_plot_bbox(img,
                                    bounding_boxs[0],
                                    scores[0],
                                    class_ids[0],
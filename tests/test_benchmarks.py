@@ -0,0 +1,916 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = "Gregorio Ambrosio"
+__contact__ = "gambrosio[at]uma.es"
+__copyright__ = "Copyright 2021, 2026, Gregorio Ambrosio"
+__date__ = "2026/10/17"
+__license__ = "MIT"
+
+import unittest
+import os
+import sys
+import time
+import importlib.util
+import tempfile
+import tracemalloc
+import robotathome as rh
+import numpy as np
+import cv2
+import pandas as pd
+from robotathome.lazy import lazy_import
+
+mx = lazy_import('mxnet')
+gcv = lazy_import('gluoncv')
+
+
+def per_call(func, repeat=200):
+    """
+    Returns the mean wall time (in microseconds) of calling func()
+    """
+    func()  # warm up: statement caches, file system caches, ...
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - t0) / repeat * 1e6
+
+
+def write_chelmnts_unit(unit_path, num_homes=10, num_rooms=10, seed=0):
+    """
+    Writes a synthetic characterized elements unit (types.txt and a
+    features file per room, with 50 objects, 50 relations and 20
+    observations each)
+    """
+    rng = np.random.default_rng(seed)
+
+    def features(n):
+        return ' '.join(f'{v:.6f}' for v in rng.uniform(0, 1, n))
+
+    home_names = [f'home{i}-s1' for i in range(num_homes)]
+    os.makedirs(unit_path)
+    with open(os.path.join(unit_path, 'types.txt'), 'w') as file_handler:
+        file_handler.write(f"N_homes {num_homes}\n")
+        file_handler.writelines(f"{i} {name}\n" for i, name in enumerate(home_names))
+    for home_name in home_names:
+        os.makedirs(os.path.join(unit_path, home_name))
+        for room_index in range(num_rooms):
+            lines = [f"Home {home_name} 0 Room_type bedroom 1 ID {room_index} "
+                     f"N_objects 50 N_objectFeatures 32"]
+            lines += [f"chair_{i} {i} chair 11 {features(32)}" for i in range(50)]
+            lines += ["N_relations 50 N_relationFeatures 11"]
+            lines += [f"chair_{i} chair_0 {i} {i} 0 11 11 {features(11)}" for i in range(50)]
+            lines += ["N_observations 20 N_roomFeatures 48 N_scanFeatures 9"]
+            lines += [f"RGBD_1 {i} 2 0 1 {features(57)}" for i in range(20)]
+            with open(os.path.join(unit_path, home_name,
+                                   f'features_{home_name}_bedroom{room_index}.txt'),
+                      'w') as file_handler:
+                file_handler.write('\n'.join(lines) + '\n')
+
+
+class Test(unittest.TestCase):
+    ''' Benchmarks over the Robot@Home dataset '''
+
+    def setUp(self):
+        rh.log.enable_logger(sink=sys.stderr, level="INFO")
+        rh.logger.info("""
+        Remember:
+        python -m unittest <testModule>.<className>.<function_name>
+        e.g.
+        python -m unittest test_benchmarks.Test.test_query_latency
+        The dataset location can be set through RH_PATH and RH_WSPC_PATH
+        """)
+
+        self.rh_path = os.environ.get(
+            'RH_PATH',
+            '/media/goyo/WDGREEN2TB-A/Users/goyo/Documents/PhD2020/Robot@Home_DataSet_v2.0.0/')
+        self.wspc_path = os.environ.get(
+            'RH_WSPC_PATH',
+            '/media/goyo/WDGREEN2TB-A/Users/goyo/Documents/PhD2020/WORKSPACE')
+        self.so_id = 100000
+
+        self.rh_obj = rh.RobotAtHome(self.rh_path, self.wspc_path)
+
+    def tearDown(self):
+        del self.rh_obj
+
+    def test_query_latency(self):
+        """
+        Per call latency of point lookups: f-string sql + pd.read_sql_query
+        (before) versus parameter bound, statement cached queries (after)
+        """
+        con = self.rh_obj.get_con()
+        so_id = self.so_id
+
+        def before_files():
+            return pd.read_sql_query(
+                f"select pth, f1, f2, f3 from rh_temp_lblrgbd where id = {so_id}",
+                con)
+
+        def before_labels():
+            return pd.read_sql_query(
+                f"select * from rh_lblrgbd_labels where sensor_observation_id = {so_id}",
+                con)
+
+        def before_sequence():
+            return pd.read_sql_query(
+                """
+                select id, t, pth, f1, f2, f3 from rh_temp_lblrgbd
+                where hs_name = 'anto-s1' and hss_id = 0 and
+                      r_name = 'anto_livingroom1' and s_name = 'RGBD_2'
+                order by t
+                """,
+                con)
+
+        def after_files():
+            return self.rh_obj._RobotAtHome__get_lblrgbd_files(so_id)
+
+        def after_labels():
+            return self.rh_obj.get_labels_from_lblrgbd(so_id, df=False)
+
+        def after_sequence():
+            return self.rh_obj.get_sensor_observation_files('lblrgbd',
+                                                            'anto-s1',
+                                                            0,
+                                                            'anto_livingroom1',
+                                                            'RGBD_2',
+                                                            df=False)
+
+        rh.logger.info("{:<20} {:>14} {:>14} {:>8}",
+                       "lookup", "before (us)", "after (us)", "speedup")
+        for name, before, after in [("files by id", before_files, after_files),
+                                    ("labels by id", before_labels, after_labels),
+                                    ("sequence files", before_sequence, after_sequence)]:
+            t_before = per_call(before)
+            t_after = per_call(after)
+            rh.logger.info("{:<20} {:>14.1f} {:>14.1f} {:>7.1f}x",
+                           name, t_before, t_after, t_before / t_after)
+            self.assertLess(t_after, t_before)
+
+    def test_materialized_lblrgbd(self):
+        """
+        Sequence and id lookups over the rh_temp_lblrgbd join view versus
+        the materialized and indexed rh_cache.rh2_lblrgbd table
+        """
+        t0 = time.perf_counter()
+        rh_mat = rh.RobotAtHome(self.rh_path, self.wspc_path, materialize=True)
+        rh.logger.info("RobotAtHome(materialize=True) opened in {:.3f} s",
+                       time.perf_counter() - t0)
+
+        def sequence(rh_obj):
+            return lambda: rh_obj.get_sensor_observation_files('lblrgbd',
+                                                               'anto-s1',
+                                                               0,
+                                                               'anto_livingroom1',
+                                                               'RGBD_2',
+                                                               df=False)
+
+        def files_by_id(rh_obj):
+            return lambda: rh_obj._RobotAtHome__get_lblrgbd_files(self.so_id)
+
+        rh.logger.info("{:<20} {:>14} {:>18} {:>8}",
+                       "lookup", "view (us)", "materialized (us)", "speedup")
+        for name, func in [("sequence files", sequence),
+                           ("files by id", files_by_id)]:
+            t_view = per_call(func(self.rh_obj))
+            t_mat = per_call(func(rh_mat))
+            rh.logger.info("{:<20} {:>14.1f} {:>18.1f} {:>7.1f}x",
+                           name, t_view, t_mat, t_view / t_mat)
+
+        self.assertListEqual(sequence(rh_mat)()['id'].tolist(),
+                             sequence(self.rh_obj)()['id'].tolist())
+
+    def test_files_index(self):
+        """
+        Resolving the intensity file names of a whole sequence: one sql
+        query per frame versus a single batch lookup in the in-memory files
+        index
+        """
+        rows = self.rh_obj.get_sensor_observation_files('lblrgbd',
+                                                        'anto-s1',
+                                                        0,
+                                                        'anto_livingroom1',
+                                                        'RGBD_2',
+                                                        df=False)
+        con = self.rh_obj.get_con()
+
+        def per_frame_queries():
+            return [con.execute("select pth, f2 from rh_temp_lblrgbd where id = ?",
+                                (int(so_id),)).fetchone()
+                    for so_id in rows['id']]
+
+        def files_index():
+            return self.rh_obj.get_lblrgbd_file_names(rows['id'], 'intensity')
+
+        t_queries = per_call(per_frame_queries, repeat=20)
+        t_index = per_call(files_index, repeat=20)
+        rh.logger.info("{} frames: per frame queries {:.1f} us, files index {:.1f} us ({:.2f} us/frame)",
+                       len(rows), t_queries, t_index, t_index / len(rows))
+        self.assertLess(t_index, t_queries)
+
+    def test_iter_frames(self):
+        """
+        Decoding the rgb and depth files of a sequence one by one versus
+        prefetching them in a thread pool with iter_frames
+        """
+        rows = self.rh_obj.get_sensor_observation_files('lblrgbd',
+                                                        'anto-s1',
+                                                        0,
+                                                        'anto_livingroom1',
+                                                        'RGBD_2',
+                                                        df=False)
+
+        def sequential():
+            for so_id in rows['id']:
+                self.rh_obj.get_rgb_image_from_lblrgbd(so_id)
+                self.rh_obj.get_depth_image_from_lblrgbd(so_id)
+
+        def prefetched(num_workers):
+            return lambda: list(self.rh_obj.iter_lblrgbd_frames(rows['id'],
+                                                                ('rgb', 'depth'),
+                                                                num_workers=num_workers))
+
+        t_sequential = per_call(sequential, repeat=20)
+        rh.logger.info("{} frames, sequential: {:.1f} frames/s",
+                       len(rows), len(rows) / t_sequential * 1e6)
+        for num_workers in [1, 2, 4, 8]:
+            t_prefetched = per_call(prefetched(num_workers), repeat=20)
+            rh.logger.info("{} frames, iter_frames with {} workers: {:.1f} frames/s",
+                           len(rows), num_workers, len(rows) / t_prefetched * 1e6)
+
+    def test_frame_cache(self):
+        """
+        Revisiting the frames of a sequence: PNG decoding versus the decoded
+        frame cache
+        """
+        rows = self.rh_obj.get_sensor_observation_files('lblrgbd',
+                                                        'anto-s1',
+                                                        0,
+                                                        'anto_livingroom1',
+                                                        'RGBD_2',
+                                                        df=False)
+        rh_cached = rh.RobotAtHome(self.rh_path,
+                                   self.wspc_path,
+                                   frame_cache_size=256 * 1024**2)
+
+        def revisit(rh_obj):
+            def func():
+                rh_obj.get_rgb_images_from_lblrgbd(rows['id'])
+                rh_obj.get_depth_images_from_lblrgbd(rows['id'])
+            return func
+
+        t_decoded = per_call(revisit(self.rh_obj), repeat=20)
+        t_cached = per_call(revisit(rh_cached), repeat=20)
+        rh.logger.info("{} frames revisited: decoded {:.1f} us, cached {:.1f} us ({:.1f}x)",
+                       len(rows), t_decoded, t_cached, t_decoded / t_cached)
+        rh.logger.info("frame cache stats: {}", rh_cached.get_frame_cache_stats())
+        self.assertLess(t_cached, t_decoded)
+
+    def test_mask_cache(self):
+        """
+        Getting the label masks of a sequence: line by line text parsing
+        (before), vectorized text parsing and binary .npy mask cache
+        """
+        rows = self.rh_obj.get_sensor_observation_files('lblrgbd',
+                                                        'anto-s1',
+                                                        0,
+                                                        'anto_livingroom1',
+                                                        'RGBD_2',
+                                                        df=False)
+        file_names = self.rh_obj.get_lblrgbd_file_names(rows['id'], 'labels')
+        rh_no_cache = rh.RobotAtHome(self.rh_path, self.wspc_path, mask_cache=False)
+        rh_cached = rh.RobotAtHome(self.rh_path, self.wspc_path, mask_cache=True)
+        rh_cached.create_mask_cache()
+
+        def line_by_line():
+            for file_name in file_names:
+                mask = []
+                with open(file_name, "r") as file_handler:
+                    line = file_handler.readline()
+                    while line:
+                        words = line.strip().split()
+                        if words[0][0] != '#':
+                            num_of_labels = int(words[0])
+                            break
+                        line = file_handler.readline()
+                    for i in range(num_of_labels):
+                        line = file_handler.readline()
+                    line = file_handler.readline()
+                    while line:
+                        mask.append(list(map(int, line.strip().split())))
+                        line = file_handler.readline()
+                np.rot90(np.array(mask))
+
+        t_before = per_call(line_by_line, repeat=5)
+        t_parsed = per_call(lambda: rh_no_cache.get_masks_from_lblrgbd(rows['id']), repeat=5)
+        t_cached = per_call(lambda: rh_cached.get_masks_from_lblrgbd(rows['id']), repeat=5)
+        rh.logger.info("{} masks: line by line {:.2f} ms/frame, vectorized {:.2f} ms/frame, cached {:.2f} ms/frame",
+                       len(rows),
+                       t_before / len(rows) / 1e3,
+                       t_parsed / len(rows) / 1e3,
+                       t_cached / len(rows) / 1e3)
+        self.assertLess(t_cached, t_parsed)
+        self.assertLess(t_parsed, t_before)
+
+    def test_label_masks(self):
+        """
+        Extracting every label mask of an observation with its pixel count,
+        bounding box and centroid: one label at a time (before) versus
+        broadcasting over the bit planes
+        """
+        mask = self.rh_obj.get_mask_from_lblrgbd(self.so_id)
+        labels = [label[1] for label in self.rh_obj.get_labels_from_lblrgbd(self.so_id, df=False)]
+
+        def one_label_at_a_time():
+            masks = []
+            for label in labels:
+                arr = mask & (2**(label))
+                np.clip(arr, 0, 1, out=arr)
+                arr = np.uint8(arr[:, 2:-2])
+                ys, xs = np.nonzero(arr)
+                if len(xs):
+                    stats = (len(xs), xs.min(), ys.min(), xs.max(), ys.max(),
+                             xs.mean(), ys.mean())
+                masks.append((arr, stats))
+            return masks
+
+        t_before = per_call(one_label_at_a_time)
+        t_after = per_call(lambda: self.rh_obj.get_label_masks(mask, labels))
+        rh.logger.info("{} labels: one at a time {:.1f} us, broadcast {:.1f} us",
+                       len(labels), t_before, t_after)
+        self.assertLess(t_after, t_before)
+
+    def test_depth_loading(self):
+        """
+        Loading metric depth for a sequence: IMREAD_COLOR + cvtColor + float
+        conversion (before) versus IMREAD_ANYDEPTH into a preallocated
+        float32 stack
+        """
+        rows = self.rh_obj.get_sensor_observation_files('lblrgbd',
+                                                        'anto-s1',
+                                                        0,
+                                                        'anto_livingroom1',
+                                                        'RGBD_2',
+                                                        df=False)
+        file_names = self.rh_obj.get_lblrgbd_file_names(rows['id'], 'depth')
+        out = self.rh_obj.get_depths_from_lblrgbd(rows['id'], metric=True)
+
+        def before():
+            return [cv2.cvtColor(cv2.imread(file_name, cv2.IMREAD_COLOR),
+                                 cv2.COLOR_BGR2GRAY).astype(np.float32) * self.rh_obj.DEPTH_SCALE_8BIT
+                    for file_name in file_names]
+
+        t_before = per_call(before, repeat=20)
+        t_single = per_call(lambda: [self.rh_obj.get_depth_from_lblrgbd(so_id, metric=True)
+                                     for so_id in rows['id']], repeat=20)
+        t_batch = per_call(lambda: self.rh_obj.get_depths_from_lblrgbd(rows['id'],
+                                                                       metric=True,
+                                                                       out=out), repeat=20)
+        rh.logger.info("{} depth frames: before {:.1f} us/frame, anydepth {:.1f} us/frame, batch {:.1f} us/frame",
+                       len(rows),
+                       t_before / len(rows),
+                       t_single / len(rows),
+                       t_batch / len(rows))
+
+    def test_point_clouds(self):
+        """
+        Back-projecting a sequence to world frame point clouds: rays computed
+        per frame (before) versus cached ray grids
+        """
+        rows = self.rh_obj.get_sensor_observation_files('lblrgbd',
+                                                        'anto-s1',
+                                                        0,
+                                                        'anto_livingroom1',
+                                                        'RGBD_2',
+                                                        df=False)
+        depths = self.rh_obj.get_depths_from_lblrgbd(rows['id'], metric=True)
+        rotations, translations = self.rh_obj.get_sensor_poses(rows['id'])
+
+        def before():
+            point_clouds = []
+            for depth, rotation, translation in zip(depths, rotations, translations):
+                native_depth = np.rot90(depth, k=-1)
+                h, w = native_depth.shape
+                fx = (w / 2) / np.tan(np.deg2rad(self.rh_obj.DEPTH_CAMERA_HFOV) / 2)
+                fy = (h / 2) / np.tan(np.deg2rad(self.rh_obj.DEPTH_CAMERA_VFOV) / 2)
+                u, v = np.meshgrid(np.arange(w) - (w - 1) / 2,
+                                   np.arange(h) - (h - 1) / 2)
+                points = np.stack([native_depth,
+                                   -u / fx * native_depth,
+                                   -v / fy * native_depth], axis=-1).reshape(-1, 3)
+                points = points[native_depth.reshape(-1) > 0]
+                point_clouds.append((points @ rotation.T + translation).astype(np.float32))
+            return point_clouds
+
+        def after():
+            return [self.rh_obj._RobotAtHome__back_project(depth, rotation, translation, None, None)
+                    for depth, rotation, translation in zip(depths, rotations, translations)]
+
+        t_before = per_call(before, repeat=20)
+        t_after = per_call(after, repeat=20)
+        num_of_points = sum(len(point_cloud) for point_cloud in after())
+        rh.logger.info("{} frames ({} points): before {:.2f} ms/frame, cached rays {:.2f} ms/frame",
+                       len(rows), num_of_points,
+                       t_before / len(rows) / 1e3,
+                       t_after / len(rows) / 1e3)
+        t_total = per_call(lambda: self.rh_obj.get_point_clouds(rows['id'], rgb=True, labels=True),
+                           repeat=5)
+        rh.logger.info("get_point_clouds with rgb and labels (decoding included): {:.2f} ms/frame",
+                       t_total / len(rows) / 1e3)
+        self.assertLess(t_after, t_before)
+
+    def test_room_point_cloud(self):
+        """
+        Fusing a room: concatenating every frame point cloud and downsampling
+        at the end (before) versus streaming frames into a hashed voxel grid
+        """
+        room = ('anto-s1', 0, 'anto_livingroom1')
+        voxel_size = 0.1
+        ids = np.concatenate([
+            self.rh_obj.get_sensor_observation_files('lblrgbd', *room, sensor_name, df=False)['id']
+            for sensor_name in ['RGBD_1', 'RGBD_2', 'RGBD_3', 'RGBD_4']])
+
+        def before():
+            points = np.concatenate(self.rh_obj.get_point_clouds(ids))
+            voxels, inverse, counts = np.unique(np.floor(points / voxel_size).astype(np.int64),
+                                                axis=0,
+                                                return_inverse=True,
+                                                return_counts=True)
+            return np.stack([np.bincount(inverse.ravel(), points[:, axis])
+                             for axis in range(3)], axis=1) / counts[:, np.newaxis]
+
+        def after():
+            return self.rh_obj.get_room_point_cloud(*room,
+                                                    voxel_size=voxel_size,
+                                                    rgb=False,
+                                                    labels=False)
+
+        for name, func in [("concatenate", before), ("voxel grid", after)]:
+            tracemalloc.start()
+            t0 = time.perf_counter()
+            point_cloud = func()
+            elapsed = time.perf_counter() - t0
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            rh.logger.info("{:<12} {} frames -> {} points: {:.2f} s, peak memory {:.1f} MB",
+                           name, len(ids), len(point_cloud), elapsed, peak / 1024**2)
+
+    def test_video_rendering(self):
+        """
+        End to end fps of get_video_from_rgbd: serial read + write (before)
+        versus the pipelined renderer (reader threads, writer thread)
+        """
+        locator = ('lblrgbd', 'anto-s1', 0, 'anto_livingroom1', 'RGBD_2')
+        rows = self.rh_obj.get_sensor_observation_files(*locator, df=False)
+        file_names = self.rh_obj.get_lblrgbd_file_names(rows['id'], 'intensity')
+        video_path_file_name = os.path.join(self.wspc_path, 'benchmark_video.avi')
+        fourcc = cv2.VideoWriter_fourcc(*'MJPG')
+
+        def serial():
+            img = cv2.imread(file_names[0], cv2.IMREAD_COLOR)
+            img_h, img_w, _ = img.shape
+            out = cv2.VideoWriter(video_path_file_name, fourcc, 10, (img_w, img_h))
+            for file_name in file_names:
+                out.write(cv2.imread(file_name, cv2.IMREAD_COLOR))
+            out.release()
+
+        def pipelined(**kwargs):
+            return lambda: self.rh_obj.get_video_from_rgbd(*locator,
+                                                           video_file_name='benchmark_video.avi',
+                                                           **kwargs)
+
+        for name, func in [("serial", serial),
+                           ("pipelined", pipelined()),
+                           ("pipelined, stride 2", pipelined(stride=2)),
+                           ("pipelined, half size", pipelined(resize=(120, 160)))]:
+            t = per_call(func, repeat=5)
+            rh.logger.info("{:<22} {:.1f} fps", name, len(rows) / t * 1e6)
+        os.remove(video_path_file_name)
+
+    def test_detection_output(self):
+        """
+        Converting the network output of a sequence to dataframes: three
+        nested dataframes per frame (nn_out2df) versus a single long format
+        dataframe built from the filtered NumPy arrays
+        """
+        num_frames, num_objects = 355, 100
+        rng = np.random.default_rng(0)
+        class_ids = np.full((num_frames, num_objects, 1), -1, dtype=np.float32)
+        scores = np.full((num_frames, num_objects, 1), -1, dtype=np.float32)
+        bounding_boxs = rng.uniform(0, 320, (num_frames, num_objects, 4)).astype(np.float32)
+        # Network outputs are sorted by score and padded with -1
+        num_detections = rng.integers(0, num_objects, num_frames)
+        for i, n in enumerate(num_detections):
+            class_ids[i, :n, 0] = rng.integers(0, 80, n)
+            scores[i, :n, 0] = np.sort(rng.uniform(0, 1, n))[::-1]
+        frame_ids = np.arange(100000, 100000 + num_frames)
+
+        def nested():
+            nn_out_list = []
+            for i in range(num_frames):
+                nn_out_list.append(
+                    [pd.DataFrame(class_ids[i].tolist(), columns=['class_ids']),
+                     pd.DataFrame(scores[i].tolist(), columns=['scores']),
+                     pd.DataFrame(bounding_boxs[i].tolist(),
+                                  columns=['xmin', 'ymin', 'xmax', 'ymax'])])
+            return pd.DataFrame(nn_out_list, columns=['class_ids', 'scores', 'bounding_boxs'])
+
+        def long_format(thresh):
+            def func():
+                frame_pos, *detections = rh.filter_detections(class_ids,
+                                                              scores,
+                                                              bounding_boxs,
+                                                              thresh)
+                return rh.detections2df(frame_ids[frame_pos], *detections)
+            return func
+
+        df_detections = long_format(0.0)()
+        self.assertEqual(len(df_detections), num_detections.sum())
+        t_nested = per_call(nested, repeat=5)
+        rh.logger.info("{} frames, nested dataframes: {:.1f} ms", num_frames, t_nested / 1e3)
+        for thresh in [0.0, 0.5]:
+            t_long = per_call(long_format(thresh), repeat=20)
+            rh.logger.info("{} frames, long format (thresh {}): {:.2f} ms ({:.0f}x)",
+                           num_frames, thresh, t_long / 1e3, t_nested / t_long)
+
+    def test_detection_evaluation(self):
+        """
+        Evaluating detections against the lblrgbd labels: per frame and per
+        object Python loops over get_label_mask versus the vectorized
+        evaluator (label mask statistics, per frame IoU matrices and a
+        single pass average precision)
+        """
+        ids = self.rh_obj.get_lblrgbd_ids()
+        ground_truth = self.rh_obj.get_ground_truth_boxes(ids)
+        # Synthetic detections: the ground truth boxes, jittered, plus as
+        # many false positives
+        rng = np.random.default_rng(0)
+        boxes = ground_truth[['xmin', 'ymin', 'xmax', 'ymax']].to_numpy()
+        detections = rh.detections2df(
+            np.tile(ground_truth['frame_id'].to_numpy(), 2),
+            np.tile(ground_truth['class_id'].to_numpy(), 2),
+            rng.uniform(0, 1, 2 * len(boxes)),
+            np.concatenate([boxes + rng.normal(0, 4, boxes.shape),
+                            boxes + rng.uniform(-100, 100, (len(boxes), 2)).repeat(2, axis=1)]))
+        coco_classes = {name: i for i, name in enumerate(rh.COCO_CLASSES)}
+
+        def loops():
+            gt = {}
+            for so_id in ids:
+                mask = self.rh_obj.get_mask_from_lblrgbd(so_id)
+                for _, local_id, name, _, _ in self.rh_obj.get_labels_from_lblrgbd(so_id, df=False):
+                    if name not in rh.RH2COCO_CLASSES:
+                        continue
+                    ys, xs = np.nonzero(self.rh_obj.get_label_mask(mask, [local_id])[0])
+                    if len(xs):
+                        gt.setdefault((so_id, coco_classes[rh.RH2COCO_CLASSES[name]]), []).append(
+                            [xs.min(), ys.min(), xs.max() + 1, ys.max() + 1, False])
+            num_tp = 0
+            for row in detections.sort_values('score', ascending=False).itertuples():
+                best_iou, best = 0.5, None
+                for box in gt.get((row.frame_id, row.class_id), []):
+                    iw = min(row.xmax, box[2]) - max(row.xmin, box[0])
+                    ih = min(row.ymax, box[3]) - max(row.ymin, box[1])
+                    if iw <= 0 or ih <= 0 or box[4]:
+                        continue
+                    inter = iw * ih
+                    iou = inter / ((row.xmax - row.xmin) * (row.ymax - row.ymin) +
+                                   (box[2] - box[0]) * (box[3] - box[1]) - inter)
+                    if iou >= best_iou:
+                        best_iou, best = iou, box
+                if best is not None:
+                    best[4] = True
+                    num_tp += 1
+            return num_tp
+
+        df_ap = self.rh_obj.evaluate_object_detections(detections, ids)
+        self.assertEqual(df_ap['tp'].sum(), loops())
+        t_loops = per_call(loops, repeat=3)
+        t_vectorized = per_call(lambda: self.rh_obj.evaluate_object_detections(detections, ids),
+                                repeat=3)
+        rh.logger.info("{} frames, {} detections, mAP {:.3f}", len(ids), len(detections),
+                       df_ap['ap'].mean())
+        rh.logger.info("loops: {:.1f} ms, vectorized: {:.1f} ms ({:.1f}x)",
+                       t_loops / 1e3, t_vectorized / 1e3, t_loops / t_vectorized)
+
+    @unittest.skipUnless(importlib.util.find_spec('gluoncv'), "gluoncv is not installed")
+    def test_batched_detection(self):
+        """
+        Detection throughput by batch size and number of MXNet threads. The
+        network is randomly initialised, so no weights are downloaded
+        """
+        rows = self.rh_obj.get_sensor_observation_files('lblrgbd',
+                                                        'anto-s1',
+                                                        0,
+                                                        'anto_livingroom1',
+                                                        'RGBD_2',
+                                                        df=False)
+        imgs = self.rh_obj.get_rgb_images_from_lblrgbd(rows['id'][:16])
+
+        net = gcv.model_zoo.get_model('yolo3_mobilenet1.0_coco',
+                                      pretrained=False,
+                                      pretrained_base=False)
+        net.initialize()
+        net.hybridize(static_alloc=True)
+
+        def detect(batch_size):
+            def func():
+                for i in range(0, len(imgs), batch_size):
+                    class_ids, _, _ = rh.object_detection_batch(net,
+                                                                imgs[i:i+batch_size],
+                                                                'yolo')
+                    # Waits for the asynchronous engine
+                    self.assertEqual(class_ids.asnumpy().shape[0],
+                                     len(imgs[i:i+batch_size]))
+            return func
+
+        for num_threads in sorted({1, os.cpu_count()}):
+            rh.set_mxnet_threads(num_threads)
+            for batch_size in [1, 4, 8, 16]:
+                t = per_call(detect(batch_size), repeat=3)
+                rh.logger.info("{} threads, batch size {:>2}: {:.1f} frames/s",
+                               num_threads, batch_size, len(imgs) / t * 1e6)
+
+    @unittest.skipUnless(importlib.util.find_spec('gluoncv') and importlib.util.find_spec('fire'),
+                         "gluoncv or fire are not installed")
+    def test_sharded_detection(self):
+        """
+        Scaling efficiency of the multi-process object detection runner from
+        1 to os.cpu_count() workers
+        """
+        from robotathome import detector
+
+        df_report = detector.scaling_report(self.rh_path,
+                                            self.wspc_path,
+                                            num_frames=128,
+                                            model='yolo3_mobilenet1.0_coco')
+        rh.logger.info("\n{}", df_report.to_string(index=False))
+        self.assertEqual(df_report['processes'].iloc[0], 1)
+
+        # Merged results are the same as a single process run
+        ids = self.rh_obj.get_lblrgbd_ids()[:32]
+        df_sharded = detector.detect_objects(self.rh_path, self.wspc_path, ids=ids,
+                                             model='yolo3_mobilenet1.0_coco',
+                                             num_processes=2, shard_size=8)
+        df_single = self.rh_obj.detect_objects(ids, 'yolo3_mobilenet1.0_coco')
+        self.assertTrue(np.array_equal(df_sharded['frame_id'], df_single['frame_id']))
+        self.assertTrue(np.allclose(df_sharded['score'], df_single['score'], atol=1e-4))
+
+
+class TestDatasetUnits(unittest.TestCase):
+    ''' Benchmarks over synthetic dataset units, no dataset is needed '''
+
+    def setUp(self):
+        rh.log.enable_logger(sink=sys.stderr, level="INFO")
+
+    def test_dataset_node_memory(self):
+        """
+        Memory of a characterized elements unit loaded by its _load_function:
+        object, relation and observation nodes with a __dict__ (before)
+        versus the unit __slots__ nodes (after)
+        """
+        from robotathome.dataset import Dataset
+
+        chelmnts = Dataset.DatasetUnitCharacterizedElements
+
+        # Subclasses without __slots__ get a __dict__ per instance again
+        class DictNodesUnit(chelmnts):
+            class Object(chelmnts.Object):
+                pass
+
+            class ObjectFeatures(chelmnts.ObjectFeatures):
+                pass
+
+            class ObjectRelation(chelmnts.ObjectRelation):
+                pass
+
+            class ObjectRelationFeatures(chelmnts.ObjectRelationFeatures):
+                pass
+
+            class Observation(chelmnts.Observation):
+                pass
+
+            class ObservationFeatures(chelmnts.ObservationFeatures):
+                pass
+
+            class ObservationScanFeatures(chelmnts.ObservationScanFeatures):
+                pass
+
+        with tempfile.TemporaryDirectory() as tmp_path:
+            unit_path = os.path.join(tmp_path, 'Robot@Home-dataset_characterized-elements')
+            write_chelmnts_unit(unit_path, num_homes=20)
+
+            sizes = {}
+            for name, unit_class in [("__dict__", DictNodesUnit), ("__slots__", chelmnts)]:
+                unit = unit_class('chelmnts', unit_path)
+                tracemalloc.start()
+                unit._load_function()
+                size, _ = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                sizes[name] = size
+                node = unit.home_sessions[0].rooms[0].objects[0]
+                self.assertEqual(hasattr(node, '__dict__'), name == "__dict__")
+                num_nodes = sum(len(room.objects) + len(room.relations) +
+                                len(room.observations) for room in unit.rooms)
+                del unit, node
+
+        node_size = (sizes["__dict__"] - sizes["__slots__"]) / num_nodes
+        rh.logger.info("{} nodes, __dict__: {:.1f} MiB, __slots__: {:.1f} MiB "
+                       "({:.0f} bytes less per node)",
+                       num_nodes, sizes["__dict__"] / 1024**2,
+                       sizes["__slots__"] / 1024**2, node_size)
+        self.assertLess(sizes["__slots__"], sizes["__dict__"])
+
+    def test_parallel_autoload(self):
+        """
+        Loading several dataset units one after another (before) versus
+        concurrently in worker processes (after), with and without snapshots
+        """
+        from robotathome.dataset import Dataset
+
+        num_units = 4
+        with tempfile.TemporaryDirectory() as tmp_path:
+            dataset = Dataset("Robot@Home", tmp_path, autoload=False)
+
+            def load(num_workers, snapshot_path=None):
+                dataset.unit = {}
+                for i in range(num_units):
+                    unit = Dataset.DatasetUnitCharacterizedElements(
+                        f'Characterized elements {i}', os.path.join(tmp_path, f'chelmnts{i}'))
+                    unit.snapshot_path = snapshot_path
+                    dataset.unit[f'chelmnts{i}'] = unit
+                t0 = time.perf_counter()
+                load_report = dataset.load_units(num_workers)
+                return load_report, time.perf_counter() - t0
+
+            for i in range(num_units):
+                write_chelmnts_unit(os.path.join(tmp_path, f'chelmnts{i}'), seed=i)
+
+            serial_report, t_serial = load(1)
+            serial_features = dataset.unit['chelmnts1'].object_features.values
+            # At least two workers, so worker processes are used
+            num_workers = max(2, os.cpu_count())
+            for snapshot_path in [None, os.path.join(tmp_path, 'snapshots')]:
+                parallel_report, t_parallel = load(num_workers, snapshot_path)
+                self.assertTrue(all(unit.is_loaded() for unit in dataset.unit.values()))
+                self.assertTrue(np.array_equal(dataset.unit['chelmnts1'].object_features.values,
+                                               serial_features))
+                rh.logger.info("{} units, {} workers (snapshots: {}): serial {:.2f} s "
+                               "(slowest unit {:.2f} s), parallel {:.2f} s",
+                               num_units, num_workers, snapshot_path is not None,
+                               t_serial, max(seconds for seconds, _ in serial_report.values()),
+                               t_parallel)
+            self.assertEqual(set(parallel_report), set(dataset.unit))
+
+    def test_feature_matrices(self):
+        """
+        Per room mean object features: Python loops over the feature strings
+        (before) versus the float32 feature matrix of the characterized
+        elements unit (after)
+        """
+        from robotathome.dataset import Dataset
+
+        chelmnts = Dataset.DatasetUnitCharacterizedElements
+        num_rooms, num_objects = 200, 100
+        rng = np.random.default_rng(0)
+        rooms = []
+        for room_index in range(num_rooms):
+            objects = chelmnts.Objects()
+            # Some rooms without objects
+            for i in range(num_objects if room_index % 10 else 0):
+                features = chelmnts.ObjectFeatures()
+                features += [f'{v:.6f}' for v in rng.uniform(0, 1, 32)]
+                objects.append(chelmnts.Object(room_index * num_objects + i, 'chair_0',
+                                               11, 'chair', str(room_index), features))
+            rooms.append(chelmnts.Room(str(room_index), 'room', 1, 'bedroom',
+                                       room_index // 10, objects,
+                                       chelmnts.ObjectRelations(),
+                                       chelmnts.Observations()))
+
+        t0 = time.perf_counter()
+        object_features = chelmnts.FeatureMatrix.from_rooms(rooms, 'objects', 'features',
+                                                            chelmnts.ObjectFeatures)
+        t_build = time.perf_counter() - t0
+        room = object_features.get_room(1)
+        self.assertTrue(np.shares_memory(room.values, object_features.values))
+        self.assertTrue(np.all(room.ids == [obj.id for obj in rooms[1].objects]))
+        self.assertTrue(np.all(object_features.home_index == object_features.room_index // 10))
+
+        def before():
+            means = []
+            for room in rooms:
+                if room.objects:
+                    means.append([sum(float(obj.features[i]) for obj in room.objects) /
+                                  len(room.objects)
+                                  for i in range(32)])
+                else:
+                    means.append([float('nan')] * 32)
+            return np.array(means)
+
+        def after():
+            return object_features.get_room_means()
+
+        self.assertTrue(np.allclose(before(), after(), equal_nan=True, atol=1e-5))
+        t_before = per_call(before, repeat=3)
+        t_after = per_call(after, repeat=100)
+        rh.logger.info("{} objects, matrix built in {:.1f} ms, per room means: "
+                       "strings {:.1f} ms, float32 matrix {:.3f} ms ({:.0f}x)",
+                       len(object_features), t_build * 1e3, t_before / 1e3,
+                       t_after / 1e3, t_before / t_after)
+
+    def test_dataset_snapshots(self):
+        """
+        Loading a characterized elements unit: parsing the plain text files
+        (before) versus loading its binary snapshot (after), and snapshot
+        invalidation when a file changes
+        """
+        from robotathome.dataset import Dataset
+
+        with tempfile.TemporaryDirectory() as tmp_path:
+            unit_path = os.path.join(tmp_path, 'Robot@Home-dataset_characterized-elements')
+            write_chelmnts_unit(unit_path)
+
+            def load():
+                unit = Dataset.DatasetUnitCharacterizedElements('chelmnts', unit_path)
+                unit.snapshot_path = os.path.join(tmp_path, 'snapshots')
+                t0 = time.perf_counter()
+                unit.load_data()
+                return unit, time.perf_counter() - t0
+
+            parsed_unit, t_parse = load()
+            snapshot_unit, t_snapshot = load()
+            self.assertTrue(np.array_equal(parsed_unit.object_features.values,
+                                           snapshot_unit.object_features.values))
+            self.assertEqual(str(parsed_unit.home_sessions), str(snapshot_unit.home_sessions))
+            # Every loaded attribute is restored, including the ones that
+            # already exist before _load_function runs
+            for name in Dataset.DatasetUnitCharacterizedElements._loaded_attributes:
+                self.assertTrue(hasattr(snapshot_unit, name))
+            rh.logger.info("{} objects, parse: {:.0f} ms, snapshot: {:.0f} ms ({:.1f}x)",
+                           len(parsed_unit.object_features), t_parse * 1e3,
+                           t_snapshot * 1e3, t_parse / t_snapshot)
+
+            # Any change of size or modification time invalidates the snapshot
+            fingerprint = snapshot_unit.get_fingerprint()
+            os.utime(os.path.join(unit_path, 'types.txt'), ns=(0, 0))
+            self.assertNotEqual(snapshot_unit.get_fingerprint(), fingerprint)
+            self.assertFalse(snapshot_unit.load_snapshot(snapshot_unit.get_fingerprint()))
+
+    def test_lazy_home_sessions(self):
+        """
+        Loading a raw data unit and using a single room: every room file
+        parsed up front (before) versus rooms parsed on first access (after)
+        """
+        from robotathome.dataset import Dataset
+
+        num_homes, num_rooms, num_observations = 10, 8, 2000
+        with tempfile.TemporaryDirectory() as tmp_path:
+            unit_path = os.path.join(tmp_path, 'Robot@Home-dataset_raw_data-plain_text-all')
+            for home_index in range(num_homes):
+                home_session_path = os.path.join(unit_path, f'home{home_index}-s1',
+                                                 f'home{home_index}-s1')
+                for room_index in range(num_rooms):
+                    os.makedirs(os.path.join(home_session_path, f'room{room_index}'))
+                    with open(os.path.join(home_session_path, f'room{room_index}.txt'),
+                              'w') as file_handler:
+                        file_handler.write("# [Observation_id] [sensor_label] ...\n")
+                        file_handler.writelines(
+                            f"{i} RGBD_{i % 4 + 1} 0.1 0.2 1.0 0.5 0.0 0.0 {1000000 + i}\n"
+                            for i in range(num_observations))
+
+            def load(eager):
+                unit = Dataset.DatasetUnitRawData('Raw data', unit_path)
+                tracemalloc.start()
+                t0 = time.perf_counter()
+                unit._load_function()
+                if eager:
+                    for home_session in unit.home_sessions:
+                        for room in home_session.rooms:
+                            room.sensor_observations
+                room = unit.home_sessions.as_dict_name()['home3-s1'].rooms.as_dict_name()['room2']
+                num_sensors = len(room.sensor_observations)
+                elapsed = time.perf_counter() - t0
+                size, _ = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                num_loaded = sum(room.is_loaded()
+                                 for home_session in unit.home_sessions
+                                 for room in home_session.rooms)
+                return num_sensors, num_loaded, elapsed, size
+
+            eager_sensors, eager_loaded, t_eager, eager_size = load(True)
+            lazy_sensors, lazy_loaded, t_lazy, lazy_size = load(False)
+            self.assertEqual(eager_sensors, lazy_sensors)
+            self.assertEqual(eager_loaded, num_homes * num_rooms)
+            self.assertEqual(lazy_loaded, 1)
+            # Name lookups reuse the index built by the first one
+            unit = Dataset.DatasetUnitRawData('Raw data', unit_path)
+            unit._load_function()
+            self.assertIs(unit.home_sessions.as_dict_name(),
+                          unit.home_sessions.as_dict_name())
+            rh.logger.info("{} rooms, one used: all parsed {:.0f} ms, {:.1f} MiB; "
+                           "lazy {:.1f} ms, {:.2f} MiB",
+                           num_homes * num_rooms, t_eager * 1e3, eager_size / 1024**2,
+                           t_lazy * 1e3, lazy_size / 1024**2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+__author__ = "Gregorio Ambrosio"
+__contact__ = "gambrosio[at]uma.es"
+__copyright__ = "Copyright 2021, 2026, Gregorio Ambrosio"
+__date__ = "2026/10/17"
+__license__ = "MIT"
+
+import unittest
+import os
+import sys
+import subprocess
+
+# Seconds allowed for a cold `import robotathome` (best of IMPORT_RUNS)
+IMPORT_TIME_BUDGET = 1.0
+IMPORT_RUNS = 3
+# Modules that must not be imported until they are really used
+HEAVY_MODULES = ['cv2', 'pandas', 'matplotlib', 'mxnet', 'gluoncv']
+
+IMPORT_SCRIPT = """
+import sys
+import time
+t0 = time.perf_counter()
+import robotathome
+print(time.perf_counter() - t0)
+print(' '.join(m for m in {} if m in sys.modules))
+""".format(HEAVY_MODULES)
+
+
+class Test(unittest.TestCase):
+    ''' Import time benchmark for the robotathome package '''
+
+    def import_robotathome(self):
+        """
+        Imports robotathome in a fresh interpreter and returns the elapsed
+        time and the list of heavy modules found in sys.modules
+        """
+        root_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        out = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT],
+                             cwd=root_path,
+                             check=True,
+                             capture_output=True,
+                             text=True).stdout.splitlines()
+        elapsed = float(out[0])
+        loaded = out[1].split() if len(out) > 1 else []
+        return elapsed, loaded
+
+    def test_import_time(self):
+        """
+        Testing that `import robotathome` fits in IMPORT_TIME_BUDGET
+        """
+        timings = []
+        for _ in range(IMPORT_RUNS):
+            elapsed, _ = self.import_robotathome()
+            timings.append(elapsed)
+        print("\nimport robotathome: best {:.3f} s, worst {:.3f} s (budget {:.3f} s)".format(
+            min(timings), max(timings), IMPORT_TIME_BUDGET))
+        self.assertLess(min(timings), IMPORT_TIME_BUDGET)
+
+    def test_heavy_modules_are_lazy(self):
+        """
+        Testing that vision, detection and plotting backends are not
+        imported by `import robotathome`
+        """
+        _, loaded = self.import_robotathome()
+        self.assertListEqual(loaded, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -10,8 +10,10 @@ __license__ = "MIT"
 import unittest
 import os
 import sys
+import tempfile
 import robotathome as rh
 import numpy as np
+import pandas as pd
 # from matplotlib import pyplot as plt
 import matplotlib.patches as mpatches
 import matplotlib.pyplot as plt
@@ -257,6 +259,31 @@ class Test(unittest.TestCase):
         self.assertEqual(len(rows), 355)
         rh.logger.debug("Number of returned rows: {}", len(rows))
 
+    def test_get_sensor_observation_files_fast_path(self):
+        """
+        Testing of get_sensor_observation_files and get_labels_from_lblrgbd
+        without DataFrames (parameter bound fast path)
+        """
+        rh.logger.trace("*** Testing of RobotAtHome.get_sensor_observation_files(df=False)")
+        rows = self.rh_obj.get_sensor_observation_files('lblrgbd',
+                                                        'anto-s1',
+                                                        0,
+                                                        'anto_livingroom1',
+                                                        'RGBD_2',
+                                                        df=False)
+        df_rows = self.rh_obj.get_sensor_observation_files('lblrgbd',
+                                                           'anto-s1',
+                                                           0,
+                                                           'anto_livingroom1',
+                                                           'RGBD_2')
+        self.assertEqual(len(rows), 355)
+        self.assertListEqual(rows['id'].tolist(), df_rows['id'].tolist())
+        self.assertListEqual(rows['f2'].tolist(), df_rows['f2'].tolist())
+
+        labels = self.rh_obj.get_labels_from_lblrgbd(100000, df=False)
+        self.assertEqual(len(labels), 11)
+        self.assertEqual(len(labels[0]), 5)
+
     def test_get_video_from_rgbd(self):
         """
         Testing get_video_from_rgbd
@@ -296,6 +323,115 @@ class Test(unittest.TestCase):
         rh.logger.debug("Video file name: {}", video_file_name)
         rh.logger.debug("Video file size: {}", video_file_size)
 
+    def test_get_synced_sensor_observations(self):
+        """
+        Testing get_synced_sensor_observations
+        """
+        rh.logger.trace("*** Testing of RobotAtHome.get_synced_sensor_observations()")
+        rh.logger.info("Synchronizing the four RGBD sensors of a room by time stamp")
+        tolerance = 0.1
+        ids, t = self.rh_obj.get_synced_sensor_observations('anto-s1',
+                                                            0,
+                                                            'anto_livingroom1',
+                                                            tolerance=tolerance)
+        self.assertEqual(ids.shape, (len(t), 4))
+        for s, sensor_name in enumerate(['RGBD_1', 'RGBD_2', 'RGBD_3', 'RGBD_4']):
+            rows = self.rh_obj.get_sensor_observation_files('lblrgbd',
+                                                            'anto-s1',
+                                                            0,
+                                                            'anto_livingroom1',
+                                                            sensor_name,
+                                                            df=False)
+            t_s = rows['t'][np.searchsorted(rows['id'], ids[:, s])]
+            self.assertTrue(np.all(np.abs(t_s - t) <= tolerance * 10**7))
+
+        self.assertListEqual(
+            rh.sync_time_stamps([0, 10, 20, 30], [[1, 12, 40], [-2, 9, 21, 29]], 3).tolist(),
+            [[0, 0, 0], [1, 1, 1]])
+
+    def test_iter_frames(self):
+        """
+        Testing iter_frames
+        """
+        rh.logger.trace("*** Testing of RobotAtHome.iter_frames()")
+        rh.logger.info("Iterating over the prefetched frames of a sequence")
+        rows = self.rh_obj.get_sensor_observation_files('lblrgbd',
+                                                        'anto-s1',
+                                                        0,
+                                                        'anto_livingroom1',
+                                                        'RGBD_2',
+                                                        df=False)
+        frames = list(self.rh_obj.iter_frames('lblrgbd',
+                                              'anto-s1',
+                                              0,
+                                              'anto_livingroom1',
+                                              'RGBD_2',
+                                              num_workers=4,
+                                              prefetch=4))
+        self.assertListEqual([so_id for so_id, _ in frames], rows['id'].tolist())
+        so_id, frame = frames[0]
+        self.assertTrue(np.array_equal(frame['rgb'],
+                                       self.rh_obj.get_rgb_image_from_lblrgbd(so_id)))
+        self.assertTrue(np.array_equal(frame['depth'],
+                                       self.rh_obj.get_depth_image_from_lblrgbd(so_id)))
+        self.assertTrue(np.array_equal(frame['mask'],
+                                       self.rh_obj.get_mask_from_lblrgbd(so_id)))
+
+    def test_frame_cache(self):
+        """
+        Testing the decoded frame cache
+        """
+        rh.logger.trace("*** Testing of the RobotAtHome decoded frame cache")
+        so_id = 100000
+        self.assertIsNone(self.rh_obj.get_frame_cache_stats())
+        bgr_img = self.rh_obj.get_rgb_image_from_lblrgbd(so_id)
+
+        # Budget for just one rgb image
+        self.rh_obj.set_frame_cache_size(bgr_img.nbytes)
+        for _ in range(3):
+            cached_img = self.rh_obj.get_rgb_image_from_lblrgbd(so_id)
+            self.assertTrue(np.array_equal(cached_img, bgr_img))
+            cached_img[:] = 0  # returned images are copies
+        stats = self.rh_obj.get_frame_cache_stats()
+        rh.logger.debug("frame cache stats: {}", stats)
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions']),
+                         (2, 1, 0))
+
+        self.rh_obj.get_rgb_image_from_lblrgbd(so_id + 1)
+        stats = self.rh_obj.get_frame_cache_stats()
+        self.assertEqual((stats['items'], stats['evictions']), (1, 1))
+        self.assertLessEqual(stats['bytes'], stats['max_bytes'])
+
+        self.rh_obj.clear_frame_cache()
+        self.assertEqual(self.rh_obj.get_frame_cache_stats()['items'], 0)
+        self.rh_obj.set_frame_cache_size(0)
+        self.assertIsNone(self.rh_obj.get_frame_cache_stats())
+
+    def test_mask_cache(self):
+        """
+        Testing the binary label mask cache
+        """
+        rh.logger.trace("*** Testing of the RobotAtHome binary label mask cache")
+        so_id = 100000
+        parsed_mask = self.rh_obj.get_mask_from_lblrgbd(so_id)
+        self.assertEqual(parsed_mask.dtype, np.int64)
+
+        rh_cached = rh.RobotAtHome(self.rh_path, self.wspc_path, mask_cache=True)
+        rh_cached.create_mask_cache()
+        label_file_name = rh_cached.get_lblrgbd_file_names([so_id], 'labels')[0]
+        label_stat = os.stat(label_file_name)
+        mask_file_name = os.path.join(self.wspc_path,
+                                      'rh_cache',
+                                      'masks',
+                                      '{}_labels.{}_{}.npy'.format(so_id,
+                                                                   label_stat.st_size,
+                                                                   label_stat.st_mtime_ns))
+        self.assertTrue(os.path.isfile(mask_file_name))
+        cached_mask = rh_cached.get_mask_from_lblrgbd(so_id)
+        self.assertEqual(cached_mask.dtype, np.int64)
+        self.assertTrue(np.array_equal(cached_mask, parsed_mask))
+        self.assertEqual(rh_cached.create_mask_cache(), 0)
+
     def test_get_labels_from_lblrgbd(self):
         """
         Testing of get_labels_from_lblrgbd
@@ -341,6 +477,30 @@ class Test(unittest.TestCase):
         plt.imshow(img[0], cmap='Greys_r', interpolation='nearest')
         plt.show()
 
+    def test_get_label_masks(self):
+        """
+        Testing of get_label_masks
+        """
+        rh.logger.trace("*** Testing of RobotAtHome.get_label_masks()")
+        rh.logger.info("Getting all the label masks of a sensor observation at once")
+        mask = self.rh_obj.get_mask_from_lblrgbd(100000)
+        labels = [label[1] for label in self.rh_obj.get_labels_from_lblrgbd(100000, df=False)]
+        label_masks, stats = self.rh_obj.get_label_masks(mask, labels)
+        self.assertEqual(label_masks.shape, (len(labels), 320, 240))
+        for i, img in enumerate(self.rh_obj.get_label_mask(mask, labels)):
+            self.assertTrue(np.array_equal(img, label_masks[i]))
+            ys, xs = np.nonzero(img)
+            self.assertEqual(stats['count'][i], len(xs))
+            if len(xs):
+                self.assertListEqual(stats['bbox'][i].tolist(),
+                                     [xs.min(), ys.min(), xs.max(), ys.max()])
+                self.assertTrue(np.allclose(stats['centroid'][i],
+                                            [xs.mean(), ys.mean()]))
+        packed_masks, _ = self.rh_obj.get_label_masks(mask, labels, packed=True)
+        self.assertTrue(np.array_equal(
+            np.unpackbits(packed_masks, axis=-1, count=240).astype(bool),
+            label_masks))
+
     def test_get_rgb_image_from_lblrgbd(self):
         """
         Testing of get_rgb_image_from_lblrgbd
@@ -385,6 +545,113 @@ class Test(unittest.TestCase):
             cv2.waitKey(0)
             cv2.destroyAllWindows()
 
+    def test_get_depth_from_lblrgbd(self):
+        """
+        Testing of get_depth_from_lblrgbd and get_depths_from_lblrgbd
+        """
+        rh.logger.trace("*** Testing of RobotAtHome.get_depth_from_lblrgbd()")
+        rh.logger.info("Getting native and metric depth from labelled rgbd image set")
+        img = self.rh_obj.get_depth_image_from_lblrgbd(100000)
+        depth = self.rh_obj.get_depth_from_lblrgbd(100000)
+        self.assertEqual(depth.dtype, np.uint16)
+        self.assertTrue(np.array_equal(depth, img))
+
+        out = np.empty(depth.shape, dtype=np.float32)
+        metric_depth = self.rh_obj.get_depth_from_lblrgbd(100000, metric=True, out=out)
+        self.assertIs(metric_depth, out)
+        self.assertTrue(np.allclose(metric_depth, img * self.rh_obj.DEPTH_SCALE_8BIT))
+
+        ids = [100000, 100001, 100002]
+        depths = self.rh_obj.get_depths_from_lblrgbd(ids, metric=True)
+        self.assertEqual(depths.shape, (len(ids),) + depth.shape)
+        self.assertTrue(np.array_equal(depths[0], metric_depth))
+
+        depths = self.rh_obj.get_depths_from_lblrgbd([])
+        self.assertEqual(depths.shape, (0,) + depth.shape)
+        self.assertEqual(depths.dtype, np.uint16)
+
+    def test_get_point_cloud(self):
+        """
+        Testing of get_point_cloud and get_point_clouds
+        """
+        rh.logger.trace("*** Testing of RobotAtHome.get_point_cloud()")
+        rh.logger.info("Back-projecting a depth image to a world frame point cloud")
+        depth = self.rh_obj.get_depth_from_lblrgbd(100000, metric=True)
+        point_cloud = self.rh_obj.get_point_cloud(100000)
+        self.assertEqual(point_cloud.dtype, np.float32)
+        self.assertEqual(point_cloud.shape, (np.count_nonzero(depth), 3))
+
+        # The distance to the sensor position is at least the depth
+        _, translations = self.rh_obj.get_sensor_poses([100000])
+        distances = np.linalg.norm(point_cloud - translations[0], axis=1)
+        self.assertTrue(np.all(distances >= depth[depth > 0] - 1e-4))
+
+        ids = [100000, 100001]
+        point_clouds = self.rh_obj.get_point_clouds(ids, rgb=True, labels=True)
+        self.assertEqual(len(point_clouds), len(ids))
+        self.assertEqual(point_clouds[0].shape, (len(point_cloud), 7))
+        self.assertTrue(np.allclose(point_clouds[0][:, 0:3], point_cloud))
+        labels = [label[1] for label in self.rh_obj.get_labels_from_lblrgbd(100000, df=False)]
+        self.assertTrue(set(np.unique(point_clouds[0][:, 6])) <= set(labels + [-1]))
+
+    def test_get_room_point_cloud(self):
+        """
+        Testing of get_room_point_cloud
+        """
+        rh.logger.trace("*** Testing of RobotAtHome.get_room_point_cloud()")
+        rh.logger.info("Fusing the four RGBD sensors of a room into a voxel grid")
+        voxel_size = 0.1
+        room_point_cloud, votes = self.rh_obj.get_room_point_cloud('anto-s1',
+                                                                   0,
+                                                                   'anto_livingroom1',
+                                                                   voxel_size=voxel_size,
+                                                                   return_votes=True)
+        rh.logger.debug("Room point cloud shape: {}", room_point_cloud.shape)
+        self.assertEqual(room_point_cloud.dtype, np.float32)
+        self.assertEqual(room_point_cloud.shape[1], 7)
+        # One point per voxel
+        voxels = np.floor(room_point_cloud[:, 0:3] / voxel_size).astype(np.int64)
+        self.assertEqual(len(np.unique(voxels, axis=0)), len(room_point_cloud))
+        # The label of a voxel is its most voted object type
+        voxel, object_type_id, _ = votes[np.argmax(votes[:, 2])]
+        self.assertEqual(room_point_cloud[voxel, 6], object_type_id)
+
+    def test_get_room_point_cloud_missing_labels(self):
+        """
+        Testing of get_room_point_cloud with mask bits without a label row
+        """
+        rh.logger.trace("*** Testing of RobotAtHome.get_room_point_cloud() with missing labels")
+        rh.logger.info("Fusing a room whose masks have bits without a label row")
+        rh_obj = rh.RobotAtHome(self.rh_path, self.wspc_path)
+        con = rh_obj.get_con()
+        ids = [row[0] for row in con.execute(
+            """
+            select id from rh_temp_lblrgbd
+            where hs_name = 'anto-s1' and hss_id = 0 and r_name = 'anto_livingroom1'
+            order by id
+            """)]
+        # A temporary table shadows the labels table in this connection. It
+        # lacks the highest local id of every frame and every label of the
+        # first one
+        con.execute(
+            """
+            create temp table rh_lblrgbd_labels as
+            select * from main.rh_lblrgbd_labels as l
+            where l.sensor_observation_id != ?
+              and l.local_id < (select max(m.local_id)
+                                from main.rh_lblrgbd_labels as m
+                                where m.sensor_observation_id = l.sensor_observation_id)
+            """, (ids[0],))
+        room_point_cloud = rh_obj.get_room_point_cloud('anto-s1',
+                                                       0,
+                                                       'anto_livingroom1',
+                                                       voxel_size=0.1)
+        object_type_ids = [row[0] for row in con.execute(
+            "select object_type_id from rh_lblrgbd_labels")]
+        self.assertTrue(np.isin(room_point_cloud[:, 6], object_type_ids + [-1]).all())
+        self.assertTrue((room_point_cloud[:, 6] == -1).any())
+        con.close()
+
     def test_lblrgbd_rgb_image_object_detection(self):
         """
         Testing of lblrgbd_rgb_image_object_detection
@@ -413,6 +680,30 @@ class Test(unittest.TestCase):
                                     )
             plt.show()
 
+    def test_detection_model_registry(self):
+        """
+        Testing that detection networks are loaded once per (model, ctx)
+        """
+        rh.logger.trace("*** Testing of the detection model registry")
+        rh.logger.info("Reusing detection networks across calls")
+        model = 'yolo3_darknet53_coco'
+        rh.evict_detection_models()
+        net = rh.get_detection_model(model)
+        self.assertIs(rh.get_detection_model(model), net)
+        self.assertListEqual(rh.MODEL_REGISTRY.keys(), [(model, 'cpu(0)')])
+
+        # Object detection calls reuse the registered network
+        misses = rh.MODEL_REGISTRY.stats()['misses']
+        for so_id in [100000, 100001]:
+            self.rh_obj.lblrgbd_rgb_image_object_detection(so_id, model)
+        self.assertEqual(rh.MODEL_REGISTRY.stats()['misses'], misses)
+
+        self.assertEqual(rh.evict_detection_models(model), 1)
+        self.assertEqual(len(rh.MODEL_REGISTRY), 0)
+        self.assertIsNot(rh.get_detection_model(model), net)
+        with self.assertRaises(Exception):
+            rh.get_detection_model('not_a_model')
+
     def test_lblrgbd_object_detection(self):
         """
         Testing lblrgbd_object_detection
@@ -428,12 +719,117 @@ class Test(unittest.TestCase):
             model='faster_rcnn_resnet50_v1b_coco',
             # gpu=True
         )
-        self.assertTupleEqual(detections.shape, (355, 3))
+        # Long format: a row per detected object
+        self.assertListEqual(list(detections.columns),
+                             ['frame_id', 'class_id', 'score', 'xmin', 'ymin', 'xmax', 'ymax'])
+        self.assertLessEqual(detections['frame_id'].nunique(), 355)
+        self.assertTrue((detections['class_id'] >= 0).all())
         video_file_size = os.path.getsize(
             os.path.join(self.wspc_path, video_file_name)
         )
         self.assertGreater(video_file_size, 7489000)
 
+    def test_lblrgbd_batched_object_detection(self):
+        """
+        Testing the headless batched mode of lblrgbd_object_detection
+        """
+        rh.logger.trace("*** Testing of RobotAtHome.lblrgbd_object_detection(batch_size)")
+        rh.logger.info("Batched object detection without video rendering")
+        locator = ('lblrgbd', 'anto-s1', 0, 'anto_livingroom1', 'RGBD_2')
+        detections, video_file_name = self.rh_obj.lblrgbd_object_detection(
+            *locator,
+            batch_size=8,
+            num_threads=2,
+            render_video=False,
+            thresh=0.2
+        )
+        self.assertIsNone(video_file_name)
+        self.assertTrue((detections['score'] >= 0.2).all())
+
+        # Same detections as one frame per forward pass
+        one_by_one, _ = self.rh_obj.lblrgbd_object_detection(*locator,
+                                                             render_video=False,
+                                                             thresh=0.2)
+        self.assertEqual(len(detections), len(one_by_one))
+        self.assertTrue(np.array_equal(detections['frame_id'], one_by_one['frame_id']))
+        self.assertTrue(np.allclose(detections['score'], one_by_one['score'], atol=1e-4))
+
+    def test_store_object_detections(self):
+        """
+        Testing store_object_detections and get_object_detections
+        """
+        rh.logger.trace("*** Testing of RobotAtHome.store_object_detections()")
+        rh.logger.info("Storing object detections in the results database")
+        model = 'yolo3_darknet53_coco'
+        rows = self.rh_obj.get_sensor_observation_files('lblrgbd',
+                                                        'anto-s1',
+                                                        0,
+                                                        'anto_livingroom1',
+                                                        'RGBD_2',
+                                                        df=False)
+        ids = rows['id'][:20]
+        # A fresh results database, the workspace one is left untouched
+        with tempfile.TemporaryDirectory() as results_path:
+            rh_obj = rh.RobotAtHome(self.rh_path,
+                                    self.wspc_path,
+                                    results_db_filename=os.path.join(results_path,
+                                                                     'rh_results.db'))
+            rh_obj.store_object_detections(ids[:10], model)
+            processed = rh_obj.store_object_detections(ids, model)
+            # Only the missing observations are processed
+            self.assertEqual(processed, 10)
+            self.assertEqual(rh_obj.store_object_detections(ids, model), 0)
+
+            detections = rh_obj.get_object_detections(ids, model)
+            self.assertListEqual(list(detections.columns),
+                                 ['frame_id', 'class_id', 'score', 'xmin', 'ymin', 'xmax', 'ymax'])
+            self.assertTrue(set(detections['frame_id']) <= set(ids.tolist()))
+            self.assertTrue((detections['class_id'] >= 0).all())
+            self.assertTrue(detections.equals(
+                rh_obj.get_object_detections(model=model)
+                .query('frame_id in @ids').reset_index(drop=True)))
+
+            # Same detections as lblrgbd_rgb_image_object_detection
+            _, _, _, nn_out = rh_obj.lblrgbd_rgb_image_object_detection(ids[0], model)
+            scores = nn_out[1].asnumpy()[0, :, 0]
+            self.assertTrue(np.allclose(np.sort(detections[detections['frame_id'] == ids[0]]['score']),
+                                        np.sort(scores[scores >= 0]),
+                                        atol=1e-4))
+            rh_obj.get_con().close()
+
+    def test_evaluate_object_detections(self):
+        """
+        Testing get_ground_truth_boxes and evaluate_object_detections
+        """
+        rh.logger.trace("*** Testing of RobotAtHome.evaluate_object_detections()")
+        rh.logger.info("Evaluating object detections against the lblrgbd labels")
+        ids = [100000, 100001, 100002]
+        ground_truth = self.rh_obj.get_ground_truth_boxes(ids)
+        self.assertTrue(set(ground_truth['frame_id']) <= set(ids))
+        # Boxes are the bounding boxes of the label masks
+        row = ground_truth.iloc[0]
+        mask = self.rh_obj.get_mask_from_lblrgbd(row['frame_id'])
+        labels = self.rh_obj.get_labels_from_lblrgbd(row['frame_id'])
+        local_id = labels[labels['object_type_id'] == row['object_type_id']]['local_id'].iloc[0]
+        _, stats = self.rh_obj.get_label_masks(mask, [local_id])
+        self.assertListEqual((stats['bbox'][0] + [0, 0, 1, 1]).tolist(),
+                             row[['xmin', 'ymin', 'xmax', 'ymax']].tolist())
+
+        # Perfect detections
+        detections = ground_truth.drop(columns='object_type_id')
+        detections.insert(2, 'score', 1.0)
+        df_ap = self.rh_obj.evaluate_object_detections(detections, ids)
+        self.assertTrue(np.allclose(df_ap['ap'], 1.0))
+        self.assertTrue(np.allclose(df_ap['recall'], 1.0))
+
+        # False positives with higher scores halve the average precision
+        false_positives = detections.copy()
+        false_positives[['xmin', 'xmax']] += 1000
+        false_positives['score'] = 2.0
+        df_ap = self.rh_obj.evaluate_object_detections(pd.concat([detections, false_positives]), ids)
+        self.assertTrue(np.allclose(df_ap['ap'], 0.5))
+        self.assertTrue(np.allclose(df_ap['precision'], 0.5))
+
     def test_lblrgbd_plot_labels(self):
         """
         Testing lblrgbd_plot_labels